@@ -0,0 +1,246 @@
+import datetime
+import threading
+import time
+
+import numpy as np
+
+COLUMNS = (
+    ('book_id', np.int64),
+    ('category_id', np.int32),
+    ('quantity', np.int64),  # Negative for reversals of failed or cancelled orders
+    ('unit_price_cents', np.int64),
+    ('timestamp', np.int64),  # Seconds since the epoch
+    ('day', np.int32),  # Proleptic Gregorian ordinal of the order date
+)
+GROUPS = ('day', 'category', 'book')
+DENSE_GROUPS_LIMIT = 1 << 22  # Up to this many possible groups, group with bincount instead of sorting
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+class SalesLedger:
+    """
+    Append-only columnar store of order lines with incremental rollups.
+
+    Each order line is one row across NumPy column arrays that grow by
+    doubling, so appends are amortized O(1) and scans run vectorized over
+    contiguous memory. Revenue and units per day, per category and per day
+    and category are kept up to date as lines are appended, so the common
+    reports are dictionary reads. Other queries (date ranges, one category,
+    per-book) are answered by a masked scan of the columns.
+
+    The ledger is append-only: an order that fails payment or is cancelled
+    is reversed by appending its lines again with negative quantities, which
+    keeps the rollups correct without rewriting history. Reversal rows count
+    as -1 line, so line counts are net like revenue and units.
+
+    Methods:
+        record_order(order, reverse=False): Append an order's lines.
+        append(book_ids, categories, quantities, unit_prices_cents, timestamps): Append many lines at once.
+        rollup(group_by): Return maintained totals grouped by 'day', 'category' or both.
+        query(group_by, start=None, end=None, category=None): Scan the columns and aggregate.
+    """
+
+    def __init__(self, capacity=1024):
+        self._columns = {name: np.zeros(capacity, dtype) for name, dtype in COLUMNS}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._category_ids = {}  # category name -> id
+        self.categories = []  # id -> category name
+        # Rollups: key -> [revenue cents, units, lines]
+        self._by_day = {}
+        self._by_category = {}
+        self._by_day_category = {}
+
+    def __len__(self):
+        return self._size
+
+    def _category_id(self, category):
+        category_id = self._category_ids.get(category)
+        if category_id is None:
+            category_id = self._category_ids[category] = len(self.categories)
+            self.categories.append(category)
+        return category_id
+
+    def record_order(self, order, reverse=False):
+        """Append one line per order item, negated when reversing the order"""
+        sign = -1 if reverse else 1
+        timestamp = int(order.order_date.timestamp())
+        with self._lock:
+            for item in order.items:
+                self._append_locked(item.book.book_id, self._category_id(item.book.category),
+                                    sign * item.quantity, item.unit_price_cents, timestamp, order.order_date.toordinal())
+
+    def append(self, book_ids, categories, quantities, unit_prices_cents, timestamps):
+        """Append many lines from parallel sequences, e.g. when loading history"""
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        day_column = _days(timestamps)
+        with self._lock:
+            category_ids = np.array([self._category_id(category) for category in categories], dtype=np.int32)
+            count = len(category_ids)
+            self._reserve(count)
+            start, end = self._size, self._size + count
+            values = {
+                'book_id': book_ids, 'category_id': category_ids, 'quantity': quantities,
+                'unit_price_cents': unit_prices_cents, 'timestamp': timestamps, 'day': day_column
+            }
+            for name, column in values.items():
+                self._columns[name][start:end] = column
+            self._size = end
+            self._roll_up_range(start, end)
+
+    def _append_locked(self, book_id, category_id, quantity, unit_price_cents, timestamp, day):
+        self._reserve(1)
+        row = self._size
+        columns = self._columns
+        columns['book_id'][row] = book_id
+        columns['category_id'][row] = category_id
+        columns['quantity'][row] = quantity
+        columns['unit_price_cents'][row] = unit_price_cents
+        columns['timestamp'][row] = timestamp
+        columns['day'][row] = day
+        self._size += 1
+        revenue = quantity * unit_price_cents
+        for rollup, key in ((self._by_day, day), (self._by_category, category_id),
+                            (self._by_day_category, (day, category_id))):
+            totals = rollup.get(key)
+            if totals is None:
+                totals = rollup[key] = [0, 0, 0]
+            totals[0] += revenue
+            totals[1] += quantity
+            totals[2] += 1 if quantity >= 0 else -1
+
+    def _roll_up_range(self, start, end):
+        """Fold rows start:end into the rollups with one vectorized group-by per rollup"""
+        view = self._view(start, end)
+        for group_by, rollup in ((('day',), self._by_day), (('category',), self._by_category),
+                                 (('day', 'category'), self._by_day_category)):
+            for key, revenue, units, lines in _aggregate(view, group_by):
+                key = key[0] if len(key) == 1 else key
+                totals = rollup.setdefault(key, [0, 0, 0])
+                totals[0] += revenue
+                totals[1] += units
+                totals[2] += lines
+
+    def _reserve(self, count):
+        needed = self._size + count
+        capacity = len(self._columns['book_id'])
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name, column in self._columns.items():
+            grown = np.zeros(capacity, column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+
+    def _view(self, start=0, end=None):
+        end = self._size if end is None else end
+        return {name: column[start:end] for name, column in self._columns.items()}
+
+    def rollup(self, group_by=('day', 'category')):
+        """Return maintained totals as report rows, without scanning the columns"""
+        group_by = tuple(group_by)
+        rollups = {('day',): self._by_day, ('category',): self._by_category,
+                   ('day', 'category'): self._by_day_category}
+        if group_by not in rollups:
+            raise ValueError(f'No rollup is maintained for {group_by}; use query()')
+        with self._lock:
+            items = sorted((key if isinstance(key, tuple) else (key,), list(totals))
+                           for key, totals in rollups[group_by].items())
+        return [self._row(group_by, key, *totals) for key, totals in items]
+
+    def query(self, group_by=('day', 'category'), start=None, end=None, category=None):
+        """
+        Aggregate revenue, units and lines with a vectorized scan.
+
+        start and end are inclusive dates, category is a category name, and
+        group_by is any combination of 'day', 'category' and 'book'.
+        """
+        group_by = tuple(group_by)
+        unknown = set(group_by) - set(GROUPS)
+        if unknown:
+            raise ValueError(f"Unknown group: {', '.join(sorted(unknown))}")
+        with self._lock:
+            view = self._view()  # Views stay valid if the columns are later regrown
+            category_id = self._category_ids.get(category, -1) if category is not None else None
+        mask = np.ones(len(view['day']), dtype=bool)
+        if start is not None:
+            mask &= view['day'] >= start.toordinal()
+        if end is not None:
+            mask &= view['day'] <= end.toordinal()
+        if category_id is not None:
+            mask &= view['category_id'] == category_id
+        if not mask.all():
+            view = {name: column[mask] for name, column in view.items()}
+        return [self._row(group_by, key, revenue, units, lines)
+                for key, revenue, units, lines in _aggregate(view, group_by)]
+
+    def _row(self, group_by, key, revenue_cents, units, lines):
+        row = {}
+        for name, value in zip(group_by, key):
+            if name == 'day':
+                row['day'] = datetime.date.fromordinal(int(value)).isoformat()
+            elif name == 'category':
+                row['category'] = self.categories[int(value)]
+            else:
+                row['book_id'] = int(value)
+        row.update(revenue=int(revenue_cents) / 100, units=int(units), lines=int(lines))
+        return row
+
+
+def _days(timestamps):
+    """Map epoch seconds to local date ordinals, looking up the UTC offset once per distinct hour"""
+    if not len(timestamps):
+        return np.zeros(0, np.int32)
+    hours, inverse = np.unique(timestamps // 3600, return_inverse=True)
+    # The full offset, not just whole hours, so zones like UTC+5:30 change date at their own midnight
+    offsets = np.array([time.localtime(int(hour) * 3600).tm_gmtoff for hour in hours], np.int64)
+    return ((timestamps + offsets[inverse]) // 86400 + EPOCH_ORDINAL).astype(np.int32)
+
+
+def _aggregate(view, group_by):
+    """
+    Yield (key tuple, revenue cents, units, net lines) for each group in a column view, in key order.
+
+    The group columns are packed into one integer code per row. When the
+    code space is small, as it is for days and categories, groups are
+    summed with bincount in a single linear pass; otherwise the codes are
+    sorted with unique.
+    """
+    if not len(view['day']):
+        return
+    revenue = view['quantity'].astype(np.int64) * view['unit_price_cents']
+    lines = np.where(view['quantity'] < 0, -1, 1)  # Reversal rows cancel the lines they reverse
+    if not group_by:
+        yield (), int(revenue.sum()), int(view['quantity'].sum()), int(lines.sum())
+        return
+    sources = {'day': view['day'], 'category': view['category_id'], 'book': view['book_id']}
+    codes = np.zeros(len(revenue), np.int64)
+    size = 1
+    decoders = []
+    for name in group_by:
+        column = sources[name].astype(np.int64)
+        low = int(column.min())
+        span = int(column.max()) - low + 1
+        codes = codes * span + (column - low)
+        size *= span
+        decoders.append((low, span))
+    if size <= DENSE_GROUPS_LIMIT:
+        group_codes = np.flatnonzero(np.bincount(codes, minlength=size))
+        revenue_totals = np.bincount(codes, weights=revenue, minlength=size)[group_codes]
+        unit_totals = np.bincount(codes, weights=view['quantity'], minlength=size)[group_codes]
+        line_counts = np.bincount(codes, weights=lines, minlength=size)[group_codes]
+    else:
+        group_codes, inverse = np.unique(codes, return_inverse=True)
+        revenue_totals = np.bincount(inverse, weights=revenue)
+        unit_totals = np.bincount(inverse, weights=view['quantity'])
+        line_counts = np.bincount(inverse, weights=lines)
+    keys = []
+    remaining = group_codes
+    for low, span in reversed(decoders):
+        keys.append(remaining % span + low)
+        remaining = remaining // span
+    keys.reverse()
+    for index in range(len(group_codes)):
+        yield (tuple(int(key[index]) for key in keys), int(round(revenue_totals[index])),
+               int(round(unit_totals[index])), int(round(line_counts[index])))
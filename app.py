@@ -1,28 +1,37 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
-from models import Book, Cart, User, Order, PaymentGateway, EmailService
+from flask import Flask, current_app, render_template, stream_template, request, redirect, url_for, flash, jsonify, session, get_flashed_messages, make_response, send_file, abort, g
+from flask import before_render_template, template_rendered
+from flask.cli import AppGroup
+from markupsafe import Markup
+from werkzeug.local import LocalProxy
+import click
+from models import Book, Catalog, Cart, CartStore, User, UserStore, PasswordHasher, Order, EmailService
+from payments import PaymentExecutor, PaymentQueueFull
+from outbox import EmailOutbox, ConsoleTransport, SMTPTransport, MemoryTransport
+from order_log import OrderLog
+from order_store import OrderStore
+from pricing import PricingEngine
+from caching import FragmentCache
+from static_assets import StaticAssets
+from metrics import MetricsRegistry
+from profiling import RequestProfiler
+from inventory import Inventory
+from catalog_import import import_catalog, save_catalog, source_signature, save_snapshot, load_snapshot
+from analytics import SalesLedger, GROUPS
+from order_export import CONTENT_TYPES, decode_cursor, select_orders, stream_export
+from recommendations import CoPurchaseIndex
+import atexit
+import datetime
+import hashlib
+import mimetypes
 import uuid
 import os
 import re
+import threading
+import time
+from functools import wraps
 TESTING = os.environ.get('TESTING', 'False').lower() == 'true'
-app = Flask(__name__, template_folder='templates')
-app.secret_key = 'your_secret_key'  # Required for session management
-app.config.update(
-    TESTING=TESTING,
-    WTF_CSRF_ENABLED=not TESTING
-)
 
-# Global storage for users and orders (in production, use a database)
-users = {}  # email -> User object
-orders = {}  # order_id -> Order object
-
-# Create demo user for testing
-demo_user = User("demo@bookstore.com", "demo123", "Demo User", "123 Demo Street, Demo City, DC 12345")
-users["demo@bookstore.com"] = demo_user
-
-# Create a cart instance to manage the cart
-cart = Cart()
-
-# Create a global books list to avoid duplication
+# Seed data for the catalog
 BOOKS = [
     Book("The Great Gatsby", "Fiction", 10.99, "/images/books/the_great_gatsby.jpg"),
     Book("1984", "Dystopia", 8.99, "/images/books/1984.jpg"),
@@ -30,10 +39,491 @@ BOOKS = [
     Book("Moby Dick", "Adventure", 12.49, "/images/books/moby_dick.jpg")
 ]
 
+# Request latency, in-flight requests, timing spans and order counters, exported at /metrics
+metrics = MetricsRegistry()
+request_latency = metrics.histogram('request_duration_seconds', 'Request latency by endpoint.', ('endpoint', 'method'))
+requests_total = metrics.counter('requests_total', 'Requests handled by endpoint and status.', ('endpoint', 'method', 'status'))
+requests_in_flight = metrics.gauge('requests_in_flight', 'Requests currently being handled.')
+checkout_attempts = metrics.counter('checkout_attempts_total', 'Checkout form submissions.')
+orders_placed = metrics.counter('orders_placed_total', 'Orders placed and sent for payment.')
+orders_settled = metrics.counter('orders_settled_total', 'Orders that reached a final status.', ('status',))
+late_payments = metrics.counter('late_payments_total', 'Payments approved after their order had failed, by outcome.', ('outcome',))
+
+
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    requests_in_flight.inc()
+
+
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+def record_request_metrics(exception=None):
+    """Observe the request's latency; runs after streamed responses finish and after errors"""
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    endpoint = request.endpoint or 'unmatched'
+    request_latency.observe(time.perf_counter() - started, endpoint, request.method)
+    requests_total.inc(endpoint, request.method, str(g.get('response_status', 500)))
+    requests_in_flight.dec()
+
+
+def start_render_timer(sender, template, context, **extra):
+    g.setdefault('render_started', []).append(time.perf_counter())
+
+
+def record_render_time(sender, template, context, **extra):
+    # A stack, because the index page renders the cached book grid inside its own render
+    started = g.get('render_started')
+    if started:
+        metrics.spans.observe(time.perf_counter() - started.pop(), f'render:{template.name}')
+
+
+def start_request_profile():
+    if current_app.config['PROFILING_ENABLED']:
+        g.profile = request_profiler.start(force=current_app.config['PROFILE_TRIGGER_HEADER'] in request.headers)
+
+
+def stop_request_profile(exception=None):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        request_profiler.stop(profile, request.endpoint or 'unmatched')
+
+
+def asset_url_for(endpoint, **values):
+    """url_for for templates that points static files at their fingerprinted copies"""
+    if endpoint == 'static' and 'filename' in values:
+        fingerprinted = static_assets.fingerprinted(values['filename'])
+        if fingerprinted:
+            endpoint, values['filename'] = 'static_asset', fingerprinted
+    return url_for(endpoint, **values)
+
+
+class subsystem:
+    """Decorator for a Services method that builds a subsystem, turning it into an attribute built once, on first use"""
+
+    def __init__(self, build):
+        self.build = build
+        self.name = build.__name__
+        self.__doc__ = build.__doc__
+
+    def __get__(self, services, owner=None):
+        if services is None:
+            return self
+        with services._lock:
+            if self.name not in services.__dict__:
+                services.__dict__[self.name] = self.build(services)
+        # From now on the instance attribute shadows this descriptor, so reads skip the lock
+        return services.__dict__[self.name]
+
+
+class Services:
+    """
+    The subsystems of one app, each built the first time it is used.
+
+    Nothing here is built by create_app(), so importing the app or starting
+    a worker costs no catalog load, password hash or file I/O until a
+    request needs them. The catalog warm-starts from a pickled snapshot of
+    its indexes when one matches the seed books and the imported catalog
+    file, and writes that snapshot after building from source otherwise.
+
+    Methods:
+        built(): Return the names of the subsystems built so far.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.config = app.config
+        self.catalog_source = None  # 'snapshot' or 'source', once the catalog is built
+        self._lock = threading.RLock()  # Reentrant: building one subsystem may build another
+
+    def built(self):
+        return {name for name, value in vars(type(self)).items()
+                if isinstance(value, subsystem) and name in self.__dict__}
+
+    @subsystem
+    def catalog(self):
+        """Indexed catalog of the seed books merged with the last `flask catalog import`"""
+        snapshot_path = self.config['CATALOG_SNAPSHOT_PATH']
+        signature = source_signature(BOOKS, self.config['CATALOG_PATH'])
+        catalog = load_snapshot(snapshot_path, signature) if snapshot_path else None
+        if catalog is not None:
+            self.catalog_source = 'snapshot'
+            return catalog
+        catalog = Catalog([Book(book.title, book.category, book.price, book.image) for book in BOOKS])
+        if signature['source']:
+            import_catalog(catalog, self.config['CATALOG_PATH'], 'jsonl',
+                           chunk_size=self.config['CATALOG_IMPORT_CHUNK_SIZE'],
+                           workers=self.config['CATALOG_IMPORT_WORKERS'])
+        if snapshot_path:
+            save_snapshot(catalog, snapshot_path, signature)
+        self.catalog_source = 'source'
+        return catalog
+
+    @subsystem
+    def users(self):
+        """Accounts by case-folded email, starting with the demo user (in production, use a database)"""
+        # Password hashing runs in a process pool with this app's configured cost
+        hasher = PasswordHasher(method=self.config['PASSWORD_HASH_METHOD'],
+                                workers=self.config['PASSWORD_HASH_WORKERS'])
+        atexit.register(hasher.shutdown)
+        users = UserStore(hasher=hasher)
+        users.bulk_load([User("demo@bookstore.com", "demo123", "Demo User", "123 Demo Street, Demo City, DC 12345",
+                              hasher=hasher)])
+        return users
+
+    @subsystem
+    def orders(self):
+        """Recent orders in memory; older ones are archived to compressed segments in the background"""
+        orders = OrderStore(
+            self.config['ORDER_ARCHIVE_DIR'],
+            archive_after=self.config['ORDER_ARCHIVE_AFTER'],
+            cache_size=self.config['ORDER_CACHE_SIZE'],
+            archive_interval=self.config['ORDER_ARCHIVE_INTERVAL']
+        )
+        orders.start()
+        atexit.register(orders.stop)
+        return orders
+
+    @subsystem
+    def order_log(self):
+        """Durable journal of every order, so orders survive a restart"""
+        order_log = OrderLog(
+            self.config['ORDER_LOG_PATH'],
+            sync_interval=self.config['ORDER_LOG_SYNC_INTERVAL'],
+            checkpoint_every=self.config['ORDER_LOG_CHECKPOINT_EVERY']
+        )
+        atexit.register(order_log.close)
+        return order_log
+
+    @subsystem
+    def cart_store(self):
+        """Per-visitor carts, keyed by the cart ID stored in the session"""
+        return CartStore(shards=self.config['CART_STORE_SHARDS'], ttl=self.config['CART_IDLE_TTL'])
+
+    @subsystem
+    def inventory(self):
+        """Stock levels and cart/order holds, so checkouts cannot oversell"""
+        inventory = Inventory(stripes=self.config['INVENTORY_STRIPES'], ttl=self.config['INVENTORY_HOLD_TTL'])
+        for seed in BOOKS:
+            book = self.catalog.get_by_title(seed.title)
+            if book is not None:
+                inventory.set_stock(book.book_id, self.config['INVENTORY_DEFAULT_STOCK'])
+        return inventory
+
+    @subsystem
+    def payment_executor(self):
+        """Payments run off the request thread so gateway latency doesn't hold a worker"""
+        return PaymentExecutor(
+            max_workers=self.config['PAYMENT_WORKERS'],
+            max_pending=self.config['PAYMENT_MAX_PENDING'],
+            timeout=self.config['PAYMENT_TIMEOUT'],
+            metrics=metrics
+        )
+
+    @subsystem
+    def email_outbox(self):
+        """Confirmation emails, queued and delivered in batches by a background worker"""
+        if self.config['EMAIL_TRANSPORT'] == 'smtp':
+            transport = SMTPTransport(self.config['EMAIL_SMTP_HOST'], self.config['EMAIL_SMTP_PORT'])
+        elif self.config['EMAIL_TRANSPORT'] == 'memory':
+            transport = MemoryTransport()
+        else:
+            transport = ConsoleTransport()
+        email_outbox = EmailOutbox(
+            transport,
+            batch_size=self.config['EMAIL_BATCH_SIZE'],
+            max_retries=self.config['EMAIL_MAX_RETRIES'],
+            retry_backoff=self.config['EMAIL_RETRY_BACKOFF'],
+            metrics=metrics
+        )
+        email_outbox.start()
+        atexit.register(email_outbox.stop)
+        return email_outbox
+
+    @subsystem
+    def pricing(self):
+        """Discount rules compiled into a code-indexed pricing table"""
+        pricing = PricingEngine(self.config['DISCOUNT_RULES'])
+        if self.config['DISCOUNT_RULES_PATH']:
+            pricing.load_file(self.config['DISCOUNT_RULES_PATH'])
+        return pricing
+
+    @subsystem
+    def static_assets(self):
+        """Fingerprinted, precompressed copies of the static folder"""
+        static_assets = StaticAssets(self.app.static_folder, self.config['STATIC_BUILD_DIR'])
+        if self.config['STATIC_FINGERPRINTING']:
+            static_assets.build()
+        return static_assets
+
+    @subsystem
+    def request_profiler(self):
+        """Sampled cProfile runs of whole requests, dumped per endpoint for /admin/profiles"""
+        return RequestProfiler(
+            self.config['PROFILE_DIR'],
+            sample_rate=self.config['PROFILE_SAMPLE_RATE'],
+            max_profiles=self.config['PROFILE_MAX_FILES']
+        )
+
+    @subsystem
+    def sales_ledger(self):
+        """Order lines in columnar form with daily and category rollups, for the admin sales report"""
+        return SalesLedger()
+
+    @subsystem
+    def co_purchases(self):
+        """Books bought together, counted per order, with top-k neighbour lists refreshed in the background"""
+        co_purchases = CoPurchaseIndex(k=self.config['RECOMMENDATIONS_TOP_K'],
+                                       refresh_interval=self.config['RECOMMENDATIONS_REFRESH_INTERVAL'])
+        co_purchases.start()
+        atexit.register(co_purchases.stop)
+        return co_purchases
+
+    @subsystem
+    def book_grid_cache(self):
+        """Rendered book grid pages, invalidated whenever the catalog version changes"""
+        return FragmentCache(max_entries=self.config['BOOK_GRID_CACHE_SIZE'])
+
+
+def services_proxy(name):
+    """Helper function to stand in for a subsystem of the current app under a module-level name"""
+    return LocalProxy(lambda: getattr(current_app.extensions['bookstore'], name))
+
+
+# Module-level names for the current app's subsystems, so views read like plain globals
+catalog = services_proxy('catalog')
+users = services_proxy('users')
+orders = services_proxy('orders')
+order_log = services_proxy('order_log')
+cart_store = services_proxy('cart_store')
+inventory = services_proxy('inventory')
+payment_executor = services_proxy('payment_executor')
+email_outbox = services_proxy('email_outbox')
+pricing = services_proxy('pricing')
+static_assets = services_proxy('static_assets')
+request_profiler = services_proxy('request_profiler')
+sales_ledger = services_proxy('sales_ledger')
+co_purchases = services_proxy('co_purchases')
+book_grid_cache = services_proxy('book_grid_cache')
+
+ROUTES = []  # (rule, view function, options) for create_app() to register
+
+
+def route(rule, **options):
+    """Decorator recording a view for every app built by create_app(), like Flask.route"""
+    def decorator(f):
+        ROUTES.append((rule, f, options))
+        return f
+
+    return decorator
+
+
+def create_app(config=None):
+    """
+    Build the bookstore app; config overrides the defaults below.
+
+    Only routes, hooks and commands are registered here. The catalog, user
+    store, order store and every other subsystem are built on first use (see
+    Services), so creating an app is cheap for workers and tests alike.
+    """
+    app = Flask(__name__, template_folder='templates')
+    app.secret_key = 'your_secret_key'  # Required for session management
+    app.config.update(
+        TESTING=TESTING,
+        WTF_CSRF_ENABLED=not TESTING,
+        CATALOG_PAGE_SIZE=20,  # Books per page on the index route
+        CATALOG_MAX_PAGE_SIZE=100,  # Upper bound for the per_page query argument
+        CATALOG_PATH=os.environ.get('CATALOG_PATH', os.path.join(app.instance_path, 'catalog.jsonl')),  # Imported catalog, loaded on first use
+        CATALOG_SNAPSHOT_PATH=os.environ.get('CATALOG_SNAPSHOT_PATH', os.path.join(app.instance_path, 'catalog.snapshot')),  # Pickled catalog indexes for warm starts; None disables
+        CATALOG_IMPORT_CHUNK_SIZE=5000,  # Rows parsed per worker task during an import
+        CATALOG_IMPORT_WORKERS=None,  # Parser processes for imports; None uses every CPU, 0 parses inline
+        CATALOG_STREAMING=False,  # Stream the index page by default (also enabled with ?stream=1)
+        BOOK_GRID_CACHE_SIZE=256,  # Rendered book grid pages kept per catalog version
+        SEARCH_RESULTS_LIMIT=50,  # Books shown on the search page
+        AUTOCOMPLETE_LIMIT=10,  # Suggestions returned per autocomplete request
+        STATIC_FINGERPRINTING=True,  # Serve static files under content-hashed, immutable URLs
+        STATIC_BUILD_DIR=os.environ.get('STATIC_BUILD_DIR', os.path.join(app.instance_path, 'static-build')),
+        STATIC_MAX_AGE=365 * 86400,  # Cache lifetime for fingerprinted assets
+        CART_STORE_SHARDS=16,  # Number of independently locked cart shards
+        CART_IDLE_TTL=3600,  # Seconds before an untouched cart is evicted
+        CART_MAX_QUANTITY=99,  # Most copies of one book a cart or quote may hold
+        PAYMENT_WORKERS=4,  # Payments sent to the gateway concurrently
+        PAYMENT_MAX_PENDING=64,  # Payments queued or running before checkout is refused
+        PAYMENT_TIMEOUT=10.0,  # Seconds before a pending payment is failed
+        EMAIL_TRANSPORT=os.environ.get('EMAIL_TRANSPORT', 'console'),  # 'console', 'smtp' or 'memory'
+        EMAIL_SMTP_HOST='localhost',
+        EMAIL_SMTP_PORT=25,
+        EMAIL_BATCH_SIZE=50,  # Emails handed to the transport per delivery
+        EMAIL_MAX_RETRIES=5,  # Retries for a failed batch before giving up
+        EMAIL_RETRY_BACKOFF=0.5,  # Seconds before the first retry, doubled each time
+        PASSWORD_HASH_METHOD='scrypt:32768:8:1',  # werkzeug method and cost; changing it rehashes on login
+        PASSWORD_HASH_WORKERS=2,  # Hashing processes; 0 hashes on the request thread
+        ORDER_LOG_PATH=os.environ.get('ORDER_LOG_PATH', os.path.join(app.instance_path, 'orders.log')),
+        ORDER_LOG_SYNC_INTERVAL=0.005,  # Durability window: seconds of appends grouped into one fsync
+        ORDER_LOG_CHECKPOINT_EVERY=10000,  # Appends between index checkpoints
+        ORDER_HISTORY_PAGE_SIZE=10,  # Orders per page on the account page
+        ORDER_HISTORY_MAX_PAGE_SIZE=100,  # Upper bound for the limit query argument
+        ORDER_ARCHIVE_DIR=os.environ.get('ORDER_ARCHIVE_DIR', os.path.join(app.instance_path, 'order-segments')),
+        ORDER_ARCHIVE_AFTER=30 * 86400,  # Seconds before a settled order moves to a compressed segment
+        ORDER_ARCHIVE_INTERVAL=60,  # Seconds between background archive passes
+        ORDER_CACHE_SIZE=1024,  # Archived orders kept in the LRU cache
+        DISCOUNT_RULES_PATH=os.environ.get('DISCOUNT_RULES_PATH'),  # JSON list of rules, overrides DISCOUNT_RULES
+        DISCOUNT_RULES=[
+            {'code': 'SAVE10', 'kind': 'percentage', 'value': 10},
+            {'code': 'WELCOME20', 'kind': 'percentage', 'value': 20, 'label': 'Welcome discount'}
+        ],
+        QUOTE_BATCH_LIMIT=1000,  # Carts accepted per batch quote request
+        METRICS_ENABLED=True,  # Record request latency and spans and serve them at /metrics
+        PROFILING_ENABLED=os.environ.get('PROFILING_ENABLED', 'False').lower() == 'true',  # Opt-in request profiling
+        PROFILE_SAMPLE_RATE=float(os.environ.get('PROFILE_SAMPLE_RATE', '0.01')),  # Fraction of requests profiled
+        PROFILE_TRIGGER_HEADER='X-Profile',  # Requests sending this header are always profiled
+        PROFILE_DIR=os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles')),
+        PROFILE_MAX_FILES=200,  # Profiles kept per endpoint
+        INVENTORY_STRIPES=64,  # Independently locked stock counter stripes
+        INVENTORY_HOLD_TTL=900,  # Seconds a cart holds stock after its last change
+        INVENTORY_DEFAULT_STOCK=100,  # Units on hand for each seed book
+        RECOMMENDATIONS_TOP_K=10,  # Neighbours kept per book in the co-purchase index
+        RECOMMENDATIONS_LIMIT=4,  # "Customers also bought" books shown on the index and cart pages
+        RECOMMENDATIONS_REFRESH_INTERVAL=30.0,  # Seconds between background refreshes of the neighbour lists
+        ADMIN_EMAILS=[email for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email]  # Accounts allowed on /admin routes
+    )
+    app.config.update(config or {})
+    app.extensions['bookstore'] = Services(app)
+
+    for rule, view_func, options in ROUTES:
+        app.add_url_rule(rule, view_func=view_func, **options)
+    if app.config['METRICS_ENABLED']:
+        app.before_request(start_request_timer)
+        app.after_request(record_response_status)
+        app.teardown_request(record_request_metrics)
+        before_render_template.connect(start_render_timer, app)
+        template_rendered.connect(record_render_time, app)
+    app.before_request(start_request_profile)
+    app.teardown_request(stop_request_profile)
+    app.jinja_env.globals['url_for'] = asset_url_for
+    app.cli.add_command(catalog_cli)
+    return app
+
+
+catalog_cli = AppGroup('catalog', help='Manage the book catalog.')
+
+
+@catalog_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--chunk-size', type=click.IntRange(min=1), help='Rows parsed per worker task.')
+@click.option('--workers', type=click.IntRange(min=0), help='Parser processes; 0 parses in this process.')
+@click.option('--save/--no-save', default=True, help='Write the merged catalog to CATALOG_PATH for the app to load.')
+def import_catalog_command(path, file_format, chunk_size, workers, save):
+    """Stream books from a CSV or JSONL file (optionally .gz) into the catalog.
+
+    Rows need title, category, price and image, plus an optional id. Rows
+    matching an existing book by id, or by title when there is no id, update
+    it; only rows that changed touch the catalog's indexes.
+    """
+    def report(stats):
+        click.echo(f'{stats.rows} rows ({stats.rows_per_second:.0f} rows/s): {stats.added} added, '
+                   f'{stats.updated} updated, {stats.unchanged} unchanged, {stats.error_count} invalid')
+
+    try:
+        stats = import_catalog(
+            catalog, path, file_format,
+            chunk_size=chunk_size or current_app.config['CATALOG_IMPORT_CHUNK_SIZE'],
+            workers=workers if workers is not None else current_app.config['CATALOG_IMPORT_WORKERS'],
+            progress=report
+        )
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for line_number, message in stats.errors:
+        click.echo(f"  line {line_number}: {message}" if line_number else f"  {message}", err=True)
+    if stats.error_count > len(stats.errors):
+        click.echo(f'  ... and {stats.error_count - len(stats.errors)} more invalid rows', err=True)
+    click.echo(f'Imported {stats.rows} rows in {stats.elapsed:.2f}s ({stats.rows_per_second:.0f} rows/s); '
+               f'catalog now has {len(catalog)} books')
+    if save:
+        save_catalog(catalog, current_app.config['CATALOG_PATH'])
+        click.echo(f"Saved catalog to {current_app.config['CATALOG_PATH']}")
+        write_catalog_snapshot()
+
+
+@catalog_cli.command('snapshot')
+def snapshot_catalog_command():
+    """Write the catalog snapshot that new workers warm-start from.
+
+    Run it after deploying, so the first worker doesn't pay for building the
+    catalog indexes from source.
+    """
+    if not current_app.config['CATALOG_SNAPSHOT_PATH']:
+        raise click.UsageError('CATALOG_SNAPSHOT_PATH is not set')
+    write_catalog_snapshot()
+
+
+def write_catalog_snapshot():
+    """Helper function to pickle the app's catalog indexes to CATALOG_SNAPSHOT_PATH, if set"""
+    path = current_app.config['CATALOG_SNAPSHOT_PATH']
+    if path:
+        save_snapshot(current_app.extensions['bookstore'].catalog, path,
+                      source_signature(BOOKS, current_app.config['CATALOG_PATH']))
+        click.echo(f'Saved catalog snapshot to {path}')
+
 
 def get_book_by_title(title):
     """Helper function to find a book by title"""
-    return next((book for book in BOOKS if book.title == title), None)
+    return catalog.get_by_title(title)
+
+
+def get_cart(create=True):
+    """Helper function to get the current visitor's cart
+
+    Pages that only read the cart pass create=False and get an unsaved empty
+    Cart for visitors without one, so browsing and crawlers don't fill the
+    cart store or set a session cookie.
+    """
+    if not create:
+        cart = cart_store.find(session['cart_id']) if 'cart_id' in session else None
+        return cart if cart is not None else Cart()
+    if 'cart_id' not in session:
+        session['cart_id'] = uuid.uuid4().hex
+    return cart_store.get(session['cart_id'])
+
+
+def hold_cart_stock(quantities):
+    """Helper function to hold stock for the current cart, returning an error message if a book is short"""
+    return stock_error(inventory.hold(session['cart_id'], quantities))
+
+
+def stock_error(shortfalls):
+    """Helper function to describe stock shortfalls from the inventory"""
+    if not shortfalls:
+        return None
+    problems = []
+    for book_id, available in shortfalls.items():
+        title = catalog.get(book_id).title
+        problems.append(f'only {available} left of "{title}"' if available else f'"{title}" is out of stock')
+    return f"Sorry, {', '.join(problems)}."
+
+
+def get_recommendations(cart):
+    """Helper function to list books customers bought together with the ones in the cart"""
+    if cart.is_empty():
+        return []
+    book_ids = co_purchases.recommend([item.book.book_id for item in cart.items.values()],
+                                      current_app.config['RECOMMENDATIONS_LIMIT'])
+    return [book for book in map(catalog.get, book_ids) if book is not None]
+
+
+def get_order(order_id):
+    """Helper function to find an order in the order store, falling back to the order log"""
+    order = orders.get(order_id)
+    if order is None:
+        record = order_log.read(order_id)
+        if record is not None:
+            order = Order.from_dict(record)
+    return order
 
 
 def get_current_user():
@@ -45,10 +535,11 @@ def get_current_user():
 
 def login_required(f):
     """Decorator to require login for certain routes"""
-    from functools import wraps
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_email' not in session:
+        # Accounts live in memory, so a session can outlive its user, e.g. across a restart
+        if get_current_user() is None:
+            session.pop('user_email', None)
             flash('Please log in to access this page.', 'error')
             return redirect(url_for('login'))
         return f(*args, **kwargs)
@@ -56,69 +547,342 @@ def login_required(f):
     return decorated_function
 
 
-@app.route('/')
+def admin_required(f):
+    """Decorator to restrict a route to registered users listed in ADMIN_EMAILS"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        admins = {UserStore.normalize(email) for email in current_app.config['ADMIN_EMAILS']}
+        user = get_current_user()
+        if user is None or UserStore.normalize(user.email) not in admins:
+            return jsonify({'error': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def get_positive_int_arg(name, default):
+    """Helper function to read a positive integer query argument"""
+    value = request.args.get(name, '')
+    return int(value) if value.isdigit() and int(value) > 0 else default
+
+
+def get_date_arg(name):
+    """Helper function to read an optional YYYY-MM-DD query argument; raises ValueError if malformed"""
+    value = request.args.get(name)
+    return datetime.date.fromisoformat(value) if value else None
+
+
+def conditional_response(etag_parts, render):
+    """Helper function to answer 304 Not Modified when the client already has this version of a page"""
+    # Pending flash messages make the page one-off, so render it without an ETag
+    if session.get('_flashes'):
+        return render()
+    etag = hashlib.sha1(repr(etag_parts).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def page_etag_parts(cart, current_user):
+    """Helper function to list what the shared page header depends on"""
+    return (cart.version, session.get('cart_id'),
+            current_user.email if current_user else None,
+            current_user.name if current_user else None)
+
+
+@route('/')
 def index():
     current_user = get_current_user()
-    return render_template('index.html', books=BOOKS, cart=cart, current_user=current_user)
-
+    cart = get_cart(create=False)
+    per_page = min(get_positive_int_arg('per_page', current_app.config['CATALOG_PAGE_SIZE']),
+                   current_app.config['CATALOG_MAX_PAGE_SIZE'])
+    page = get_positive_int_arg('page', 1)
+    after = request.args.get('after', '')
+    stream = request.args.get('stream', '1' if current_app.config['CATALOG_STREAMING'] else '0') == '1'
+    page_key = (page, per_page, after if after.isdigit() else None)
+    etag_parts = ('index', catalog.version, co_purchases.version, page_key, stream) + page_etag_parts(cart, current_user)
+    return conditional_response(etag_parts, lambda: render_index(cart, current_user, page_key, stream))
+
+
+def render_index(cart, current_user, page_key, stream):
+    """Render the index page, reusing the cached book grid for this catalog version and page"""
+    page, per_page, after = page_key
+
+    # Fetch one extra book to know whether there is a next page
+    if after is not None:
+        books = catalog.page(limit=per_page + 1, after=int(after))
+    else:
+        books = catalog.page(offset=(page - 1) * per_page, limit=per_page + 1)
+    has_next = len(books) > per_page
+    books = books[:per_page]
+    context = dict(
+        books=books,
+        cart=cart,
+        current_user=current_user,
+        page=page,
+        per_page=per_page,
+        has_next=has_next,
+        next_cursor=books[-1].book_id if has_next else None,
+        recommendations=get_recommendations(cart)
+    )
 
-@app.route('/add_to_cart', methods=['POST'])
+    if stream:
+        # Pop flashes before the headers go out so the session change is saved
+        get_flashed_messages(with_categories=True)
+        return stream_template('index.html', **context)
+    context['book_grid'] = Markup(book_grid_cache.get_or_render(
+        catalog.version, page_key, lambda: render_template('_book_grid.html', **context)))
+    return render_template('index.html', **context)
+
+
+@route('/book/<int:book_id>')
+def book_detail(book_id):
+    """Book detail page"""
+    book = catalog.get(book_id)
+    if book is None:
+        flash('Book not found', 'error')
+        return redirect(url_for('index'))
+    current_user = get_current_user()
+    cart = get_cart(create=False)
+    stock = inventory.available(book_id)
+    etag_parts = ('book', catalog.version, book_id, stock) + page_etag_parts(cart, current_user)
+    return conditional_response(etag_parts, lambda: render_template(
+        'book.html', book=book, stock=stock, cart=cart, current_user=current_user))
+
+
+@route('/search')
+def search():
+    """Search the catalog by words of the title and category"""
+    query = request.args.get('q', '').strip()
+    books = catalog.search(query, limit=current_app.config['SEARCH_RESULTS_LIMIT']) if query else []
+    current_user = get_current_user()
+    cart = get_cart(create=False)
+    etag_parts = ('search', catalog.version, query) + page_etag_parts(cart, current_user)
+    return conditional_response(etag_parts, lambda: render_template(
+        'search.html', query=query, books=books, cart=cart, current_user=current_user))
+
+
+@route('/search/autocomplete')
+def autocomplete():
+    """Suggest books whose titles or categories start with what the user has typed so far"""
+    query = request.args.get('q', '')
+    limit = min(get_positive_int_arg('limit', current_app.config['AUTOCOMPLETE_LIMIT']), current_app.config['AUTOCOMPLETE_LIMIT'])
+    books = catalog.search(query, limit=limit, prefix=True)
+    return jsonify({
+        'query': query,
+        'suggestions': [
+            {'book_id': book.book_id, 'title': book.title, 'category': book.category,
+             'url': url_for('book_detail', book_id=book.book_id)}
+            for book in books
+        ]
+    })
+
+
+@route('/assets/<path:filename>')
+def static_asset(filename):
+    """Serve a fingerprinted static file, precompressed when the client accepts it"""
+    path, encoding = static_assets.resolve(filename, request.accept_encodings)
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = f"public, max-age={current_app.config['STATIC_MAX_AGE']}, immutable"
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@route('/add_to_cart', methods=['POST'])
 def add_to_cart():
     if not TESTING and not session.get('user_email'):
         return redirect(url_for('login'))
     title = request.form.get('title')
     quantity = request.form.get('quantity')
-    if title in BOOKS and quantity and quantity.isdigit() and int(quantity) > 0:
-        book = get_book_by_title(title)
-        cart.add_book(book, int(quantity))  # Reverted to global cart
-        flash(f'Added {quantity} "{title}" to cart!', 'success')
+    book = get_book_by_title(title)
+    if book and quantity and quantity.isdigit() and int(quantity) > 0:
+        cart = get_cart()
+        in_cart = cart.items[title].quantity if title in cart.items else 0
+        error = quantity_error(in_cart + int(quantity)) or hold_cart_stock({book.book_id: in_cart + int(quantity)})
+        if error:
+            flash(error, 'error')
+        else:
+            cart.add_book(book, int(quantity))
+            flash(f'Added {quantity} "{title}" to cart!', 'success')
     else:
         flash('Book not found or invalid quantity!', 'error')
     return redirect(url_for('index'))
 
 
-@app.route('/remove-from-cart', methods=['POST'])
+@route('/remove-from-cart', methods=['POST'])
 def remove_from_cart():
     book_title = request.form.get('title')
+    cart = get_cart()
+    if book_title in cart.items:
+        inventory.release(session['cart_id'], [cart.items[book_title].book.book_id])
     cart.remove_book(book_title)
     flash(f'Removed "{book_title}" from cart!', 'success')
     return redirect(url_for('view_cart'))
 
 
-@app.route('/update_cart', methods=['POST'])
+@route('/update_cart', methods=['POST'])
 def update_cart():
     if not TESTING and not session.get('user_email'):
         return redirect(url_for('login'))
     title = request.form.get('title')
     quantity = request.form.get('quantity')
-    if title in [item.book.title for item in cart.get_items()]:
-        if quantity and quantity.isdigit() and int(quantity) >= 0:
-            cart.update_quantity(title, int(quantity))
-            if int(quantity) == 0:
+    cart = get_cart()
+    if title in cart.items:
+        if quantity and re.match(r'^-?\d+$', quantity):
+            error = quantity_error(int(quantity)) or hold_cart_stock(
+                {cart.items[title].book.book_id: max(int(quantity), 0)})
+            if error:
+                flash(error, 'error')
+            elif int(quantity) <= 0:
                 cart.remove_book(title)
                 flash(f'Removed "{title}" from cart!', 'success')
             else:
+                cart.update_quantity(title, int(quantity))
                 flash(f'Updated "{title}" quantity to {quantity}!', 'success')
         else:
             flash('Invalid quantity!', 'error')
     return redirect(url_for('view_cart'))
 
 
-@app.route('/cart')
+@route('/api/cart', methods=['GET', 'POST'])
+def cart_api():
+    """Return the cart as JSON, after applying a batch of operations on POST
+
+    The body is {"operations": [...], "discount_code": optional}, where each
+    operation is {"op": "add"|"update", "title", "quantity"},
+    {"op": "remove", "title"} or {"op": "clear"}. Every operation is validated
+    before any is applied, so the batch applies as a whole or not at all.
+    """
+    if not TESTING and not session.get('user_email'):
+        return jsonify({'error': 'Please log in to access your cart'}), 401
+    cart = get_cart(create=request.method == 'POST')
+    data = request.get_json(silent=True)
+    data = {} if data is None else data
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    discount_code = data.get('discount_code')
+    if discount_code is not None and not isinstance(discount_code, str):
+        return jsonify({'error': 'discount_code must be a string'}), 400
+    if request.method == 'POST':
+        operations = data.get('operations')
+        if not isinstance(operations, list):
+            return jsonify({'error': 'Expected a JSON body with an "operations" list'}), 400
+        # Concurrent batches on one cart would interleave their checks and updates
+        with cart_store.lock(session['cart_id']):
+            steps = []
+            in_cart = set(cart.items)  # Titles in the cart as the batch goes, so update and remove can be checked
+            for index, operation in enumerate(operations):
+                step = validate_cart_operation(operation, in_cart)
+                if isinstance(step, str):
+                    return jsonify({'error': f'Operation {index}: {step}', 'cart': cart.to_dict()}), 400
+                steps.append(step)
+            quantities = cart_quantities_after(cart, steps)
+            error = quantity_error(max(quantities.values(), default=0))
+            if error:
+                return jsonify({'error': error, 'cart': cart.to_dict()}), 400
+            error = hold_cart_stock(quantities)
+            if error:
+                return jsonify({'error': error, 'cart': cart.to_dict()}), 409
+            with metrics.span('cart_operations'):
+                for op, book, quantity in steps:
+                    if op == 'add':
+                        cart.add_book(book, quantity)
+                    elif op == 'update' and quantity > 0:
+                        cart.update_quantity(book.title, quantity)
+                    elif op in ('update', 'remove'):
+                        cart.remove_book(book.title)
+                    else:
+                        cart.clear()
+    state = cart.to_dict()
+    state['quote'] = pricing.quote(cart, discount_code).to_dict()
+    return jsonify(state)
+
+
+def quantity_error(quantity):
+    """Helper function to return an error message if a cart line would exceed CART_MAX_QUANTITY"""
+    limit = current_app.config['CART_MAX_QUANTITY']
+    if quantity > limit:
+        return f'At most {limit} copies of a book per cart'
+    return None
+
+
+def cart_quantities_after(cart, steps):
+    """Helper function to work out each book's cart quantity once a batch of cart API steps is applied"""
+    quantities = {item.book.book_id: item.quantity for item in cart.items.values()}
+    for op, book, quantity in steps:
+        if op == 'clear':
+            quantities = dict.fromkeys(quantities, 0)
+        elif op == 'add':
+            quantities[book.book_id] = quantities.get(book.book_id, 0) + quantity
+        else:
+            quantities[book.book_id] = max(quantity, 0) if op == 'update' else 0
+    return quantities
+
+
+def validate_cart_operation(operation, in_cart):
+    """Helper function to turn a cart API operation into (op, book, quantity), or an error message
+
+    in_cart is the set of titles in the cart before this operation; it is
+    updated as if the operation were applied.
+    """
+    if not isinstance(operation, dict):
+        return 'operation must be an object'
+    op = operation.get('op')
+    if op == 'clear':
+        in_cart.clear()
+        return op, None, 0
+    if op not in ('add', 'update', 'remove'):
+        return f'unknown op {op!r}'
+    title = operation.get('title')
+    if not isinstance(title, str):
+        return 'title must be a string'
+    book = get_book_by_title(title)
+    if book is None:
+        return f'book not found: {title!r}'
+    quantity = operation.get('quantity', 0)
+    if op != 'remove' and (not isinstance(quantity, int) or isinstance(quantity, bool)):
+        return 'quantity must be an integer'
+    if op == 'add' and quantity <= 0:
+        return 'quantity must be positive'
+    if op != 'add' and title not in in_cart:
+        # Otherwise the stock hold would be placed for a cart line that never exists
+        return f'not in the cart: {title!r}'
+    if op == 'add' or (op == 'update' and quantity > 0):
+        in_cart.add(title)
+    else:
+        in_cart.discard(title)
+    return op, book, quantity
+
+
+@route('/cart')
 def view_cart():
+    cart = get_cart(create=False)
     current_user = get_current_user()
-    return render_template('cart.html', cart=cart, current_user=current_user)
+    return render_template('cart.html', cart=cart, current_user=current_user,
+                           recommendations=get_recommendations(cart))
 
 
-@app.route('/clear-cart', methods=['POST'])
+@route('/clear-cart', methods=['POST'])
 def clear_cart():
+    cart = get_cart()
+    inventory.release(session['cart_id'], [item.book.book_id for item in cart.items.values()])
     cart.clear()
     flash('Cart cleared!', 'success')
     return redirect(url_for('view_cart'))
 
 
-@app.route('/checkout')
+@route('/checkout')
 def checkout():
+    cart = get_cart(create=False)
     if cart.is_empty():
         flash('Your cart is empty!', 'error')
         return redirect(url_for('index'))
@@ -128,11 +892,13 @@ def checkout():
     return render_template('checkout.html', cart=cart, total_price=total_price, current_user=current_user)
 
 
-@app.route('/process-checkout', methods=['POST'])
+@route('/process-checkout', methods=['POST'])
 def process_checkout():
     """Process the checkout form with shipping and payment information"""
     if TESTING:
         session['user_email'] = 'demo@bookstore.com'  # Mock login for tests
+    checkout_attempts.inc()
+    cart = get_cart()
     if cart.is_empty():
         flash('Your cart is empty!', 'error')
         return redirect(url_for('index'))
@@ -153,22 +919,14 @@ def process_checkout():
         'cvv': request.form.get('cvv')
     }
 
-    discount_code = request.form.get('discount_code', '').upper()  # Normalize to uppercase
-
     # Calculate total with discount
-    total_amount = cart.get_total_price()
-    discount_applied = 0
-
-    if discount_code == 'SAVE10':
-        discount_applied = total_amount * 0.10
-        total_amount -= discount_applied
-        flash(f'Discount applied! You saved ${discount_applied:.2f}', 'success')
-    elif discount_code == 'WELCOME20':
-        discount_applied = total_amount * 0.20
-        total_amount -= discount_applied
-        flash(f'Welcome discount applied! You saved ${discount_applied:.2f}', 'success')
-    elif discount_code:
-        flash('Invalid discount code', 'error')
+    with metrics.span('pricing_quote'):
+        quote = pricing.quote(cart, request.form.get('discount_code'))
+    total_amount = quote.total
+    if quote.error:
+        flash(quote.error, 'error')
+    elif quote.message:
+        flash(quote.message, 'success')
 
     required_fields = ['name', 'email', 'address', 'city', 'zip_code']
     for field in required_fields:
@@ -190,23 +948,21 @@ def process_checkout():
             flash('Invalid CVV! Must be 3-4 digits.', 'error')
             return redirect(url_for('checkout'))
     elif payment_info['payment_method'] == 'paypal':
-        if not payment_info.get('email') or not re.match(r'^[\w\.-]+@[\w\.-]+\.\w+$', payment_info.get('email')):
+        if not re.match(r'^[\w\.-]+@[\w\.-]+\.\w+$', shipping_info['email']):
             flash('Please provide a valid email for PayPal!', 'error')
             return redirect(url_for('checkout'))
 
-    # Process payment through mock gateway
-    payment_result = PaymentGateway.process_payment(payment_info)
-
-    if not payment_result['success']:
-        flash(payment_result['message'], 'error')
-        return redirect(url_for('checkout'))
+    # Create a pending order; the payment executor confirms or fails it later
+    order_id = str(uuid.uuid4())[:8].upper()
+    cart_id = session['cart_id']
 
-    # Add specific flash for PayPal success before order creation
-    if payment_info['payment_method'] == 'paypal' and payment_result['success']:
-        flash('Payment successful via PayPal!', 'success')
+    # Move the cart's stock holds to the order; they are committed once payment succeeds
+    error = stock_error(inventory.transfer(
+        cart_id, order_id, {item.book.book_id: item.quantity for item in cart.items.values()}))
+    if error:
+        flash(error, 'error')
+        return redirect(url_for('view_cart'))
 
-    # Create order
-    order_id = str(uuid.uuid4())[:8].upper()
     order = Order(
         order_id=order_id,
         user_email=shipping_info['email'],
@@ -214,35 +970,260 @@ def process_checkout():
         shipping_info=shipping_info,
         payment_info={
             'method': payment_info['payment_method'],
-            'transaction_id': payment_result['transaction_id']
+            'transaction_id': None
         },
-        total_amount=total_amount
+        total_amount=total_amount,
+        status='Pending'
     )
 
-    # Store order
-    orders[order_id] = order
+    # Clear cart before submitting so a failed payment can restore it safely
+    # Store and journal the order before the payment callback can record its outcome
+    cart.clear()
+    orders.add(order)
+    order_log.append(order_id, order.to_dict())
+    record_sales(order)
 
     # Add order to user if logged in
     current_user = get_current_user()
     if current_user:
         current_user.add_order(order)
 
-    # Send confirmation email (mock)
-    EmailService.send_order_confirmation(shipping_info['email'], order)
+    # The callback runs on a payment thread, so it brings this app's context along
+    flask_app = current_app._get_current_object()
+
+    def settle(result):
+        with flask_app.app_context():
+            complete_order(order, current_user, cart_id, result)
+
+    def reconcile(result):
+        with flask_app.app_context():
+            reconcile_late_payment(order, result)
+
+    try:
+        payment_executor.submit(order_id, payment_info, settle, reconcile)
+    except PaymentQueueFull as e:
+        order.status = 'Cancelled'
+        orders_settled.inc(order.status)
+        order_log.append(order_id, order.to_dict())
+        restore_cart(cart_id, order)
+        flash(str(e), 'error')
+        return redirect(url_for('checkout'))
 
-    # Clear cart
-    cart.clear()
+    orders_placed.inc()
 
     # Store order in session for confirmation page
     session['last_order_id'] = order_id
 
-    flash('Payment successful! Your order has been confirmed.', 'success')
+    flash('Order placed! We are processing your payment.', 'success')
     return redirect(url_for('order_confirmation', order_id=order_id))
 
-@app.route('/order-confirmation/<order_id>')
+
+@route('/api/quotes', methods=['POST'])
+def batch_quotes():
+    """Price many carts in one call, e.g. for marketing simulations"""
+    data = request.get_json(silent=True)
+    carts = data.get('carts') if isinstance(data, dict) else None
+    if not isinstance(carts, list):
+        return jsonify({'error': 'Expected a JSON body with a "carts" list'}), 400
+    if len(carts) > current_app.config['QUOTE_BATCH_LIMIT']:
+        return jsonify({'error': f"At most {current_app.config['QUOTE_BATCH_LIMIT']} carts per request"}), 400
+
+    batch = []
+    for index, entry in enumerate(carts):
+        lines = entry.get('items', []) if isinstance(entry, dict) else None
+        discount_code = entry.get('discount_code') if isinstance(entry, dict) else None
+        if not isinstance(lines, list) or not (discount_code is None or isinstance(discount_code, str)):
+            return jsonify({'error': f'Cart {index}: expected an object with an "items" list '
+                                     'and an optional "discount_code" string'}), 400
+        cart = Cart()
+        for line in lines:
+            title = line.get('title') if isinstance(line, dict) else None
+            book = get_book_by_title(title) if isinstance(title, str) else None
+            quantity = line.get('quantity') if isinstance(line, dict) else None
+            if (book is None or not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0
+                    or quantity_error(quantity)):
+                return jsonify({'error': f'Cart {index}: unknown book or invalid quantity', 'line': line}), 400
+            cart.add_book(book, quantity)
+        batch.append((cart, discount_code))
+    with metrics.span('pricing_quote_batch'):
+        quotes = pricing.quote_many(batch)
+    return jsonify({'quotes': [quote.to_dict() for quote in quotes]})
+
+
+def complete_order(order, user, cart_id, payment_result):
+    """Payment executor callback: confirm the order, or fail it and return its items to the cart"""
+    if payment_result['success']:
+        order.payment_info['transaction_id'] = payment_result['transaction_id']
+        status = 'Confirmed'
+    else:
+        order.payment_info['message'] = payment_result['message']
+        status = 'Payment Failed'
+    # Journal the outcome before the status is published, so anyone who sees it can read it back from the log
+    order_log.append(order.order_id, dict(order.to_dict(), status=status))
+    order.status = status
+    if payment_result['success']:
+        inventory.commit(order.order_id, [item.book.book_id for item in order.items])
+        co_purchases.record(item.book.book_id for item in order.items)  # Only paid orders count as bought together
+        if user:
+            user.confirm_order(order)
+        # Queue confirmation email for background delivery
+        email_outbox.enqueue(EmailService.build_order_confirmation(order.user_email, order))
+    else:
+        restore_cart(cart_id, order)
+    orders_settled.inc(order.status)
+
+
+def reconcile_late_payment(order, payment_result):
+    """Payment executor callback for a gateway answer that came after the order had timed out: refund any charge"""
+    if not payment_result['success']:
+        return
+    refund = payment_executor.gateway.refund(payment_result['transaction_id'])
+    order.payment_info['late_transaction_id'] = payment_result['transaction_id']
+    if refund['success']:
+        order.payment_info['message'] += '; the late charge was refunded'
+        late_payments.inc('refunded')
+    else:
+        order.payment_info['message'] += '; the late charge could not be refunded and needs review'
+        late_payments.inc('refund_failed')
+    order_log.append(order.order_id, order.to_dict())
+
+
+def record_sales(order, reverse=False):
+    """Helper function to add an order to the sales ledger without letting a reporting error fail the checkout"""
+    try:
+        sales_ledger.record_order(order, reverse=reverse)
+    except Exception:
+        current_app.logger.exception('Could not record order %s in the sales ledger', order.order_id)
+
+
+def restore_cart(cart_id, order):
+    """Helper function to put an unpaid order's items back into its cart, release its stock holds and reverse its sales"""
+    record_sales(order, reverse=True)
+    book_ids = [item.book.book_id for item in order.items]
+    inventory.release(order.order_id, book_ids)
+    cart = cart_store.get(cart_id)
+    for item in order.items:
+        cart.add_book(item.book, item.quantity)
+    # Best effort: hold the stock again for the cart, the checkout re-checks it anyway
+    inventory.hold(cart_id, {item.book.book_id: item.quantity for item in cart.items.values()})
+
+
+@route('/metrics')
+def metrics_endpoint():
+    """Export metrics in the Prometheus text exposition format"""
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+@route('/admin/profiles')
+@admin_required
+def admin_profiles():
+    """Aggregate the dumped request profiles into the hottest functions per endpoint"""
+    limit = min(get_positive_int_arg('top', 20), 200)
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in RequestProfiler.SORT_KEYS:
+        return jsonify({'error': f"sort must be one of: {', '.join(RequestProfiler.SORT_KEYS)}"}), 400
+    return jsonify({
+        'enabled': current_app.config['PROFILING_ENABLED'],
+        'sample_rate': request_profiler.sample_rate,
+        'endpoints': request_profiler.top(request.args.get('endpoint'), limit, sort)
+    })
+
+
+@route('/admin/reports/sales')
+@admin_required
+def admin_sales_report():
+    """
+    Report revenue, units and order lines grouped by day, category and/or book.
+
+    Query arguments: group_by (comma-separated, default day,category), start
+    and end (inclusive YYYY-MM-DD dates) and category. Unfiltered reports by
+    day and/or category come straight from the maintained rollups; anything
+    else is a vectorized scan of the ledger.
+    """
+    group_by = tuple(name for name in request.args.get('group_by', 'day,category').split(',') if name)
+    if set(group_by) - set(GROUPS) or len(set(group_by)) != len(group_by):
+        return jsonify({'error': f"group_by must be a comma-separated list of: {', '.join(GROUPS)}"}), 400
+    try:
+        start, end = get_date_arg('start'), get_date_arg('end')
+    except ValueError:
+        return jsonify({'error': 'start and end must be dates in YYYY-MM-DD format'}), 400
+    category = request.args.get('category') or None
+
+    started = time.perf_counter()
+    if start is None and end is None and category is None and group_by in (('day',), ('category',), ('day', 'category')):
+        source, rows = 'rollup', sales_ledger.rollup(group_by)
+    else:
+        source, rows = 'scan', sales_ledger.query(group_by, start, end, category)
+    return jsonify({
+        'group_by': list(group_by),
+        'source': source,
+        'lines_total': len(sales_ledger),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+        'rows': rows
+    })
+
+
+@route('/admin/orders/export')
+@admin_required
+def export_orders():
+    """
+    Stream orders as CSV or JSONL for reconciliation, oldest first.
+
+    Query arguments: format (csv or jsonl), start and end (inclusive
+    YYYY-MM-DD dates), status (comma-separated), limit, and cursor, taken
+    from the last row received, to resume an interrupted or paged export.
+    The output is gzip-compressed on the fly for clients that accept it.
+    """
+    file_format = request.args.get('format', 'csv')
+    if file_format not in CONTENT_TYPES:
+        return jsonify({'error': f"format must be one of: {', '.join(CONTENT_TYPES)}"}), 400
+    try:
+        start, end = get_date_arg('start'), get_date_arg('end')
+    except ValueError:
+        return jsonify({'error': 'start and end must be dates in YYYY-MM-DD format'}), 400
+    statuses = {status for status in request.args.get('status', '').split(',') if status}
+    cursor = request.args.get('cursor') or None
+    limit = get_positive_int_arg('limit', None)
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    # The body is generated after the request's app context is gone, so hand it the store itself
+    records = select_orders(orders._get_current_object(), start, end, statuses, cursor, limit)
+    compress = bool(request.accept_encodings['gzip'])
+    response = current_app.response_class(
+        stream_export(records, file_format, header=cursor is None, compress=compress),
+        content_type=CONTENT_TYPES[file_format])
+    response.headers['Content-Disposition'] = f'attachment; filename=orders.{file_format}'
+    response.headers['Cache-Control'] = 'no-store'
+    response.vary.add('Accept-Encoding')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+@route('/order-status/<order_id>')
+def order_status(order_id):
+    """Report the payment status of an order as JSON"""
+    order = get_order(order_id)
+    if not order:
+        return jsonify({'error': 'Order not found'}), 404
+    payment_executor.check(order_id)
+    return jsonify({
+        'order_id': order.order_id,
+        'status': order.status,
+        'message': order.payment_info.get('message'),
+        'transaction_id': order.payment_info.get('transaction_id')
+    })
+
+@route('/order-confirmation/<order_id>')
 def order_confirmation(order_id):
     """Display order confirmation page"""
-    order = orders.get(order_id)
+    order = get_order(order_id)
     if not order:
         flash('Order not found', 'error')
         return redirect(url_for('index'))
@@ -253,7 +1234,7 @@ def order_confirmation(order_id):
 
 # User Account Management Routes
 
-@app.route('/register', methods=['GET', 'POST'])
+@route('/register', methods=['GET', 'POST'])
 def register():
     """User registration"""
     if request.method == 'POST':
@@ -273,19 +1254,24 @@ def register():
             return render_template('register.html')
 
         # Case-insensitive email check
-        if email.lower() in [user.email.lower() for user in users.values()]:
+        if email in users:
             flash('An account with this email already exists', 'error')
             return render_template('register.html')
 
-        user = User(email, password, name, address)  # Hashes password
-        users[email] = user
+        user = User(email, password, name, address, hasher=users.hasher)  # Hashes password
+        try:
+            users.add(user)
+        except ValueError:
+            # Someone registered the same email while the password was being hashed
+            flash('An account with this email already exists', 'error')
+            return render_template('register.html')
         session['user_email'] = email
         flash('Account created successfully! You are now logged in.', 'success')
         return redirect(url_for('index'))
     return render_template('register.html')
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     """User login"""
     if request.method == 'POST':
@@ -293,8 +1279,8 @@ def login():
         password = request.form.get('password')
 
         user = users.get(email)
-        if user and user.password == password:
-            session['user_email'] = email
+        if user and user.check_password(password):
+            session['user_email'] = user.email
             flash('Logged in successfully!', 'success')
             return redirect(url_for('index'))
         else:
@@ -303,7 +1289,7 @@ def login():
     return render_template('login.html')
 
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     """User logout"""
     session.pop('user_email', None)
@@ -311,15 +1297,48 @@ def logout():
     return redirect(url_for('index'))
 
 
-@app.route('/account')
+@route('/account')
 @login_required
 def account():
     """User account page"""
     current_user = get_current_user()
-    return render_template('account.html', current_user=current_user)
+    order_ids, next_before = get_order_history_page(current_user)
+    orders_page = [order for order in map(get_order, order_ids) if order]
+    return render_template('account.html', current_user=current_user, orders=orders_page,
+                           next_before=next_before, per_page=get_order_history_limit())
+
+
+@route('/account/orders')
+@login_required
+def account_orders():
+    """Order history page and summary as JSON"""
+    current_user = get_current_user()
+    order_ids, next_before = get_order_history_page(current_user)
+    return jsonify({
+        'orders': [order.to_dict() for order in map(get_order, order_ids) if order],
+        'next_before': next_before,
+        'summary': {
+            'order_count': current_user.order_count,
+            'lifetime_spend': current_user.lifetime_spend,
+            'last_order_date': current_user.last_order_date.strftime('%Y-%m-%d %H:%M:%S')
+            if current_user.last_order_date else None
+        }
+    })
 
 
-@app.route('/update-profile', methods=['POST'])
+def get_order_history_limit():
+    """Helper function to get the order history page size requested, capped at ORDER_HISTORY_MAX_PAGE_SIZE"""
+    return min(get_positive_int_arg('limit', current_app.config['ORDER_HISTORY_PAGE_SIZE']),
+               current_app.config['ORDER_HISTORY_MAX_PAGE_SIZE'])
+
+
+def get_order_history_page(user):
+    """Helper function to read one page of a user's order history from the request arguments"""
+    before = request.args.get('before', '')
+    return user.get_order_history(limit=get_order_history_limit(), before=int(before) if before.isdigit() else None)
+
+
+@route('/update-profile', methods=['POST'])
 @login_required
 def update_profile():
     """Update user profile"""
@@ -330,7 +1349,7 @@ def update_profile():
 
     new_password = request.form.get('new_password')
     if new_password:
-        current_user.password = new_password
+        current_user.set_password(new_password)
         flash('Password updated successfully!', 'success')
     else:
         flash('Profile updated successfully!', 'success')
@@ -338,5 +1357,8 @@ def update_profile():
     return redirect(url_for('account'))
 
 
+# The default app, configured from the environment, for `flask run`, WSGI servers and scripts
+app = create_app()
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
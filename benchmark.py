@@ -0,0 +1,309 @@
+"""
+End-to-end load and latency benchmark for the storefront.
+
+Replays a mix of shopper sessions (browse -> add to cart -> checkout ->
+account) against the app and reports p50/p95/p99 latency and requests per
+second for each route. Results can be saved as a JSON baseline, and a later
+run compared against it fails when a route's p95 latency regresses past the
+threshold.
+
+By default requests go through the Flask test client. --server starts the
+app on a real threaded WSGI server and drives it over HTTP instead.
+
+Examples:
+    python benchmark.py --books 10000 --users 500 --orders 5 --sessions 200 --threads 4
+    python benchmark.py --save-baseline benchmarks/baseline.json
+    python benchmark.py --baseline benchmarks/baseline.json --threshold 0.25
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+PASSWORD = 'benchmark-password'
+SEARCH_TERMS = ['volume', 'fiction', 'mystery', 'history', 'science', 'vol', 'myst', 'hist']
+CATEGORIES = ['Fiction', 'Mystery', 'History', 'Science', 'Poetry']
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LatencyRecorder:
+    """
+    Thread-safe collection of request latencies grouped by route.
+
+    Methods:
+        record(route, seconds, status): Add one timed request.
+        summary(): Return count, errors, p50/p95/p99 (ms) and requests/sec per route.
+    """
+
+    def __init__(self):
+        self._latencies = {}  # route -> list of seconds
+        self._errors = {}  # route -> count of 5xx responses
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, route, seconds, status):
+        with self._lock:
+            self._latencies.setdefault(route, []).append(seconds)
+            if status >= 500:
+                self._errors[route] = self._errors.get(route, 0) + 1
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        routes = {}
+        with self._lock:
+            for route, latencies in sorted(self._latencies.items()):
+                ordered = sorted(latencies)
+                routes[route] = {
+                    'count': len(ordered),
+                    'errors': self._errors.get(route, 0),
+                    'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+                    'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+                    'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+                    'requests_per_sec': round(len(ordered) / elapsed, 1) if elapsed else 0.0
+                }
+        return routes
+
+
+class TestClientTransport:
+    """Sends requests through the Flask test client, one client (and cookie jar) per shopper"""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code
+
+
+class HTTPTransport:
+    """Sends requests to a running server over HTTP without following redirects"""
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self._NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+def seed(app_module, books=1000, users=100, orders_per_user=0, rng=None):
+    """Grow the catalog, accounts and order history of the app in context to the requested sizes"""
+    from models import Book, Order, CartItem, User
+
+    rng = rng or random.Random(0)
+    app_module.catalog.load(
+        Book(f'Benchmark Volume {i} {CATEGORIES[i % len(CATEGORIES)]}', CATEGORIES[i % len(CATEGORIES)],
+             round(rng.uniform(5, 40), 2), '/images/books/1984.jpg')
+        for i in range(books))
+    catalog_books = list(app_module.catalog)
+
+    user_store = app_module.users
+    password_hash = user_store.hasher.hash(PASSWORD)  # Hashed once and shared, seeding stays fast
+    accounts = [User(f'bench-{i}@bookstore.com', None, f'Shopper {i}', '1 Benchmark Way',
+                     password_hash=password_hash, hasher=user_store.hasher) for i in range(users)]
+    user_store.bulk_load(accounts)
+
+    for index, user in enumerate(accounts):
+        for number in range(orders_per_user):
+            items = [CartItem(book, rng.randint(1, 3)) for book in rng.sample(catalog_books, 2)]
+            total = sum(item.get_total_price() for item in items)
+            order = Order(f'BENCH{index}-{number}', user.email, items, {}, {'method': 'credit_card'}, total)
+            app_module.orders.add(order)
+            user.add_order(order)
+            user.confirm_order(order)
+    return accounts
+
+
+def run_session(transport, recorder, rng, email, books, checkout_rate=0.3):
+    """Replay one shopper: log in, browse, search, fill a cart, maybe check out, view the account"""
+    def timed(route, method, path, data=None):
+        start = time.perf_counter()
+        status = transport.request(method, path, data)
+        recorder.record(route, time.perf_counter() - start, status)
+        return status
+
+    timed('POST /login', 'POST', '/login', {'email': email, 'password': PASSWORD})
+    for _ in range(rng.randint(1, 3)):
+        timed('GET /', 'GET', f'/?page={rng.randint(1, 5)}')
+    term = rng.choice(SEARCH_TERMS)
+    timed('GET /search/autocomplete', 'GET', f'/search/autocomplete?q={term[:3]}')
+    timed('GET /search', 'GET', f'/search?q={term}')
+    for book_id, title in rng.sample(books, min(len(books), rng.randint(1, 4))):
+        timed('GET /book/<id>', 'GET', f'/book/{book_id}')
+        timed('POST /add_to_cart', 'POST', '/add_to_cart', {'title': title, 'quantity': str(rng.randint(1, 2))})
+    timed('GET /api/cart', 'GET', '/api/cart')
+    timed('GET /cart', 'GET', '/cart')
+    if rng.random() < checkout_rate:
+        timed('GET /checkout', 'GET', '/checkout')
+        timed('POST /process-checkout', 'POST', '/process-checkout', {
+            'name': 'Benchmark Shopper', 'email': email, 'address': '1 Benchmark Way',
+            'city': 'Load City', 'zip_code': '12345', 'payment_method': 'credit_card',
+            'card_number': '4242424242424242', 'expiry_date': '12/30', 'cvv': '123',
+            'discount_code': rng.choice(['', 'SAVE10'])
+        })
+    timed('GET /account', 'GET', '/account')
+    timed('GET /account/orders', 'GET', '/account/orders')
+
+
+def run(app_module, sessions=100, threads=1, accounts=None, base_url=None, seed_value=0, checkout_rate=0.3):
+    """
+    Run sessions shopper sessions spread over threads workers and return the latency summary.
+
+    Like seed(), this runs inside an app context; in-process sessions go to that app.
+    """
+    flask_app = app_module.current_app._get_current_object()
+    books = [(book.book_id, book.title) for book in app_module.catalog]
+    emails = [account.email for account in accounts] if accounts else ['demo@bookstore.com']
+    recorder = LatencyRecorder()
+    counter = iter(range(sessions))
+    counter_lock = threading.Lock()
+
+    def worker(worker_number):
+        rng = random.Random(seed_value * 1000 + worker_number)
+        while True:
+            with counter_lock:
+                session_number = next(counter, None)
+            if session_number is None:
+                return
+            # A fresh transport per session gives each shopper their own cookies
+            transport = HTTPTransport(base_url) if base_url else TestClientTransport(flask_app)
+            run_session(transport, recorder, rng, emails[session_number % len(emails)], books, checkout_rate)
+
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    recorder.stop()
+    return recorder.summary()
+
+
+def compare(baseline, current, threshold=0.25, min_delta_ms=1.0):
+    """
+    Return a description of every route whose p95 latency regressed past threshold.
+
+    A route regresses when its p95 exceeds the baseline's by more than
+    threshold (a fraction) and by at least min_delta_ms, so sub-millisecond
+    jitter on fast routes is not reported. Routes missing from either side
+    are skipped.
+    """
+    regressions = []
+    for route, before in baseline.items():
+        after = current.get(route)
+        if after is None:
+            continue
+        limit = before['p95_ms'] * (1 + threshold)
+        if after['p95_ms'] > limit and after['p95_ms'] - before['p95_ms'] >= min_delta_ms:
+            regressions.append(f"{route}: p95 {after['p95_ms']:.2f}ms > {limit:.2f}ms "
+                               f"(baseline {before['p95_ms']:.2f}ms)")
+    return regressions
+
+
+def start_server(flask_app, host='127.0.0.1', port=0):
+    """Serve the app on a threaded WSGI server in the background and return (server, base URL)"""
+    from werkzeug.serving import make_server
+    server = make_server(host, port, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='benchmark-server', daemon=True).start()
+    return server, f'http://{host}:{server.server_port}'
+
+
+def format_summary(summary):
+    lines = [f"{'route':<28}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}"]
+    for route, stats in summary.items():
+        lines.append(f"{route:<28}{stats['count']:>7}{stats['errors']:>8}{stats['p50_ms']:>10.2f}"
+                     f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['requests_per_sec']:>9.1f}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Storefront load and latency benchmark')
+    parser.add_argument('--books', type=int, default=1000, help='synthetic books added to the catalog')
+    parser.add_argument('--users', type=int, default=50, help='synthetic shopper accounts')
+    parser.add_argument('--orders', type=int, default=5, help='past orders seeded per account')
+    parser.add_argument('--sessions', type=int, default=100, help='shopper sessions to replay')
+    parser.add_argument('--threads', type=int, default=1, help='concurrent shoppers')
+    parser.add_argument('--checkout-rate', type=float, default=0.3, help='fraction of sessions that check out')
+    parser.add_argument('--server', action='store_true', help='drive a real threaded WSGI server over HTTP')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for a repeatable mix')
+    parser.add_argument('--save-baseline', metavar='PATH', help='write the results to PATH as JSON')
+    parser.add_argument('--baseline', metavar='PATH', help='compare against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed p95 regression as a fraction')
+    args = parser.parse_args(argv)
+
+    # Keep benchmark data out of the instance folder and its email out of the console
+    data_dir = tempfile.mkdtemp(prefix='bookstore-benchmark-')
+    os.environ.setdefault('ORDER_LOG_PATH', os.path.join(data_dir, 'orders.log'))
+    os.environ.setdefault('ORDER_ARCHIVE_DIR', os.path.join(data_dir, 'order-segments'))
+    os.environ.setdefault('STATIC_BUILD_DIR', os.path.join(data_dir, 'static-build'))
+    os.environ.setdefault('CATALOG_SNAPSHOT_PATH', os.path.join(data_dir, 'catalog.snapshot'))
+    os.environ.setdefault('EMAIL_TRANSPORT', 'memory')
+    import app as app_module
+
+    with app_module.app.app_context():
+        accounts = seed(app_module, args.books, args.users, args.orders, random.Random(args.seed))
+        server = None
+        base_url = None
+        if args.server:
+            server, base_url = start_server(app_module.app)
+        try:
+            summary = run(app_module, args.sessions, args.threads, accounts, base_url, args.seed, args.checkout_rate)
+        finally:
+            if server is not None:
+                server.shutdown()
+    print(format_summary(summary))
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'config': {key: value for key, value in vars(args).items()
+                                  if key not in ('save_baseline', 'baseline')},
+                       'routes': summary}, f, indent=2)
+        print(f'Baseline saved to {args.save_baseline}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline['routes'], summary, args.threshold)
+        if regressions:
+            print('Latency regressions:\n  ' + '\n  '.join(regressions))
+            return 1
+        print(f'No route regressed more than {args.threshold:.0%} against {args.baseline}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    """
+    Bounded LRU cache of rendered HTML fragments tied to a data version.
+
+    Fragments are looked up by version and key, e.g. the catalog version and
+    the page being shown. When a request arrives with a new version, every
+    cached fragment is dropped, so a catalog change invalidates the whole
+    cache in one step.
+
+    Methods:
+        get_or_render(version, key, render): Return a cached fragment or render and cache it.
+        clear(): Drop every cached fragment.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, version, key, render):
+        with self._lock:
+            if version != self._version:
+                self._fragments.clear()
+                self._version = version
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+        fragment = render()
+        with self._lock:
+            if version == self._version:
+                self._fragments[key] = fragment
+                while len(self._fragments) > self.max_entries:
+                    self._fragments.popitem(last=False)
+        return fragment
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+            self._version = None
+
+    def __len__(self):
+        return len(self._fragments)
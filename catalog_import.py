@@ -0,0 +1,276 @@
+import collections
+import csv
+import gc
+import gzip
+import json
+import math
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from models import Book
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+MAX_PRICE = 10000
+MAX_TITLE_LENGTH = 300
+SNAPSHOT_FORMAT = 2  # Bump when Catalog or SearchIndex internals change
+
+
+class ImportStats:
+    """Running totals for one catalog import"""
+
+    def __init__(self):
+        self.rows = 0
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.errors = []  # (line number, message), capped at max_errors by the importer
+        self.error_count = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self):
+        return {
+            'rows': self.rows,
+            'added': self.added,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'invalid': self.error_count,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1)
+        }
+
+
+def open_text(path):
+    """Open a catalog file for reading, transparently decompressing .gz files"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def detect_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    raise ValueError(f'Cannot tell the format of {path}; use a .csv or .jsonl file or pass the format')
+
+
+def read_chunks(f, file_format, chunk_size):
+    """
+    Yield (first line number, header, lines) chunks of whole records.
+
+    Only raw text is read here; parsing happens in the workers. CSV records
+    may span lines inside quoted fields, so a chunk only ends where the
+    number of quote characters seen so far is even.
+    """
+    header = None
+    if file_format == 'csv':
+        header = next(csv.reader([f.readline()]), None)
+        if not header:
+            return
+    line_number = 2 if header else 1
+    chunk = []
+    first = line_number
+    record = ''
+    for line in f:
+        record += line
+        if file_format == 'csv' and record.count('"') % 2:
+            continue  # Inside a quoted field that continues on the next line
+        chunk.append(record)
+        line_number += record.count('\n') or 1
+        record = ''
+        if len(chunk) >= chunk_size:
+            yield first, header, chunk
+            chunk = []
+            first = line_number
+    if record:
+        chunk.append(record)
+    if chunk:
+        yield first, header, chunk
+
+
+def parse_chunk(file_format, header, lines, first_line):
+    """
+    Parse and validate a chunk of raw records in a worker process.
+
+    Returns (rows, errors): rows are (id, title, category, price, image)
+    tuples ready to become Books, errors are (line number, message) pairs.
+    """
+    rows = []
+    errors = []
+    line_number = first_line
+    for line in lines:
+        try:
+            if file_format == 'csv':
+                record = dict(zip(header, next(csv.reader([line]))))
+            elif line.strip():
+                record = json.loads(line)
+            else:
+                record = None  # Blank lines are allowed in JSONL
+            if record is not None:
+                rows.append(validate_record(record))
+        except json.JSONDecodeError as e:
+            errors.append((line_number, f'Invalid JSON: {e.msg}'))
+        except ValueError as e:
+            errors.append((line_number, str(e)))
+        line_number += line.count('\n') or 1
+    return rows, errors
+
+
+def validate_record(record):
+    """Turn one input record into an (id, title, category, price, image) tuple or raise ValueError"""
+    if not isinstance(record, dict):
+        raise ValueError('Expected an object with title, category, price and image')
+
+    book_id = record.get('id')
+    if book_id in (None, ''):
+        book_id = None
+    else:
+        try:
+            book_id = int(book_id)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid id: {book_id!r}')
+        if book_id <= 0:
+            raise ValueError(f'Invalid id: {book_id!r}')
+
+    title = str(record.get('title') or '').strip()
+    if not title or len(title) > MAX_TITLE_LENGTH:
+        raise ValueError(f'Title must be 1 to {MAX_TITLE_LENGTH} characters')
+
+    category = str(record.get('category') or '').strip()
+    if not category:
+        raise ValueError('Category is required')
+
+    try:
+        price = round(float(record.get('price')), 2)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid price: {record.get('price')!r}")
+    if not math.isfinite(price) or not 0 < price <= MAX_PRICE:
+        raise ValueError(f'Price must be between 0 and {MAX_PRICE}')
+
+    image = str(record.get('image') or '').strip()
+    if not image.startswith('/images/') or '..' in image or not image.lower().endswith(IMAGE_EXTENSIONS):
+        raise ValueError(f'Image must be a path under /images/ ending in one of {", ".join(IMAGE_EXTENSIONS)}')
+
+    return book_id, title, category, price, image
+
+
+def import_catalog(catalog, path, file_format=None, chunk_size=5000, workers=None, max_errors=100, progress=None):
+    """
+    Stream a CSV or JSONL file into catalog and return its ImportStats.
+
+    Chunks of raw lines are parsed and validated across a pool of workers
+    processes (workers=0 parses in this process). At most two chunks per
+    worker are in flight, so memory stays bounded by the chunk size however
+    large the file is. Chunks are merged in file order with
+    Catalog.upsert_many(), so re-importing a file only re-indexes the rows
+    that changed. progress, if given, is called with the stats after every chunk.
+    """
+    file_format = file_format or detect_format(path)
+    stats = ImportStats()
+
+    def merge(rows, errors):
+        books = [Book(title, category, price, image, book_id=book_id)
+                 for book_id, title, category, price, image in rows]
+        added, updated, unchanged, rejected = catalog.upsert_many(books)
+        stats.rows += len(rows) + len(errors)
+        stats.added += added
+        stats.updated += updated
+        stats.unchanged += unchanged
+        problems = errors + [(None, reason) for _, reason in rejected]
+        stats.error_count += len(problems)
+        stats.errors.extend(problems[:max(0, max_errors - len(stats.errors))])
+        if progress:
+            progress(stats)
+
+    with open_text(path) as f:
+        chunks = read_chunks(f, file_format, chunk_size)
+        if workers == 0:
+            for first_line, header, lines in chunks:
+                merge(*parse_chunk(file_format, header, lines, first_line))
+            return stats
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = collections.deque()
+            for first_line, header, lines in chunks:
+                in_flight.append(pool.submit(parse_chunk, file_format, header, lines, first_line))
+                if len(in_flight) >= 2 * workers:
+                    merge(*in_flight.popleft().result())
+            while in_flight:
+                merge(*in_flight.popleft().result())
+    return stats
+
+
+def save_catalog(catalog, path):
+    """Write every book to path as JSONL, replacing the file atomically"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        for book in catalog:
+            f.write(json.dumps({'id': book.book_id, 'title': book.title, 'category': book.category,
+                                'price': book.price, 'image': book.image}, separators=(',', ':')) + '\n')
+    os.replace(temporary_path, path)
+    return len(catalog)
+
+
+def source_signature(seed_books, path):
+    """Describe the inputs a catalog is built from, so a snapshot of it can be checked for staleness"""
+    try:
+        stat = os.stat(path)
+        source = (stat.st_size, stat.st_mtime_ns)
+    except (OSError, TypeError):
+        source = None
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'seed': [(book.title, book.category, book.price, book.image) for book in seed_books],
+        'source': source
+    }
+
+
+def save_snapshot(catalog, path, signature):
+    """
+    Pickle a fully indexed catalog to path, replacing the file atomically.
+
+    The signature is pickled first, on its own, so load_snapshot() can
+    reject a stale snapshot without unpickling the catalog.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as f:
+        pickle.dump(signature, f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(catalog, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, path)
+
+
+def load_snapshot(path, signature):
+    """
+    Return the catalog pickled at path if it was built from the same inputs, otherwise None.
+
+    Snapshots are only ever written by this app, so they are trusted;
+    never point CATALOG_SNAPSHOT_PATH at a file from elsewhere.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if pickle.load(f) != signature:
+                return None
+            # Unpickling creates many long-lived objects and no garbage, so pause the collector's full passes
+            collecting = gc.isenabled()
+            gc.disable()
+            try:
+                return pickle.load(f)
+            finally:
+                if collecting:
+                    gc.enable()
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None  # Missing, truncated or from an incompatible version: rebuild instead
@@ -0,0 +1,196 @@
+import heapq
+import threading
+import time
+
+
+class _Stripe:
+    """Stock counters and holds for the books that hash to one lock"""
+
+    __slots__ = ('lock', 'on_hand', 'held', 'holds', 'expiries')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.on_hand = {}  # book_id -> units in the warehouse, including held ones
+        self.held = {}  # book_id -> units held by carts and pending orders
+        self.holds = {}  # (holder, book_id) -> (quantity, expiry time or None)
+        self.expiries = []  # heap of (expiry time, holder, book_id); stale entries are skipped
+
+    def purge(self, now):
+        """Drop holds whose time is up, returning their units to stock"""
+        while self.expiries and self.expiries[0][0] <= now:
+            expires, holder, book_id = heapq.heappop(self.expiries)
+            hold = self.holds.get((holder, book_id))
+            if hold is not None and hold[1] == expires:
+                self._drop(holder, book_id)
+
+    def hold_of(self, holder, book_id):
+        hold = self.holds.get((holder, book_id))
+        return hold[0] if hold else 0
+
+    def free(self, book_id):
+        return self.on_hand[book_id] - self.held.get(book_id, 0)
+
+    def set_hold(self, holder, book_id, quantity, expires):
+        self._drop(holder, book_id)
+        if quantity <= 0:
+            return
+        self.holds[(holder, book_id)] = (quantity, expires)
+        self.held[book_id] = self.held.get(book_id, 0) + quantity
+        if expires is not None:
+            heapq.heappush(self.expiries, (expires, holder, book_id))
+
+    def _drop(self, holder, book_id):
+        hold = self.holds.pop((holder, book_id), None)
+        if hold is None:
+            return 0
+        remaining = self.held[book_id] - hold[0]
+        if remaining:
+            self.held[book_id] = remaining
+        else:
+            del self.held[book_id]
+        return hold[0]
+
+
+class Inventory:
+    """
+    Stock levels with per-holder reservations, striped over many locks.
+
+    Books hash to one of stripes independently locked stripes, so checkouts
+    for different books rarely wait on each other. A hold reserves units of a
+    book for a holder (a cart or an order). Holds are absolute: setting a
+    cart's hold to its current quantity is idempotent, so the hold follows
+    the cart however it was changed. Cart holds expire after ttl seconds
+    unless renewed, which returns stock from abandoned carts. Order holds
+    never expire; they are committed when payment succeeds or released when
+    it fails.
+
+    Operations that touch several books lock their stripes in a fixed order
+    and check every book before changing any, so they succeed or fail as a
+    whole. Books whose stock was never set are untracked and never run out.
+
+    Methods:
+        set_stock(book_id, quantity): Set the units on hand for a book.
+        available(book_id): Return units not held by anyone, or None if untracked.
+        hold(holder, quantities, ttl=None): Set holds for several books at once.
+        transfer(source, target, quantities): Move holds from one holder to another.
+        commit(holder, book_ids): Turn a holder's holds into sales.
+        release(holder, book_ids): Drop a holder's holds.
+    """
+
+    def __init__(self, stripes=64, ttl=900):
+        self.ttl = ttl
+        self._stripes = [_Stripe() for _ in range(stripes)]
+
+    def _stripe(self, book_id):
+        return self._stripes[hash(book_id) % len(self._stripes)]
+
+    def _locked(self, book_ids):
+        """Lock the stripes for book_ids in index order, so concurrent callers cannot deadlock"""
+        indexes = sorted({hash(book_id) % len(self._stripes) for book_id in book_ids})
+        return _StripeLocks([self._stripes[index] for index in indexes])
+
+    def set_stock(self, book_id, quantity):
+        stripe = self._stripe(book_id)
+        with stripe.lock:
+            stripe.on_hand[book_id] = quantity
+
+    def available(self, book_id):
+        stripe = self._stripe(book_id)
+        with stripe.lock:
+            if book_id not in stripe.on_hand:
+                return None
+            stripe.purge(time.monotonic())
+            return max(stripe.free(book_id), 0)
+
+    def held_by(self, holder, book_id):
+        stripe = self._stripe(book_id)
+        with stripe.lock:
+            stripe.purge(time.monotonic())
+            return stripe.hold_of(holder, book_id)
+
+    def hold(self, holder, quantities, ttl=None):
+        """
+        Set holder's hold on each book to the given quantity (0 releases it).
+
+        The holds expire after ttl seconds (the inventory's ttl by default)
+        unless set again. Returns {} on success. If any book is short, nothing
+        changes and the result maps each short book to the units the holder
+        could have.
+        """
+        return self._move(None, holder, quantities, self.ttl if ttl is None else ttl)
+
+    def transfer(self, source, target, quantities):
+        """
+        Move holds from source to target, e.g. from a cart to the order it became.
+
+        target ends up holding the given quantities, without expiry, and
+        source holds nothing on those books. Units source held count as
+        available to target, so a checkout never competes with its own cart.
+        Returns shortfalls like hold().
+        """
+        return self._move(source, target, quantities, None)
+
+    def _move(self, source, target, quantities, ttl):
+        with self._locked(quantities) as stripes:
+            now = time.monotonic()
+            for stripe in stripes:
+                stripe.purge(now)
+            shortfalls = {}
+            for book_id, quantity in quantities.items():
+                stripe = self._stripe(book_id)
+                if book_id not in stripe.on_hand:
+                    continue
+                own = stripe.hold_of(target, book_id) + (stripe.hold_of(source, book_id) if source else 0)
+                if quantity > own and quantity > stripe.free(book_id) + own:
+                    shortfalls[book_id] = max(stripe.free(book_id) + own, 0)
+            if shortfalls:
+                return shortfalls
+            expires = now + ttl if ttl else None
+            for book_id, quantity in quantities.items():
+                stripe = self._stripe(book_id)
+                if book_id not in stripe.on_hand:
+                    continue
+                if source:
+                    stripe.set_hold(source, book_id, 0, None)
+                stripe.set_hold(target, book_id, quantity, expires)
+        return {}
+
+    def commit(self, holder, book_ids):
+        """Take holder's held units out of stock for good and return how many were sold"""
+        sold = 0
+        with self._locked(book_ids):
+            for book_id in book_ids:
+                stripe = self._stripe(book_id)
+                if book_id not in stripe.on_hand:
+                    continue
+                quantity = stripe.hold_of(holder, book_id)
+                stripe.set_hold(holder, book_id, 0, None)
+                stripe.on_hand[book_id] -= quantity
+                sold += quantity
+        return sold
+
+    def release(self, holder, book_ids):
+        self.hold(holder, {book_id: 0 for book_id in book_ids})
+
+    def expire(self):
+        """Purge expired holds everywhere; holds are also purged lazily on access"""
+        now = time.monotonic()
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.purge(now)
+
+
+class _StripeLocks:
+    """Context manager holding several stripe locks, acquired in the given order"""
+
+    def __init__(self, stripes):
+        self.stripes = stripes
+
+    def __enter__(self):
+        for stripe in self.stripes:
+            stripe.lock.acquire()
+        return self.stripes
+
+    def __exit__(self, *exc_info):
+        for stripe in reversed(self.stripes):
+            stripe.lock.release()
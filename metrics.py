@@ -0,0 +1,173 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from fast cache hits to slow gateway calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class for a metric family: one value per combination of label values"""
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}  # label values tuple -> value
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.extend(self._render_value(label_values, value))
+        return lines
+
+    def _render_value(self, label_values, value):
+        return [f'{self.name}{format_labels(self.labels, label_values)} {format_value(value)}']
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(Metric):
+    """
+    Fixed-bucket histogram. observe() is a binary search and three additions
+    under a lock; cumulative bucket counts are only worked out when rendered.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, seconds, *label_values):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last is +Inf), then sum and count
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def value(self, *label_values):
+        """Return (count, sum) for one series"""
+        with self._lock:
+            series = self._values.get(label_values)
+            return (series[2], series[1]) if series else (0, 0.0)
+
+    def _render_value(self, label_values, series):
+        counts, total, count = series
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = f'le="{format_value(bound)}"'
+            lines.append(f'{self.name}_bucket{format_labels(self.labels, label_values, le)} {cumulative}')
+        labels = format_labels(self.labels, label_values)
+        lines.append(f'{self.name}_sum{labels} {format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered together in Prometheus text format.
+
+    Metrics are registered once at startup and then updated in place, so
+    recording never allocates more than a new label combination. span() times
+    a block of code into a shared histogram labelled by span name, for work
+    such as payment calls, email delivery and template rendering.
+
+    Methods:
+        counter(name, help_text, labels=()): Register a counter.
+        gauge(name, help_text, labels=()): Register a gauge.
+        histogram(name, help_text, labels=(), buckets=DEFAULT_BUCKETS): Register a histogram.
+        span(name): Context manager timing a block into the span histogram.
+        render(): Return every metric in Prometheus text exposition format.
+    """
+
+    def __init__(self, prefix='bookstore'):
+        self.prefix = prefix
+        self._metrics = {}
+        self.spans = self.histogram('span_duration_seconds', 'Time spent in instrumented operations.', ('span',))
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric already registered: {metric.name}')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(f'{self.prefix}_{name}', help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge(f'{self.prefix}_{name}', help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(f'{self.prefix}_{name}', help_text, labels, buckets))
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.observe(time.perf_counter() - start, name)
+
+    def get(self, name):
+        return self._metrics.get(f'{self.prefix}_{name}')
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
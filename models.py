@@ -1,20 +1,234 @@
+import bisect
 import datetime
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from email.message import EmailMessage
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from search import SearchIndex
 
 class Book:
-    def __init__(self, title, category, price, image):
+    __slots__ = ('book_id', 'title', 'category', 'price', 'image')
+
+    def __init__(self, title, category, price, image, book_id=None):
+        self.book_id = book_id
         self.title = title
         self.category = category
         self.price = price
         self.image = image
 
 
+class Catalog:
+    """
+    In-memory book catalog with hash indexes for constant-time lookups.
+
+    Books are indexed by ID and by title, with secondary indexes by category
+    and by price. Indexes are built once in load(), so lookups from the cart
+    and checkout do not depend on catalog size. Titles and categories are also
+    kept in an inverted search index that add() and remove() update in place.
+    A catalog pickles together with its indexes, so a snapshot of it loads
+    without re-indexing anything.
+
+    Attributes:
+        version (int): Changes on every change to the catalog contents. Versions are
+            unique across Catalog instances, so they can key caches safely.
+
+    Methods:
+        load(books): Bulk-load books, assigning IDs and rebuilding indexes.
+        add(book): Add a single book to the catalog.
+        upsert_many(books): Add new books and update changed ones, leaving unchanged ones alone.
+        remove(book_id): Remove a book by ID.
+        get(book_id): Look up a book by ID.
+        get_by_title(title): Look up a book by title.
+        by_category(category): Return books in a category.
+        in_price_range(low, high): Return books priced between low and high.
+        page(offset=0, limit=20, after=None): Return a slice of books in ID order.
+        categories(): Return all category names.
+        search(query, limit=20, prefix=False): Return books matching every word of a query.
+    """
+
+    _versions = itertools.count(1)  # Shared so versions never repeat between catalogs
+
+    def __init__(self, books=()):
+        self._books = {}  # book_id -> Book
+        self._by_title = {}  # title -> Book
+        self._by_category = {}  # category -> {book_id: Book}
+        self._by_price = []  # sorted (price, book_id) pairs for range queries
+        self._ids = []  # sorted book IDs for offset and cursor pagination
+        self._search = SearchIndex()  # words of titles and categories -> book IDs
+        self._next_id = 1
+        self.version = next(self._versions)
+        if books:
+            self.load(books)
+
+    def load(self, books):
+        loaded = []
+        for book in books:
+            self._index(book)
+            loaded.append(book)
+        self._search.add_many((book.book_id, book.title, book.category) for book in loaded)
+        # Appending and re-sorting merges the two sorted runs in linear time
+        self._by_price.extend((book.price, book.book_id) for book in loaded)
+        self._by_price.sort()
+        self._ids.extend(book.book_id for book in loaded)
+        self._ids.sort()
+        self.version = next(self._versions)
+
+    def add(self, book):
+        self._index(book)
+        bisect.insort(self._by_price, (book.price, book.book_id))
+        bisect.insort(self._ids, book.book_id)
+        self._search.add(book.book_id, book.title, book.category)
+        self.version = next(self._versions)
+        return book
+
+    def upsert_many(self, books):
+        """
+        Merge books into the catalog, matching by ID when set and by title otherwise.
+
+        New books are bulk-loaded, changed books are re-indexed in place and
+        unchanged books touch no index. A book whose title belongs to a
+        different book is rejected. Returns (added, updated, unchanged, rejected),
+        where rejected is a list of (book, reason) pairs.
+        """
+        added = []
+        new_titles = set()
+        new_ids = set()
+        updated = unchanged = 0
+        rejected = []
+        for book in books:
+            existing = self._books.get(book.book_id) if book.book_id is not None else self._by_title.get(book.title)
+            owner = self._by_title.get(book.title)
+            if (owner is not None and owner is not existing) or book.title in new_titles:
+                rejected.append((book, f'Duplicate book title: {book.title}'))
+            elif existing is None:
+                if book.book_id in new_ids:
+                    rejected.append((book, f'Duplicate book id: {book.book_id}'))
+                    continue
+                added.append(book)
+                new_titles.add(book.title)
+                if book.book_id is not None:
+                    new_ids.add(book.book_id)
+            elif (existing.title, existing.category, existing.price, existing.image) == \
+                    (book.title, book.category, book.price, book.image):
+                unchanged += 1
+            else:
+                self._update(existing, book)
+                updated += 1
+        if added:
+            self.load(added)
+        elif updated:
+            self.version = next(self._versions)
+        return len(added), updated, unchanged, rejected
+
+    def _update(self, book, changes):
+        """Copy changes' fields onto book, re-indexing only the fields that differ"""
+        if changes.title != book.title:
+            del self._by_title[book.title]
+            self._by_title[changes.title] = book
+        if changes.category != book.category:
+            category = self._by_category[book.category]
+            del category[book.book_id]
+            if not category:
+                del self._by_category[book.category]
+            self._by_category.setdefault(changes.category, {})[book.book_id] = book
+        if changes.price != book.price:
+            del self._by_price[bisect.bisect_left(self._by_price, (book.price, book.book_id))]
+            bisect.insort(self._by_price, (changes.price, book.book_id))
+        reindex_words = changes.title != book.title or changes.category != book.category
+        book.title, book.category, book.price, book.image = changes.title, changes.category, changes.price, changes.image
+        if reindex_words:
+            self._search.remove(book.book_id)
+            self._search.add(book.book_id, book.title, book.category)
+
+    def remove(self, book_id):
+        book = self._books.pop(book_id, None)
+        if book is None:
+            return None
+        del self._by_title[book.title]
+        category = self._by_category[book.category]
+        del category[book_id]
+        if not category:
+            del self._by_category[book.category]
+        position = bisect.bisect_left(self._by_price, (book.price, book_id))
+        del self._by_price[position]
+        del self._ids[bisect.bisect_left(self._ids, book_id)]
+        self._search.remove(book_id)
+        self.version = next(self._versions)
+        return book
+
+    def _index(self, book):
+        if book.title in self._by_title:
+            raise ValueError(f'Duplicate book title: {book.title}')
+        if book.book_id is None:
+            book.book_id = self._next_id
+        elif book.book_id in self._books:
+            raise ValueError(f'Duplicate book id: {book.book_id}')
+        self._next_id = max(self._next_id, book.book_id + 1)
+        self._books[book.book_id] = book
+        self._by_title[book.title] = book
+        self._by_category.setdefault(book.category, {})[book.book_id] = book
+
+    def get(self, book_id):
+        return self._books.get(book_id)
+
+    def get_by_title(self, title):
+        return self._by_title.get(title)
+
+    def by_category(self, category):
+        return list(self._by_category.get(category, {}).values())
+
+    def in_price_range(self, low, high):
+        start = bisect.bisect_left(self._by_price, (low,))
+        end = bisect.bisect_right(self._by_price, (high, float('inf')))
+        return [self._books[book_id] for _, book_id in self._by_price[start:end]]
+
+    def page(self, offset=0, limit=20, after=None):
+        """Return up to limit books, starting at offset or after the given book ID cursor"""
+        start = bisect.bisect_right(self._ids, after) if after is not None else offset
+        return [self._books[book_id] for book_id in self._ids[start:start + limit]]
+
+    def categories(self):
+        return list(self._by_category)
+
+    def search(self, query, limit=20, prefix=False):
+        return [self._books[book_id] for book_id in self._search.search(query, limit, prefix)]
+
+    def __setstate__(self, state):
+        # A catalog unpickled from a snapshot gets a fresh version, so it never shares cache keys
+        self.__dict__.update(state)
+        self.version = next(self._versions)
+
+    def __contains__(self, title):
+        return title in self._by_title
+
+    def __iter__(self):
+        return iter(self._books.values())
+
+    def __len__(self):
+        return len(self._books)
+
+
+def to_cents(amount):
+    """Convert a dollar amount to integer cents"""
+    return int(round(amount * 100))
+
+
 class CartItem:
     def __init__(self, book, quantity=1):
         self.book = book
         self.quantity = quantity
-    
+        self.unit_price_cents = to_cents(book.price)
+
+    def get_total_price_cents(self):
+        return self.unit_price_cents * self.quantity
+
     def get_total_price(self):
-        return self.book.price * self.quantity
+        return self.get_total_price_cents() / 100
 
 
 class Cart:
@@ -23,52 +237,75 @@ class Cart:
 
     The Cart uses a dictionary with book titles as keys for efficient lookups,
     allowing operations like adding, removing, and updating book quantities.
+    Totals are kept as running sums in integer cents, updated by every
+    mutation, so reading them is O(1) and free of float drift.
 
     Attributes:
         items (dict): Dictionary storing CartItem objects with book titles as keys.
+        version (int): Incremented on every change, e.g. to key cached quotes.
 
     Methods:
         add_book(book, quantity=1): Add a book to the cart with specified quantity.
         remove_book(book_title): Remove a book from the cart by title.
         update_quantity(book_title, quantity): Update quantity of a book in the cart.
-        get_total_price(): Calculate total price of all items in the cart.
+        get_total_price(): Return the total price of all items in the cart.
+        get_total_price_cents(): Return the total price in integer cents.
         get_total_items(): Get the total count of all books in the cart.
         clear(): Remove all items from the cart.
         get_items(): Return a list of all CartItem objects in the cart.
         is_empty(): Check if the cart has no items.
+        to_dict(): Return the cart contents and totals as a dict.
     """
 
     def __init__(self):
         self.items = {}  # Using dict with book title as key for easy lookup
+        self._total_cents = 0
+        self._total_items = 0
+        self.version = 0
 
     def add_book(self, book, quantity):
         if not isinstance(book, Book):
             return  # Safety check
         title = book.title
         if title in self.items:
-            self.items[title].quantity += quantity
+            item = self.items[title]
+            item.quantity += quantity
         else:
-            self.items[title] = CartItem(book, quantity)
+            item = self.items[title] = CartItem(book, quantity)
+        self._total_cents += item.unit_price_cents * quantity
+        self._total_items += quantity
+        self.version += 1
 
     def remove_book(self, book_title):
-        if book_title in self.items:
-            del self.items[book_title]
+        item = self.items.pop(book_title, None)
+        if item is not None:
+            self._total_cents -= item.get_total_price_cents()
+            self._total_items -= item.quantity
+            self.version += 1
 
     def update_quantity(self, book_title, quantity):
-        if book_title in self.items:
-            self.items[book_title].quantity = quantity
+        item = self.items.get(book_title)
+        if item is not None:
+            delta = quantity - item.quantity
+            item.quantity = quantity
+            self._total_cents += item.unit_price_cents * delta
+            self._total_items += delta
+            self.version += 1
 
     def get_total_price(self):
-        total = 0
-        for item in self.items.values():
-            total += item.quantity * item.book.price
-        return total
+        return self._total_cents / 100
+
+    def get_total_price_cents(self):
+        return self._total_cents
 
     def get_total_items(self):
-        return sum(item.quantity for item in self.items.values())
+        return self._total_items
 
     def clear(self):
         self.items = {}
+        self._total_cents = 0
+        self._total_items = 0
+        self.version += 1
 
     def get_items(self):
         return list(self.items.values())  # Convert dict values to list of CartItem objects
@@ -76,27 +313,269 @@ class Cart:
     def is_empty(self):
         return len(self.items) == 0
 
+    def to_dict(self):
+        return {
+            'items': [{'title': item.book.title, 'category': item.book.category, 'quantity': item.quantity,
+                       'price': item.unit_price_cents / 100, 'total_price': item.get_total_price()}
+                      for item in self.items.values()],
+            'total_items': self._total_items,
+            'total_price': self.get_total_price(),
+            'version': self.version
+        }
+
+
+class CartStore:
+    """
+    Thread-safe store of per-user carts keyed by session or user ID.
+
+    Carts are spread across shards, each guarded by its own lock, so requests
+    from different users rarely contend. Carts idle for longer than ttl seconds
+    are evicted when their shard is next swept, which happens at most once per
+    sweep_interval seconds on access, or on demand with evict_idle().
+
+    Methods:
+        get(key): Return the cart for key, creating it if needed.
+        find(key): Return the cart for key, or None if there is none.
+        lock(key): Return the lock that serializes multi-step updates to the cart for key.
+        discard(key): Drop the cart for key.
+        evict_idle(): Remove all idle carts and return how many were evicted.
+    """
+
+    def __init__(self, shards=16, ttl=3600, sweep_interval=60):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._shards = [_CartShard() for _ in range(shards)]
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _entry(self, key):
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            if now - shard.last_sweep > self.sweep_interval:
+                shard.sweep(now - self.ttl)
+                shard.last_sweep = now
+            entry = shard.carts.get(key)
+            if entry is None or entry[1] < now - self.ttl:
+                entry = [Cart(), now, threading.Lock()]
+                shard.carts[key] = entry
+            else:
+                entry[1] = now
+            return entry
+
+    def get(self, key):
+        return self._entry(key)[0]
+
+    def find(self, key):
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            entry = shard.carts.get(key)
+            if entry is None or entry[1] < now - self.ttl:
+                return None
+            entry[1] = now
+            return entry[0]
+
+    def lock(self, key):
+        return self._entry(key)[2]
+
+    def discard(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            shard.carts.pop(key, None)
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.ttl
+        evicted = 0
+        for shard in self._shards:
+            with shard.lock:
+                evicted += shard.sweep(cutoff)
+        return evicted
+
+    def __len__(self):
+        return sum(len(shard.carts) for shard in self._shards)
+
+
+class _CartShard:
+    """One lock-protected partition of a CartStore"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.carts = {}  # key -> [Cart, last access time, lock for multi-step updates]
+        self.last_sweep = time.monotonic()
+
+    def sweep(self, cutoff):
+        expired = [key for key, entry in self.carts.items() if entry[1] < cutoff]
+        for key in expired:
+            del self.carts[key]
+        return len(expired)
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords with werkzeug.security off the request thread.
+
+    The work is done in a process pool so slow hashes don't hold the GIL for
+    the web workers; workers=0 hashes inline instead. method is a werkzeug
+    method string including its cost, e.g. 'scrypt:32768:8:1' or
+    'pbkdf2:sha256:600000'. needs_rehash() reports hashes made with a
+    different method, so they can be upgraded on the next login.
+    """
+
+    def __init__(self, method='scrypt:32768:8:1', workers=2):
+        self.method = method
+        self.workers = workers
+        self._prefix = None  # The method as werkzeug writes it in hashes, e.g. 'scrypt:32768:8:1' for 'scrypt'
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _call(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    # Forking a threaded server can copy held locks into the workers, so start them clean
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('forkserver'))
+        return self._pool.submit(func, *args).result()
+
+    def hash(self, password):
+        return self._call(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._call(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        if self._prefix is None:
+            # Short forms like 'scrypt' or 'pbkdf2' are expanded by werkzeug, so learn the full form once
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
 
 class User:
     """User account management class"""
-    def __init__(self, email, password, name="", address=""):
+    hasher = PasswordHasher()  # Default for users created without one; apps pass their configured hasher
+
+    def __init__(self, email, password, name="", address="", password_hash=None, hasher=None):
         self.email = email
-        self.password = password
+        if hasher is not None:
+            self.hasher = hasher
+        # Pass password_hash (or password=None) to skip hashing when seeding accounts
+        if password_hash is None and password is not None:
+            password_hash = self.hasher.hash(password)
+        self.password_hash = password_hash
         self.name = name
         self.address = address
-        self.orders = []
+        self.order_ids = []  # Oldest first; an order's position is its history cursor
         self.temp_data = []
         self.cache = {}
+        # Order summary, maintained as orders are placed and confirmed
+        self.order_count = 0
+        self.lifetime_spend_cents = 0
+        self.last_order_date = None
+
+    def set_password(self, password):
+        self.password_hash = self.hasher.hash(password)
+
+    def check_password(self, password):
+        """Verify a password, upgrading the stored hash if the hashing cost has changed"""
+        if not self.password_hash or not password:
+            return False
+        if not self.hasher.verify(self.password_hash, password):
+            return False
+        if self.hasher.needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
     def add_order(self, order):
-        self.orders.append(order)  # Remove unnecessary sorting
+        self.order_ids.append(order.order_id)  # Orders themselves live in the app's order store
+        self.order_count += 1
+        self.last_order_date = order.order_date
+
+    def confirm_order(self, order):
+        """Count a confirmed order towards lifetime spend"""
+        self.lifetime_spend_cents += to_cents(order.total_amount)
+
+    @property
+    def lifetime_spend(self):
+        return self.lifetime_spend_cents / 100
+
+    def get_order_history(self, limit=10, before=None):
+        """Return up to limit order IDs placed before the cursor, newest first, and the cursor for the next page"""
+        end = len(self.order_ids) if before is None else max(0, min(before, len(self.order_ids)))
+        start = max(0, end - limit)
+        return self.order_ids[start:end][::-1], (start if start > 0 else None)
+
+class UserStore:
+    """
+    User accounts indexed by case-folded email address.
+
+    Registration, login and session lookups all go through one normalized
+    hash index, so checking for an existing account costs the same no matter
+    how many users there are.
+
+    Attributes:
+        hasher (PasswordHasher): Hashes the passwords of users created for this store.
+
+    Methods:
+        normalize(email): Return the index key for an email address.
+        get(email): Look up a user by email, ignoring case.
+        add(user): Add a user, raising ValueError if the email is taken.
+        bulk_load(users): Add many users at once, e.g. to seed test accounts.
+    """
+
+    def __init__(self, users=(), hasher=None):
+        self.hasher = hasher or User.hasher
+        self._users = {}  # normalized email -> User
+        self._lock = threading.Lock()
+        if users:
+            self.bulk_load(users)
+
+    @staticmethod
+    def normalize(email):
+        return email.strip().casefold()
+
+    def get(self, email):
+        if not email:
+            return None
+        return self._users.get(self.normalize(email))
+
+    def add(self, user):
+        key = self.normalize(user.email)
+        with self._lock:
+            if key in self._users:
+                raise ValueError(f'An account with email {user.email} already exists')
+            self._users[key] = user
+        return user
+
+    def bulk_load(self, users):
+        loaded = {self.normalize(user.email): user for user in users}
+        with self._lock:
+            duplicates = loaded.keys() & self._users.keys()
+            if duplicates:
+                raise ValueError(f'Accounts already exist for: {", ".join(sorted(duplicates))}')
+            self._users.update(loaded)
+        return len(loaded)
+
+    def __contains__(self, email):
+        return self.get(email) is not None
+
+    def __iter__(self):
+        return iter(list(self._users.values()))
+
+    def __len__(self):
+        return len(self._users)
 
-    def get_order_history(self):
-        return self.orders  # Return reference to original list
 
 class Order:
     """Order management class"""
-    def __init__(self, order_id, user_email, items, shipping_info, payment_info, total_amount):
+    def __init__(self, order_id, user_email, items, shipping_info, payment_info, total_amount, status="Confirmed"):
         self.order_id = order_id
         self.user_email = user_email
         self.items = items.copy()  # Copy of cart items
@@ -104,26 +583,42 @@ class Order:
         self.payment_info = payment_info
         self.total_amount = total_amount
         self.order_date = datetime.datetime.now()  # Keep datetime import at module level
-        self.status = "Confirmed"
+        self.status = status
     
     def to_dict(self):
         return {
             'order_id': self.order_id,
             'user_email': self.user_email,
-            'items': [{'title': item.book.title, 'quantity': item.quantity, 'price': item.book.price} for item in self.items],
+            'items': [{'title': item.book.title, 'quantity': item.quantity, 'price': item.book.price,
+                       'book_id': item.book.book_id, 'category': item.book.category, 'image': item.book.image}
+                      for item in self.items],
             'shipping_info': self.shipping_info,
+            'payment_info': self.payment_info,
             'total_amount': self.total_amount,
             'order_date': self.order_date.strftime('%Y-%m-%d %H:%M:%S'),
             'status': self.status
         }
 
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild an Order from to_dict() output, e.g. a record read back from the order log"""
+        items = [CartItem(Book(item['title'], item.get('category', ''), item['price'], item.get('image', ''),
+                               book_id=item.get('book_id')), item['quantity'])
+                 for item in data['items']]
+        order = cls(data['order_id'], data['user_email'], items, data['shipping_info'],
+                    data.get('payment_info', {}), data['total_amount'], data['status'])
+        order.order_date = datetime.datetime.strptime(data['order_date'], '%Y-%m-%d %H:%M:%S')
+        return order
+
 
 class PaymentGateway:
     """Mock payment gateway for processing payments"""
     
+    LATENCY = 0.1  # Seconds the mock gateway takes to approve a payment
+
     @staticmethod
-    def process_payment(payment_info):
-        """Mock payment processing - returns success/failure with mock logic"""
+    def process_payment(payment_info, timeout=None):
+        """Mock payment processing - returns success/failure with mock logic, giving up after timeout seconds"""
         card_number = payment_info.get('card_number', '')
         
         # Mock logic: cards ending in '1111' fail, others succeed
@@ -138,7 +633,14 @@ class PaymentGateway:
         import time
         import datetime
         
-        time.sleep(0.1)
+        if timeout is not None and timeout < PaymentGateway.LATENCY:
+            time.sleep(timeout)
+            return {
+                'success': False,
+                'message': 'Payment failed: the payment provider timed out',
+                'transaction_id': None
+            }
+        time.sleep(PaymentGateway.LATENCY)
         
         transaction_id = f"TXN{random.randint(100000, 999999)}"
         
@@ -151,22 +653,51 @@ class PaymentGateway:
             'transaction_id': transaction_id
         }
 
+    @staticmethod
+    def refund(transaction_id):
+        """Mock refund of a captured payment, e.g. one that was approved after its order had failed"""
+        return {
+            'success': True,
+            'message': 'Payment refunded',
+            'transaction_id': transaction_id
+        }
+
 
 class EmailService:
     """Mock email service for sending order confirmations"""
-    
+
+    SENDER = 'orders@bookstore.com'
+
+    @staticmethod
+    def build_order_confirmation(user_email, order):
+        """Build the order confirmation email as an EmailMessage"""
+        message = EmailMessage()
+        message['From'] = EmailService.SENDER
+        message['To'] = user_email
+        message['Subject'] = f"Order Confirmation - Order #{order.order_id}"
+        lines = [
+            f"Order Date: {order.order_date}",
+            f"Total Amount: ${order.total_amount:.2f}",
+            "Items:"
+        ]
+        for item in order.items:
+            lines.append(f"  - {item.book.title} x{item.quantity} @ ${item.book.price:.2f}")
+        lines.append(f"Shipping Address: {order.shipping_info.get('address', 'N/A')}")
+        message.set_content("\n".join(lines))
+        return message
+
     @staticmethod
     def send_order_confirmation(user_email, order):
         """Mock email sending - just prints to console in this implementation"""
-        print(f"\n=== EMAIL SENT ===")
-        print(f"To: {user_email}")
-        print(f"Subject: Order Confirmation - Order #{order.order_id}")
-        print(f"Order Date: {order.order_date}")
-        print(f"Total Amount: ${order.total_amount:.2f}")
-        print(f"Items:")
-        for item in order.items:
-            print(f"  - {item.book.title} x{item.quantity} @ ${item.book.price:.2f}")
-        print(f"Shipping Address: {order.shipping_info.get('address', 'N/A')}")
-        print(f"==================\n")
-        
+        message = EmailService.build_order_confirmation(user_email, order)
+        print(format_console_email(message))
         return True
+
+
+def format_console_email(message):
+    """Render an EmailMessage the way the console mock prints it"""
+    return (f"\n=== EMAIL SENT ===\n"
+            f"To: {message['To']}\n"
+            f"Subject: {message['Subject']}\n"
+            f"{message.get_content().rstrip()}\n"
+            f"==================\n")
@@ -0,0 +1,105 @@
+import base64
+import csv
+import io
+import json
+import zlib
+
+from order_store import order_key
+
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson; charset=utf-8'}
+CSV_COLUMNS = ('order_id', 'order_date', 'status', 'user_email', 'total_amount', 'payment_method',
+               'transaction_id', 'lines', 'units', 'items', 'cursor')
+CHUNK_SIZE = 64 * 1024  # Bytes of output buffered before each chunk is sent
+
+
+def encode_cursor(record):
+    """Return an opaque cursor that resumes an export right after this order"""
+    key = '|'.join(order_key(record))
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the (order_date, order_id) key inside a cursor, or raise ValueError"""
+    try:
+        key = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+    order_date, separator, order_id = key.partition('|')
+    if not separator or not order_id:
+        raise ValueError('Invalid cursor')
+    return order_date, order_id
+
+
+def select_orders(store, start=None, end=None, statuses=None, cursor=None, limit=None):
+    """
+    Yield the order records to export, oldest first.
+
+    start and end are inclusive dates, statuses a set of statuses, cursor a
+    value from encode_cursor() and limit the most orders to yield. Orders
+    before start or the cursor are skipped inside the store's scan, and the
+    scan stops at the first order after end.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    if start is not None:
+        # A bare date sorts before every timestamp on that day
+        after = max(after, (start.isoformat(), '')) if after else (start.isoformat(), '')
+    end = end.isoformat() if end is not None else None
+    count = 0
+    for record in store.scan(after):
+        if end is not None and record['order_date'][:10] > end:
+            return
+        if statuses and record['status'] not in statuses:
+            continue
+        if limit is not None and count >= limit:
+            return
+        count += 1
+        yield record
+
+
+def csv_row(record):
+    payment_info = record.get('payment_info') or {}
+    items = record['items']
+    return (
+        record['order_id'], record['order_date'], record['status'], record['user_email'],
+        f"{record['total_amount']:.2f}", payment_info.get('method') or '', payment_info.get('transaction_id') or '',
+        len(items), sum(item['quantity'] for item in items),
+        '; '.join(f"{item['title']} x{item['quantity']}" for item in items), encode_cursor(record)
+    )
+
+
+def stream_export(records, file_format, header=True, compress=False, chunk_size=CHUNK_SIZE):
+    """
+    Serialize records as CSV or JSONL and yield the output in chunks of bytes.
+
+    Rows are written into a small buffer that is flushed every chunk_size
+    bytes, and compression (gzip) runs incrementally on each chunk, so
+    memory use does not grow with the number of orders. Every row carries
+    the cursor that resumes the export after it; a CSV header is written
+    only if header is true, so resumed exports can be appended as they are.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if file_format == 'csv' else None
+
+    def flush():
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    if writer and header:
+        writer.writerow(CSV_COLUMNS)
+    for record in records:
+        if writer:
+            writer.writerow(csv_row(record))
+        else:
+            buffer.write(json.dumps(dict(record, cursor=encode_cursor(record)), separators=(',', ':')) + '\n')
+        if buffer.tell() >= chunk_size:
+            chunk = flush()
+            if chunk:
+                yield chunk
+    chunk = flush()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
@@ -0,0 +1,270 @@
+import contextlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows; there, only appends from one process are coordinated
+    fcntl = None
+
+# Record: payload length, key length, key bytes, JSON payload
+RECORD_HEADER = struct.Struct('>IB')
+
+# Checkpoint: magic, log length covered, entry count, then sorted (key, offset) entries
+CHECKPOINT_MAGIC = b'OLIX0001'
+CHECKPOINT_HEADER = struct.Struct('>8sQQ')
+KEY_WIDTH = 16
+CHECKPOINT_ENTRY = struct.Struct(f'>{KEY_WIDTH}sQ')
+
+
+class OrderLog:
+    """
+    Durable append-only journal of order records with group commit.
+
+    Each record is length-prefixed and carries its key (the order ID) in the
+    header, so the key -> offset index can be rebuilt by reading headers only.
+    Writers append under a lock and wait for a background thread to fsync.
+    That thread syncs at most once per sync_interval seconds, so under load
+    many appends share one fsync. sync_interval=0 syncs as soon as possible.
+
+    Appending a key again supersedes the earlier record, which is how status
+    changes are journaled.
+
+    Several processes may share one log, e.g. the workers of one deployment.
+    Appends and checkpoints hold an exclusive flock on the file. Before
+    appending, each process indexes the records the others wrote since it
+    last looked, so its offsets and checkpoints cover the whole log.
+
+    A checkpoint file stores the sorted index and how much of the log it
+    covers. On startup it is memory-mapped and binary-searched in place, and
+    only the log tail written after it is scanned. A new checkpoint is written
+    every checkpoint_every appends and on close().
+
+    Methods:
+        append(key, record, wait=True): Journal a record and return its offset.
+        read(key): Return the latest record for key, or None.
+        keys(): Return every key in the log.
+        checkpoint(): Write the current index to the checkpoint file.
+        close(): Sync, checkpoint and close the log.
+    """
+
+    def __init__(self, path, sync_interval=0.005, checkpoint_every=10000):
+        self.path = path
+        self.checkpoint_path = path + '.idx'
+        self.sync_interval = sync_interval
+        self.checkpoint_every = checkpoint_every
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'ab+')
+        self._cond = threading.Condition()
+        self._written = 0  # appends written to the file
+        self._synced = 0  # appends known to be on disk
+        self._since_checkpoint = 0
+        self._closed = False
+        self._checkpoint = (None, 0)  # (mmap of the checkpoint file, entry count)
+        self._tail = {}  # key -> offset for records after the checkpoint
+        self._indexed = 0  # Length of the log indexed so far
+        self._load_index()
+        self._flusher = threading.Thread(target=self._flush_loop, name='order-log-sync', daemon=True)
+        self._flusher.start()
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        """Hold the cross-process lock on the log file"""
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _load_index(self):
+        covered = self._map_checkpoint()
+        if covered is None or covered > os.path.getsize(self.path):
+            self._checkpoint = (None, 0)
+            covered = 0
+        with self._exclusive():
+            self._scan(covered, truncate=True)
+
+    def _catch_up(self):
+        """Index the records other processes appended since this one last did; call holding the file lock"""
+        if os.fstat(self._file.fileno()).st_size > self._indexed:
+            self._scan(self._indexed)
+
+    def _map_checkpoint(self):
+        """Memory-map the checkpoint file and return how much of the log it covers"""
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, 'rb') as f:
+            header = f.read(CHECKPOINT_HEADER.size)
+            if len(header) < CHECKPOINT_HEADER.size:
+                return None
+            magic, covered, count = CHECKPOINT_HEADER.unpack(header)
+            if magic != CHECKPOINT_MAGIC:
+                return None
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if count else None
+        self._checkpoint = (mapped, count)
+        return covered
+
+    def _scan(self, offset, truncate=False):
+        """Index records from offset to the end of the log, dropping a torn final record if truncate is set"""
+        size = os.fstat(self._file.fileno()).st_size
+        self._file.seek(offset)
+        while True:
+            header = self._file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            length, key_length = RECORD_HEADER.unpack(header)
+            key = self._file.read(key_length)
+            end = offset + RECORD_HEADER.size + key_length + length
+            if len(key) < key_length or end > size:
+                break
+            self._tail[key.decode()] = offset
+            offset = end
+            self._file.seek(offset)
+        if truncate:
+            self._file.truncate(offset)
+        self._indexed = offset
+
+    @staticmethod
+    def _entries(mapped, count):
+        for index in range(count):
+            yield CHECKPOINT_ENTRY.unpack_from(mapped, CHECKPOINT_HEADER.size + index * CHECKPOINT_ENTRY.size)
+
+    def _mapped_offset(self, key):
+        mapped, count = self._checkpoint
+        encoded = key.encode().ljust(KEY_WIDTH, b'\0')
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            position = CHECKPOINT_HEADER.size + middle * CHECKPOINT_ENTRY.size
+            entry_key, offset = CHECKPOINT_ENTRY.unpack_from(mapped, position)
+            if entry_key < encoded:
+                low = middle + 1
+            elif entry_key > encoded:
+                high = middle
+            else:
+                return offset
+        return None
+
+    def offset_of(self, key):
+        offset = self._tail.get(key)
+        if offset is None:
+            offset = self._mapped_offset(key)
+        return offset
+
+    def append(self, key, record, wait=True):
+        encoded_key = key.encode()
+        if len(encoded_key) > KEY_WIDTH:
+            raise ValueError(f'Order log keys are limited to {KEY_WIDTH} bytes: {key}')
+        payload = json.dumps(record, separators=(',', ':')).encode()
+        data = RECORD_HEADER.pack(len(payload), len(encoded_key)) + encoded_key + payload
+        with self._cond:
+            if self._closed:
+                raise ValueError('Order log is closed')
+            with self._exclusive():
+                self._catch_up()
+                offset = self._indexed
+                self._file.write(data)
+                self._file.flush()  # The record must be whole in the file before another process appends
+                self._indexed = offset + len(data)
+            self._tail[key] = offset
+            self._written += 1
+            sequence = self._written
+            self._cond.notify_all()
+            while wait and self._synced < sequence:
+                self._cond.wait()
+        return offset
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while self._written == self._synced and not self._closed:
+                    self._cond.wait()
+                if self._closed and self._written == self._synced:
+                    return
+            # Let concurrent appends join this commit before paying for the fsync
+            if self.sync_interval:
+                time.sleep(self.sync_interval)
+            self._sync()
+
+    def _sync(self):
+        with self._cond:
+            target = self._written
+            self._file.flush()
+        os.fsync(self._file.fileno())
+        with self._cond:
+            self._since_checkpoint += target - self._synced
+            self._synced = max(self._synced, target)
+            self._cond.notify_all()
+            due = self.checkpoint_every and self._since_checkpoint >= self.checkpoint_every
+        if due:
+            self.checkpoint()
+
+    def read(self, key):
+        offset = self.offset_of(key)
+        if offset is None:
+            # Another process may have written it since this one last appended
+            with self._cond:
+                with self._exclusive():
+                    self._catch_up()
+            offset = self.offset_of(key)
+        if offset is None:
+            return None
+        with self._cond:
+            self._file.flush()
+        header = os.pread(self._file.fileno(), RECORD_HEADER.size, offset)
+        length, key_length = RECORD_HEADER.unpack(header)
+        payload = os.pread(self._file.fileno(), length, offset + RECORD_HEADER.size + key_length)
+        return json.loads(payload)
+
+    def keys(self):
+        keys = set(self._tail)
+        keys.update(key.rstrip(b'\0').decode() for key, _ in self._entries(*self._checkpoint))
+        return keys
+
+    def checkpoint(self):
+        with self._cond:
+            self._file.flush()
+            with self._exclusive():
+                self._catch_up()
+            covered = self._indexed
+            tail = dict(self._tail)
+            self._since_checkpoint = 0
+        entries = dict(self._entries(*self._checkpoint))
+        for key, offset in tail.items():
+            entries[key.encode().ljust(KEY_WIDTH, b'\0')] = offset
+        temporary_path = f'{self.checkpoint_path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, covered, len(entries)))
+            for key in sorted(entries):
+                f.write(CHECKPOINT_ENTRY.pack(key, entries[key]))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.checkpoint_path)
+        # Serve checkpointed keys from the new map and drop them from the tail
+        with self._cond:
+            self._map_checkpoint()
+            for key, offset in tail.items():
+                if self._tail.get(key) == offset:
+                    del self._tail[key]
+        return len(entries)
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+        self._sync()
+        self.checkpoint()
+        self._file.close()
+
+    def __len__(self):
+        return len(self.keys())
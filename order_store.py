@@ -0,0 +1,284 @@
+import bisect
+import collections
+import datetime
+import heapq
+import itertools
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+from models import Order
+
+SEGMENT_NAME = re.compile(r'^segment-(\d{6})\.seg$')
+FOOTER_LENGTH = struct.Struct('>Q')
+
+
+class OrderStore:
+    """
+    Hot/cold order storage with a bounded LRU cache for archived orders.
+
+    New orders stay in memory (the hot tier). Orders that are older than
+    archive_after seconds and no longer Pending are moved into an immutable
+    segment file under directory. The segment holds zlib-compressed blocks of
+    block_size orders, and its footer maps each order ID to its block. Reads
+    of archived orders go through an LRU cache of cache_size orders, so
+    resident memory follows the working set rather than all-time sales.
+
+    Archiving runs on a background thread every archive_interval seconds
+    once start() is called, so writing a segment never delays add(), or on
+    demand with archive(). Segments are found again on startup.
+
+    Methods:
+        add(order): Store a new order in the hot tier.
+        get(order_id): Return an order from memory, the cache or a segment.
+        archive(): Move old, settled orders into a new segment.
+        scan(after=None): Yield every order as a dict, oldest first.
+        start(): Start archiving in the background.
+        stop(): Stop the background archiving.
+    """
+
+    def __init__(self, directory, archive_after=30 * 86400, cache_size=1024,
+                 archive_interval=60, block_size=64):
+        self.directory = directory
+        self.archive_after = archive_after
+        self.cache_size = cache_size
+        self.archive_interval = archive_interval
+        self.block_size = block_size
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._hot = {}  # order_id -> Order
+        self._hot_keys = []  # (order_date, order_id) of the hot orders, sorted, as checkouts can finish out of order
+        self._cache = OrderedDict()  # order_id -> archived Order, least recently used first
+        self._cold = {}  # order_id -> (segment number, block offset, block length)
+        self._segments = []  # Segment numbers, oldest first
+        self._bounds = {}  # segment number -> (first, last) order_key() in it, filled in as needed
+        self._next_segment = 1
+        self._archiving = False
+        self._stopping = threading.Event()
+        self._thread = None
+        self._load_segments()
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f'segment-{number:06d}.seg')
+
+    def _load_segments(self):
+        for name in sorted(os.listdir(self.directory)):
+            match = SEGMENT_NAME.match(name)
+            if not match:
+                continue
+            number = int(match.group(1))
+            for order_id, (offset, length) in self._read_footer(number).items():
+                self._cold[order_id] = (number, offset, length)
+            self._segments.append(number)
+            self._next_segment = max(self._next_segment, number + 1)
+
+    def add(self, order):
+        key = (order.order_date, order.order_id)
+        with self._lock:
+            previous = self._hot.get(order.order_id)
+            if previous is not None:
+                del self._hot_keys[bisect.bisect_left(self._hot_keys, (previous.order_date, order.order_id))]
+            self._hot[order.order_id] = order
+            if self._hot_keys and self._hot_keys[-1] > key:
+                bisect.insort(self._hot_keys, key)
+            else:
+                self._hot_keys.append(key)
+
+    def get(self, order_id):
+        with self._lock:
+            order = self._hot.get(order_id)
+            if order is not None:
+                return order
+            order = self._cache.get(order_id)
+            if order is not None:
+                self._cache.move_to_end(order_id)
+                return order
+            location = self._cold.get(order_id)
+        if location is None:
+            return None
+        order = self._read_archived(order_id, *location)
+        with self._lock:
+            self._cache[order_id] = order
+            self._cache.move_to_end(order_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return order
+
+    def _read_footer(self, number):
+        with open(self._segment_path(number), 'rb') as f:
+            f.seek(-FOOTER_LENGTH.size, os.SEEK_END)
+            footer_length, = FOOTER_LENGTH.unpack(f.read(FOOTER_LENGTH.size))
+            f.seek(-FOOTER_LENGTH.size - footer_length, os.SEEK_END)
+            return json.loads(zlib.decompress(f.read(footer_length)))
+
+    def _read_block(self, number, offset, length):
+        with open(self._segment_path(number), 'rb') as f:
+            f.seek(offset)
+            return json.loads(zlib.decompress(f.read(length)))
+
+    def _read_archived(self, order_id, number, offset, length):
+        return Order.from_dict(self._read_block(number, offset, length)[order_id])
+
+    def archive(self, now=None):
+        """Move settled orders older than archive_after into a new segment and return how many moved"""
+        cutoff = (now or datetime.datetime.now()) - datetime.timedelta(seconds=self.archive_after)
+        with self._lock:
+            if self._archiving:
+                return 0
+            candidates = []
+            for order_date, order_id in self._hot_keys:
+                if order_date >= cutoff:
+                    break  # The hot tier is kept in date order, so the rest are newer
+                order = self._hot[order_id]
+                if order.status != 'Pending':
+                    candidates.append(order)
+            if not candidates:
+                return 0
+            self._archiving = True
+            number = self._next_segment
+            self._next_segment += 1
+        try:
+            records = [(order.order_id, order.to_dict()) for order in candidates]
+            locations = self._write_segment(number, records)
+            with self._lock:
+                keys = [order_key(record) for _, record in records]
+                self._bounds[number] = (min(keys), max(keys))
+                for order in candidates:
+                    self._cold[order.order_id] = locations[order.order_id]
+                    del self._hot[order.order_id]
+                archived = set(locations)
+                self._hot_keys = [key for key in self._hot_keys if key[1] not in archived]
+                self._segments.append(number)
+        finally:
+            self._archiving = False
+        return len(candidates)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='order-archive', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.archive_interval):
+            self.archive()
+
+    def _write_segment(self, number, records):
+        footer = {}
+        locations = {}
+        path = self._segment_path(number)
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            for start in range(0, len(records), self.block_size):
+                block = dict(records[start:start + self.block_size])
+                data = zlib.compress(json.dumps(block, separators=(',', ':')).encode())
+                offset = f.tell()
+                f.write(data)
+                for order_id in block:
+                    footer[order_id] = (offset, len(data))
+                    locations[order_id] = (number, offset, len(data))
+            footer_data = zlib.compress(json.dumps(footer, separators=(',', ':')).encode())
+            f.write(footer_data)
+            f.write(FOOTER_LENGTH.pack(len(footer_data)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, path)
+        return locations
+
+    def scan(self, after=None):
+        """
+        Yield every order as a to_dict() record, ordered by (order_date, order_id).
+
+        Each segment and the hot tier are already in date order, so they are
+        merged lazily. A segment is only opened once the merge reaches
+        its earliest order, and it is read one block at a time, bypassing
+        the LRU cache. Segments hold consecutive stretches of time, so only
+        one or two are open at once and memory stays flat however many
+        orders there are. after is an (order_date, order_id) pair; only
+        orders that sort after it are yielded, which makes the key of the
+        last order seen a resumable cursor. Segments whose last order sorts
+        before the cursor are never opened, so resuming costs no more than
+        the segments still to come.
+        """
+        with self._lock:
+            segments = list(self._segments)
+            hot = [self._hot[order_id] for _, order_id in self._hot_keys]
+        after = tuple(after) if after is not None else None
+        pending = []
+        for number in segments:
+            first, last = self._segment_bounds(number)
+            if after is None or tuple(last) > after:
+                pending.append((first[0], number))
+        pending = collections.deque(sorted(pending))
+        heap = []
+        sequence = itertools.count()
+
+        def advance(run):
+            record = next(run, None)
+            if record is not None:
+                heapq.heappush(heap, (order_key(record), next(sequence), record, run))
+
+        advance(_by_key(order.to_dict() for order in hot))
+        while heap or pending:
+            # A bare date sorts before every key on that date, so no order is passed over
+            while pending and (not heap or (pending[0][0],) <= heap[0][0]):
+                advance(_by_key(self._scan_segment(pending.popleft()[1])))
+            key, _, record, run = heapq.heappop(heap)
+            if after is None or key > after:
+                yield record
+            advance(run)
+
+    def _segment_bounds(self, number):
+        """Return the first and last order_key() in a segment"""
+        bounds = self._bounds.get(number)
+        if bounds is None:
+            # Segments written before this process started: records are in date order,
+            # so the first and last blocks hold the oldest and newest orders
+            blocks = sorted(set(map(tuple, self._read_footer(number).values())))
+            first = [order_key(record) for record in self._read_block(number, *blocks[0]).values()]
+            last = [order_key(record) for record in self._read_block(number, *blocks[-1]).values()]
+            bounds = (min(first), max(last))
+            with self._lock:
+                self._bounds[number] = bounds
+        return bounds
+
+    def _scan_segment(self, number):
+        """Yield a segment's records block by block, reopening the file per block so idle runs hold no descriptor"""
+        blocks = sorted(set(map(tuple, self._read_footer(number).values())))
+        for offset, length in blocks:
+            yield from self._read_block(number, offset, length).values()
+
+    @property
+    def hot_count(self):
+        return len(self._hot)
+
+    @property
+    def cached_count(self):
+        return len(self._cache)
+
+    def __contains__(self, order_id):
+        return order_id in self._hot or order_id in self._cold
+
+    def __len__(self):
+        return len(self._hot) + len(self._cold)
+
+
+def order_key(record):
+    """Sort key of an order record; order_date strings sort chronologically"""
+    return record['order_date'], record['order_id']
+
+
+def _by_key(run):
+    """Sort the orders placed within the same second of a date-ordered run by order ID"""
+    for _, group in itertools.groupby(run, key=lambda record: record['order_date']):
+        yield from sorted(group, key=order_key)
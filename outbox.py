@@ -0,0 +1,116 @@
+import queue
+import smtplib
+import threading
+import time
+from contextlib import nullcontext
+
+from models import format_console_email
+
+
+class ConsoleTransport:
+    """Prints emails to the console, like the original EmailService mock"""
+
+    def send_batch(self, messages):
+        print("".join(format_console_email(message) for message in messages))
+
+
+class SMTPTransport:
+    """Delivers each batch over a single SMTP connection"""
+
+    def __init__(self, host='localhost', port=25, timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def send_batch(self, messages):
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            for message in messages:
+                smtp.send_message(message)
+
+
+class MemoryTransport:
+    """Collects delivered emails in memory; a local SMTP stand-in for tests"""
+
+    def __init__(self):
+        self.sent = []
+        self.batches = 0
+
+    def send_batch(self, messages):
+        self.sent.extend(messages)
+        self.batches += 1
+
+
+class EmailOutbox:
+    """
+    Queue of outgoing emails drained by a background worker.
+
+    enqueue() only appends to an in-memory queue, so callers never wait on
+    delivery. The worker takes up to batch_size messages at a time and hands
+    them to the transport in one call. A failed batch is retried up to
+    max_retries times with exponential backoff starting at retry_backoff
+    seconds. After that its messages go to the failed list. Each delivery
+    attempt is timed as the 'email_delivery' span when a metrics registry is
+    given.
+
+    Methods:
+        start(): Start the background worker.
+        enqueue(message): Queue an EmailMessage for delivery.
+        flush(): Block until every queued message has been handled.
+        stop(): Deliver what is queued and stop the worker.
+    """
+
+    def __init__(self, transport, batch_size=50, max_retries=5, retry_backoff=0.5, metrics=None):
+        self.transport = transport
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.failed = []
+        self._span = metrics.span if metrics is not None else nullcontext
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, message):
+        self._queue.put(message)
+
+    def flush(self):
+        self._queue.join()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = None in batch
+            messages = [message for message in batch if message is not None]
+            if messages:
+                self._deliver(messages)
+            for _ in batch:
+                self._queue.task_done()
+            if stopping:
+                return
+
+    def _deliver(self, messages):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._span('email_delivery'):
+                    self.transport.send_batch(messages)
+                return
+            except Exception as e:
+                print(f"Email batch of {len(messages)} failed (attempt {attempt + 1}): {e}")
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_backoff * 2 ** attempt)
+        self.failed.extend(messages)
@@ -0,0 +1,132 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from models import PaymentGateway
+
+
+class PaymentQueueFull(Exception):
+    """Raised when too many payments are already in flight"""
+
+
+class PaymentExecutor:
+    """
+    Runs payments through the gateway on a bounded thread pool.
+
+    submit() returns straight away so a web worker never waits on gateway
+    latency. At most max_workers payments talk to the gateway at once, and at
+    most max_pending may be queued or running before submit() refuses new ones.
+    The gateway is asked to give up after timeout seconds, and a background
+    sweep fails any payment still pending past its deadline and frees its
+    slot, so a hung gateway cannot block checkout.
+
+    Each payment finishes exactly once, and its callback is then called with a
+    result dict in the same shape PaymentGateway.process_payment() returns.
+    If the gateway answers a payment after it was failed, that late result is
+    passed to the payment's reconcile callback, e.g. to refund the charge.
+    Gateway calls are timed as the 'payment_gateway' span when a metrics
+    registry is given.
+
+    Methods:
+        submit(payment_id, payment_info, callback, reconcile=None): Queue a payment.
+        check(payment_id): Return True while a payment is still pending.
+        expire(now=None): Fail the payments whose deadline has passed.
+        shutdown(wait=True): Stop accepting payments and release the pool.
+    """
+
+    TIMEOUT_RESULT = {
+        'success': False,
+        'message': 'Payment failed: the payment provider timed out',
+        'transaction_id': None
+    }
+
+    def __init__(self, gateway=PaymentGateway, max_workers=4, max_pending=64, timeout=10.0, metrics=None):
+        self.gateway = gateway
+        self.timeout = timeout
+        self._span = metrics.span if metrics is not None else nullcontext
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='payment')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = {}  # payment_id -> (deadline, callback, reconcile)
+        self._expired = {}  # payment_id -> (reconcile, set once the timeout callback returned)
+        self._stopping = threading.Event()
+        self._sweeper = threading.Thread(target=self._sweep, name='payment-sweep', daemon=True)
+        self._sweeper.start()
+
+    def submit(self, payment_id, payment_info, callback, reconcile=None):
+        if not self._slots.acquire(blocking=False):
+            raise PaymentQueueFull('Too many payments are being processed, please try again shortly')
+        with self._lock:
+            self._pending[payment_id] = (time.monotonic() + self.timeout, callback, reconcile)
+        try:
+            self._pool.submit(self._run, payment_id, payment_info)
+        except RuntimeError:
+            self._slots.release()
+            with self._lock:
+                del self._pending[payment_id]
+            raise
+
+    def _run(self, payment_id, payment_info):
+        try:
+            with self._span('payment_gateway'):
+                result = self.gateway.process_payment(payment_info, timeout=self.timeout)
+        except Exception:
+            result = {
+                'success': False,
+                'message': 'Payment failed: the payment provider is unavailable',
+                'transaction_id': None
+            }
+        with self._lock:
+            entry = self._pending.pop(payment_id, None)
+            reconcile = self._expired.pop(payment_id, None) if entry is None else None
+        if entry is not None:
+            # Not failed by the sweep yet, so the gateway's answer stands even if it came late
+            self._slots.release()
+            entry[1](result)
+        elif reconcile is not None:
+            reconcile, failed = reconcile
+            failed.wait()  # Reconcile only after the order has been failed
+            reconcile(result)
+
+    def _expire_one(self, payment_id):
+        """Fail one pending payment, keeping its reconcile callback for a late gateway answer"""
+        failed = threading.Event()
+        with self._lock:
+            entry = self._pending.pop(payment_id, None)
+            if entry is None:
+                return
+            if entry[2] is not None:
+                self._expired[payment_id] = (entry[2], failed)
+        self._slots.release()
+        try:
+            entry[1](dict(self.TIMEOUT_RESULT))
+        finally:
+            failed.set()
+
+    def expire(self, now=None):
+        """Fail every payment past its deadline and return how many were failed"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            overdue = [payment_id for payment_id, entry in self._pending.items() if now > entry[0]]
+        for payment_id in overdue:
+            self._expire_one(payment_id)
+        return len(overdue)
+
+    def _sweep(self):
+        while not self._stopping.wait(min(self.timeout / 4, 1.0)):
+            self.expire()
+
+    def check(self, payment_id):
+        with self._lock:
+            entry = self._pending.get(payment_id)
+        if entry is None:
+            return False
+        if time.monotonic() > entry[0]:
+            self._expire_one(payment_id)
+            return False
+        return True
+
+    def shutdown(self, wait=True):
+        self._stopping.set()
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,156 @@
+import datetime
+import json
+import threading
+import weakref
+
+from models import to_cents
+
+
+class DiscountRule:
+    """
+    One compiled discount rule.
+
+    kind is 'percentage' (value is a percent) or 'fixed' (value is dollars).
+    A rule can be limited to one category, require a minimum spend in dollars
+    and expire after a date (inclusive, YYYY-MM-DD). Values are converted to
+    integer cents and basis points up front so quoting does integer math only.
+    """
+
+    KINDS = ('percentage', 'fixed')
+
+    def __init__(self, code, kind, value, category=None, min_spend=0, expires=None, label=None):
+        if kind not in self.KINDS:
+            raise ValueError(f'Unknown discount kind for {code}: {kind}')
+        if kind == 'percentage' and not 0 < value <= 100:
+            raise ValueError(f'Percentage discount for {code} must be above 0 and at most 100: {value}')
+        if kind == 'fixed' and value < 0:
+            raise ValueError(f'Fixed discount for {code} must not be negative: {value}')
+        self.code = code.upper()
+        self.kind = kind
+        self.basis_points = int(round(value * 100)) if kind == 'percentage' else 0
+        self.amount_cents = to_cents(value) if kind == 'fixed' else 0
+        self.category = category
+        self.min_spend_cents = to_cents(min_spend)
+        self.expires = datetime.date.fromisoformat(expires) if expires else None
+        self.label = label or f'{self.code} discount'
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['code'], data['kind'], data['value'], data.get('category'),
+                   data.get('min_spend', 0), data.get('expires'), data.get('label'))
+
+    def discount_cents(self, base_cents):
+        if self.kind == 'percentage':
+            return (base_cents * self.basis_points + 5000) // 10000
+        return min(self.amount_cents, base_cents)
+
+
+class Quote:
+    """The price of a cart with an optional discount code applied"""
+
+    def __init__(self, subtotal_cents, discount_cents=0, code=None, message=None, error=None):
+        self.subtotal_cents = subtotal_cents
+        self.discount_cents = discount_cents
+        self.total_cents = subtotal_cents - discount_cents
+        self.code = code
+        self.message = message
+        self.error = error
+
+    @property
+    def subtotal(self):
+        return self.subtotal_cents / 100
+
+    @property
+    def discount(self):
+        return self.discount_cents / 100
+
+    @property
+    def total(self):
+        return self.total_cents / 100
+
+    def to_dict(self):
+        return {
+            'subtotal': self.subtotal,
+            'discount': self.discount,
+            'total': self.total,
+            'discount_code': self.code,
+            'message': self.message,
+            'error': self.error
+        }
+
+
+class PricingEngine:
+    """
+    Prices carts against a table of discount rules indexed by code.
+
+    Rules are loaded from dicts or a JSON file and compiled once, so quoting is
+    one hash lookup plus a single pass over the cart's lines. Each cart's latest
+    quote is cached against the cart's version and the code. Asking again before
+    the cart changes costs nothing.
+
+    Methods:
+        load(rules): Replace the rule table with the given rule dicts.
+        load_file(path): Replace the rule table from a JSON list of rules.
+        quote(cart, code=None, today=None): Price a cart, returning a Quote.
+        quote_many(requests): Price a list of (cart, code) pairs.
+    """
+
+    def __init__(self, rules=()):
+        self._rules = {}  # code -> DiscountRule
+        self._version = 0
+        self._lock = threading.Lock()
+        self._quotes = weakref.WeakKeyDictionary()  # cart -> (cache key, Quote)
+        self.load(rules)
+
+    def load(self, rules):
+        compiled = {}
+        for data in rules:
+            rule = data if isinstance(data, DiscountRule) else DiscountRule.from_dict(data)
+            compiled[rule.code] = rule
+        with self._lock:
+            self._rules = compiled
+            self._version += 1
+
+    def load_file(self, path):
+        with open(path) as f:
+            self.load(json.load(f))
+
+    def quote(self, cart, code=None, today=None):
+        code = (code or '').strip().upper()
+        today = today or datetime.date.today()
+        key = (cart.version, code, self._version, today)
+        with self._lock:
+            cached = self._quotes.get(cart)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        quote = self._price(cart, code, today)
+        with self._lock:
+            self._quotes[cart] = (key, quote)
+        return quote
+
+    def _price(self, cart, code, today):
+        subtotal_cents = cart.get_total_price_cents()
+        if not code:
+            return Quote(subtotal_cents)
+        rule = self._rules.get(code)
+        if rule is None:
+            return Quote(subtotal_cents, code=code, error='Invalid discount code')
+        if rule.expires is not None and today > rule.expires:
+            return Quote(subtotal_cents, code=code, error='This discount code has expired')
+        if subtotal_cents < rule.min_spend_cents:
+            return Quote(subtotal_cents, code=code,
+                         error=f'Spend at least ${rule.min_spend_cents / 100:.2f} to use this discount code')
+        base_cents = subtotal_cents
+        if rule.category is not None:
+            base_cents = sum(item.get_total_price_cents() for item in cart.items.values()
+                             if item.book.category == rule.category)
+            if not base_cents:
+                return Quote(subtotal_cents, code=code,
+                             error='This discount code does not apply to the items in your cart')
+        discount_cents = rule.discount_cents(base_cents)
+        return Quote(subtotal_cents, discount_cents, code,
+                     message=f'{rule.label} applied! You saved ${discount_cents / 100:.2f}')
+
+    def quote_many(self, requests):
+        today = datetime.date.today()
+        return [self.quote(cart, code, today) for cart, code in requests]
@@ -0,0 +1,112 @@
+import cProfile
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+
+SAFE_NAME = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+class RequestProfiler:
+    """
+    Samples requests and runs them under cProfile, one request at a time.
+
+    start() decides whether the current request is profiled: a sample_rate
+    fraction of requests are, and so is any request that sends the trigger
+    header. Only one request is profiled at a time; a request that would
+    overlap a running profile is skipped, so profiling never piles up under
+    load. Each profile is dumped in pstats format to directory/<endpoint>/,
+    and only the newest max_profiles per endpoint are kept.
+
+    Methods:
+        start(force=False): Start profiling the current request if it is sampled.
+        stop(profile, endpoint): Stop a profile and dump it for the endpoint.
+        top(endpoint=None, limit=20, sort='cumulative'): Aggregate the hottest functions per endpoint.
+    """
+
+    SORT_KEYS = {'cumulative': 3, 'total': 2, 'calls': 1}  # index into the function stats tuple
+
+    def __init__(self, directory, sample_rate=0.01, max_profiles=200):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_profiles = max_profiles
+        self._busy = threading.Lock()
+
+    def start(self, force=False):
+        """Return a running profile for a sampled request, or None"""
+        if not force and random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Another profiler is active in this process
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile, endpoint):
+        try:
+            profile.disable()
+        finally:
+            self._busy.release()
+        directory = os.path.join(self.directory, SAFE_NAME.sub('_', endpoint))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{time.time():.6f}-{uuid.uuid4().hex[:8]}.prof')
+        profile.dump_stats(path)
+        self._prune(directory)
+        return path
+
+    def _prune(self, directory):
+        profiles = sorted(name for name in os.listdir(directory) if name.endswith('.prof'))
+        for name in profiles[:-self.max_profiles]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+    def endpoints(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory)
+                      if os.path.isdir(os.path.join(self.directory, name)))
+
+    def top(self, endpoint=None, limit=20, sort='cumulative'):
+        """
+        Merge the dumped profiles of each endpoint and return its hottest functions.
+
+        Returns {endpoint: {'requests': n, 'functions': [...]}} with up to limit
+        functions per endpoint, ordered by sort ('cumulative', 'total' or 'calls').
+        """
+        if sort not in self.SORT_KEYS:
+            raise ValueError(f'Unknown sort key: {sort}')
+        index = self.SORT_KEYS[sort]
+        report = {}
+        for name in ([SAFE_NAME.sub('_', endpoint)] if endpoint else self.endpoints()):
+            directory = os.path.join(self.directory, name)
+            if not os.path.isdir(directory):
+                continue
+            paths = [os.path.join(directory, profile) for profile in sorted(os.listdir(directory))
+                     if profile.endswith('.prof')]
+            if not paths:
+                continue
+            stats = pstats.Stats(*paths)
+            ranked = sorted(stats.stats.items(), key=lambda entry: entry[1][index], reverse=True)
+            report[name] = {
+                'requests': len(paths),
+                'functions': [
+                    {
+                        'function': pstats.func_std_string(function),
+                        'calls': calls,
+                        'primitive_calls': primitive_calls,
+                        'total_time': round(total_time, 6),
+                        'cumulative_time': round(cumulative_time, 6)
+                    }
+                    for function, (primitive_calls, calls, total_time, cumulative_time, _) in ranked[:limit]
+                ]
+            }
+        return report
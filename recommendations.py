@@ -0,0 +1,93 @@
+import heapq
+import threading
+
+
+class CoPurchaseIndex:
+    """
+    "Customers also bought" neighbours from incrementally counted co-purchases.
+
+    record() adds one order: every pair of distinct books in it gains a count
+    in a sparse, symmetric book x book table of dictionaries, so the cost of
+    an order depends on its own size only. Books whose counts changed are
+    marked dirty. refresh() recomputes the top k neighbours of the dirty
+    books only and publishes each list with a single dictionary assignment.
+    Reads never take the lock: looking up recommendations is one dictionary
+    read per book. A background thread calls refresh() every
+    refresh_interval seconds once start() is called.
+
+    Methods:
+        record(book_ids): Count the co-purchases of one order.
+        neighbors(book_id): Return the published top-k (book_id, count) pairs for a book.
+        recommend(book_ids, limit=5): Merge the neighbours of several books, excluding them.
+        refresh(): Recompute the neighbour lists of books whose counts changed.
+        start(): Start refreshing in the background.
+        stop(): Stop the background refresh.
+    """
+
+    def __init__(self, k=10, refresh_interval=30.0):
+        self.k = k
+        self.refresh_interval = refresh_interval
+        self.version = 0  # Incremented by every refresh that publishes new lists, e.g. for ETags
+        self._counts = {}  # book_id -> {other book_id: orders containing both}
+        self._dirty = set()
+        self._top = {}  # book_id -> tuple of (book_id, count), best first
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # One refresh at a time, so an older list never replaces a newer one
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def record(self, book_ids):
+        books = sorted(set(book_ids))
+        if len(books) < 2:
+            return
+        with self._lock:
+            for index, book_id in enumerate(books):
+                row = self._counts.get(book_id)
+                if row is None:
+                    row = self._counts[book_id] = {}
+                for other in books[:index] + books[index + 1:]:
+                    row[other] = row.get(other, 0) + 1
+            self._dirty.update(books)
+
+    def neighbors(self, book_id):
+        return self._top.get(book_id, ())
+
+    def recommend(self, book_ids, limit=5):
+        """Return up to limit book IDs most often bought with any of book_ids, best first"""
+        seeds = set(book_ids)
+        scores = {}
+        for book_id in seeds:
+            for other, count in self._top.get(book_id, ()):
+                if other not in seeds:
+                    scores[other] = scores.get(other, 0) + count
+        best = heapq.nsmallest(limit, scores.items(), key=lambda entry: (-entry[1], entry[0]))
+        return [book_id for book_id, _ in best]
+
+    def refresh(self):
+        """Publish fresh top-k lists for the dirty books and return how many were refreshed"""
+        with self._refresh_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                rows = {book_id: list(self._counts[book_id].items()) for book_id in dirty}
+            # Ranking happens outside the counting lock, so checkouts recording orders never wait on it
+            for book_id, row in rows.items():
+                self._top[book_id] = tuple(heapq.nsmallest(self.k, row, key=lambda entry: (-entry[1], entry[0])))
+            if rows:
+                self.version += 1
+            return len(rows)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='co-purchase-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.refresh_interval):
+            self.refresh()
@@ -0,0 +1,150 @@
+import bisect
+import heapq
+import re
+
+TOKEN = re.compile(r'\w+')
+NO_MATCHES = ()
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens"""
+    return TOKEN.findall(text.casefold())
+
+
+class SearchIndex:
+    """
+    Inverted index from words to book IDs with prefix completion.
+
+    Each book's title and category are tokenized into words, and every word
+    maps to a sorted list of the book IDs containing it. A query walks the
+    rarest word's list in ID order, binary-searching the others for each ID,
+    and stops as soon as limit books match, so a query of common words costs
+    about limit lookups rather than a pass over the catalog. The distinct words
+    are also kept in a sorted array, so completing a prefix is a binary search
+    followed by a short scan.
+
+    Books can be added and removed one at a time; the catalog keeps the index
+    in step with its own contents.
+
+    Methods:
+        add(book_id, *texts): Index a book under the words of the given texts.
+        add_many(documents): Index (book_id, *texts) tuples, sorting the vocabulary once.
+        remove(book_id): Drop a book from the index.
+        search(query, limit=20, prefix=False): Return matching book IDs in ascending order.
+    """
+
+    def __init__(self):
+        self._postings = {}  # word -> sorted list of book IDs
+        self._words = []  # sorted distinct words for prefix lookups
+        self._documents = {}  # book_id -> words, for removal and prefix filtering
+
+    def add(self, book_id, *texts):
+        for word in self._add_document(book_id, texts):
+            bisect.insort(self._words, word)
+
+    def add_many(self, documents):
+        new_words = []
+        for book_id, *texts in documents:
+            new_words.extend(self._add_document(book_id, texts))
+        if new_words:
+            self._words.extend(new_words)
+            self._words.sort()
+
+    def _add_document(self, book_id, texts):
+        """Record a book's postings and return the words that are new to the index"""
+        words = frozenset(tokenize(' '.join(texts)))
+        self._documents[book_id] = words
+        new_words = []
+        for word in words:
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = []
+                new_words.append(word)
+            if postings and postings[-1] > book_id:
+                bisect.insort(postings, book_id)
+            else:
+                postings.append(book_id)
+        return new_words
+
+    def remove(self, book_id):
+        for word in self._documents.pop(book_id, ()):
+            postings = self._postings[word]
+            del postings[bisect.bisect_left(postings, book_id)]
+            if not postings:
+                del self._postings[word]
+                del self._words[bisect.bisect_left(self._words, word)]
+
+    def search(self, query, limit=20, prefix=False):
+        """
+        Return up to limit IDs of books containing every word of the query.
+
+        With prefix=True the last word only has to start a word in the book,
+        which is what autocomplete needs while the user is still typing.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        partial = words.pop() if prefix else None
+        if not words:
+            return self._complete(partial, limit)
+        postings = sorted((self._postings.get(word, NO_MATCHES) for word in set(words)), key=len)
+        accept = None
+        if partial is not None:
+            completions = self._expand(partial, len(postings[0]))
+            if completions is None:
+                # The prefix matches more books than the rarest word: check each candidate's words
+                accept = lambda book_id: any(word.startswith(partial) for word in self._documents[book_id])
+            else:
+                postings.insert(0, completions)
+        return self._intersect(postings, limit, accept)
+
+    def _intersect(self, postings, limit, accept=None):
+        """Walk the first posting list in ID order and keep IDs found in all the others, up to limit"""
+        rarest, others = postings[0], postings[1:]
+        starts = [0] * len(others)  # IDs only grow, so each search resumes where the last one ended
+        matches = []
+        for book_id in rarest:
+            for index, other in enumerate(others):
+                position = starts[index] = bisect.bisect_left(other, book_id, starts[index])
+                if position == len(other):
+                    return matches
+                if other[position] != book_id:
+                    break
+            else:
+                if accept is None or accept(book_id):
+                    matches.append(book_id)
+                    if len(matches) >= limit:
+                        break
+        return matches
+
+    def _expand(self, partial, budget):
+        """Return the sorted IDs of books with a word starting with partial, or None if there are more than budget"""
+        lists = []
+        total = 0
+        position = bisect.bisect_left(self._words, partial)
+        while position < len(self._words) and self._words[position].startswith(partial):
+            postings = self._postings[self._words[position]]
+            total += len(postings)
+            if total > budget:
+                return None
+            lists.append(postings)
+            position += 1
+        return sorted(set().union(*lists))
+
+    def _complete(self, partial, limit):
+        """Collect IDs of books with a word starting with partial, stopping once limit are found"""
+        matches = set()
+        position = bisect.bisect_left(self._words, partial)
+        while position < len(self._words) and len(matches) < limit:
+            word = self._words[position]
+            if not word.startswith(partial):
+                break
+            for book_id in self._postings[word]:
+                matches.add(book_id)
+                if len(matches) >= limit:
+                    break
+            position += 1
+        return heapq.nsmallest(limit, matches)
+
+    def __len__(self):
+        return len(self._documents)
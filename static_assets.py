@@ -0,0 +1,87 @@
+import gzip
+import hashlib
+import os
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip variants are built
+    brotli = None
+
+
+class StaticAssets:
+    """
+    Content-hashed copies of the static folder with precompressed variants.
+
+    build() copies every file under source_dir into build_dir with a short
+    content hash in its name, e.g. styles.css -> styles.1a2b3c4d5e6f.css.
+    Because a name changes whenever the content changes, the copies can be
+    cached as immutable. Text assets also get .gz and, when the brotli package
+    is installed, .br variants. Files already built are skipped, so rebuilding
+    after a deploy only processes what changed.
+
+    Methods:
+        build(): Fingerprint and compress every static file.
+        fingerprinted(filename): Return the fingerprinted name for a static file.
+        resolve(name, accept_encodings): Return (path, encoding) of the best variant.
+    """
+
+    COMPRESSIBLE = {'.css', '.js', '.svg', '.html', '.txt', '.json', '.xml', '.map'}
+    HASH_LENGTH = 12
+
+    def __init__(self, source_dir, build_dir):
+        self.source_dir = source_dir
+        self.build_dir = build_dir
+        self.manifest = {}  # static filename -> fingerprinted name
+        self._encodings = {}  # fingerprinted name -> available encodings, best first
+
+    def build(self):
+        os.makedirs(self.build_dir, exist_ok=True)
+        for root, _, files in os.walk(self.source_dir):
+            for name in files:
+                source = os.path.join(root, name)
+                filename = os.path.relpath(source, self.source_dir).replace(os.sep, '/')
+                self._build_file(source, filename)
+        return len(self.manifest)
+
+    def _build_file(self, source, filename):
+        with open(source, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:self.HASH_LENGTH]
+        stem, extension = os.path.splitext(filename)
+        fingerprinted = f'{stem}.{digest}{extension}'
+        target = os.path.join(self.build_dir, fingerprinted)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        self._write_once(target, lambda: data)
+        encodings = []
+        if extension.lower() in self.COMPRESSIBLE:
+            if brotli is not None:
+                self._write_once(target + '.br', lambda: brotli.compress(data))
+                encodings.append('br')
+            self._write_once(target + '.gz', lambda: gzip.compress(data, 9, mtime=0))
+            encodings.append('gzip')
+        self.manifest[filename] = fingerprinted
+        self._encodings[fingerprinted] = encodings
+
+    @staticmethod
+    def _write_once(path, produce):
+        if os.path.exists(path):
+            return
+        # Workers sharing the build directory may race to write the same file; each writes its own copy
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(produce())
+        os.replace(temporary_path, path)
+
+    def fingerprinted(self, filename):
+        return self.manifest.get(filename.lstrip('/'))
+
+    def resolve(self, name, accept_encodings):
+        """Pick the best variant of a fingerprinted file for the client's Accept-Encoding"""
+        encodings = self._encodings.get(name)
+        if encodings is None:
+            return None, None
+        path = os.path.join(self.build_dir, name)
+        for encoding in encodings:
+            if accept_encodings[encoding]:
+                return f"{path}.{'br' if encoding == 'br' else 'gz'}", encoding
+        return path, None
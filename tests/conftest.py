@@ -1,24 +1,48 @@
 # conftest.py
+import os
+import tempfile
 import pytest
+
 import app
-from models import Cart
-from flask import Flask
 
-test_app = app.app
-test_app.config.update(
-    TESTING=True,
-    WTF_CSRF_ENABLED=False,
-    SERVER_NAME='localhost',
-    DEBUG=True
-)
+# Keep test orders and build output in a scratch directory rather than the instance folder
+DATA_DIR = tempfile.mkdtemp()
+test_app = app.create_app({
+    'TESTING': True,
+    'WTF_CSRF_ENABLED': False,
+    'SERVER_NAME': 'localhost',
+    'DEBUG': True,
+    'ORDER_LOG_PATH': os.path.join(DATA_DIR, 'orders.log'),
+    'ORDER_ARCHIVE_DIR': os.path.join(DATA_DIR, 'order-segments'),
+    'STATIC_BUILD_DIR': os.path.join(DATA_DIR, 'static-build'),
+    'PROFILE_DIR': os.path.join(DATA_DIR, 'profiles'),
+    'CATALOG_PATH': os.path.join(DATA_DIR, 'catalog.jsonl'),
+    'CATALOG_SNAPSHOT_PATH': os.path.join(DATA_DIR, 'catalog.snapshot'),
+    # Cheap hashing keeps the suite fast
+    'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+    'PASSWORD_HASH_WORKERS': 1
+})
+
+TEST_CART_ID = 'test-cart'
+
+@pytest.fixture
+def app_context():
+    """Let a test reach the app's subsystems, e.g. app.catalog, outside of requests"""
+    with test_app.app_context():
+        yield
+
+@pytest.fixture
+def flask_app():
+    return test_app
 
 @pytest.fixture(scope='function')
 def client():
-    if not hasattr(test_app, 'cart') or test_app.cart is None:
-        test_app.cart = Cart()
+    with test_app.app_context():
+        test_app.cart = app.cart_store.get(TEST_CART_ID)
     with test_app.test_client() as client:
         with client.session_transaction() as session:
             session['user_email'] = 'demo@bookstore.com'
+            session['cart_id'] = TEST_CART_ID
             client.application.cart.clear()
         client.application.config['APPLICATION_ROOT'] = '/'
         yield client
\ No newline at end of file
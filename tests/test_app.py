@@ -1,18 +1,20 @@
 # test_app.py
 import pytest
+import os
+import time
 import timeit
 import app
 from flask import Flask, request
 from bs4 import BeautifulSoup
 
 @pytest.fixture
-def mock_remove_app():
+def mock_remove_app(flask_app):
     mock_app = Flask(__name__)
     mock_app.config.update(
         TESTING=True,
         WTF_CSRF_ENABLED=False
     )
-    mock_app.cart = app.app.cart
+    mock_app.cart = flask_app.cart
     @mock_app.route('/remove-from-cart', methods=['POST'])
     def mock_remove_from_cart():
         title = request.form.get('title')
@@ -26,24 +28,45 @@ def test_homepage_loads(client):
     assert b'The Great Gatsby' in response.data
 
 def test_empty_catalog(client, monkeypatch):
-    monkeypatch.setattr('app.BOOKS', [])
+    from models import Catalog
+    monkeypatch.setattr('app.catalog', Catalog())
     response = client.get('/')
     assert response.status_code == 200
     assert b'<div class="book-list">' not in response.data or b'No books' in response.data
 
 def test_add_to_cart(client):
-    initial_items = len(app.cart.get_items())
+    initial_items = len(client.application.cart.get_items())
     response = client.post('/add_to_cart', data={'title': '1984', 'quantity': '2'}, follow_redirects=True)
     print(f"Add response: {response.status_code}, {response.data}")
     assert response.status_code == 200
-    global_cart = app.cart
-    items = global_cart.get_items()
+    user_cart = client.application.cart
+    items = user_cart.get_items()
     print(f"Cart items: {items}")
-    if not items:
-        print(f"Cart not updating. Checking app.cart: {app.cart.get_items()}")
     assert len(items) > initial_items
     if len(items) > initial_items:
-        global_cart.clear()
+        user_cart.clear()
+
+def test_catalog_indexes():
+    from models import Book, Catalog
+    catalog = Catalog([Book(f"Book {i}", "Even" if i % 2 == 0 else "Odd", i + 0.99, f"/images/{i}.jpg") for i in range(10)])
+    assert len(catalog) == 10
+    assert catalog.get_by_title("Book 3").book_id == 4
+    assert catalog.get(4).title == "Book 3"
+    assert "Book 9" in catalog and "Book 10" not in catalog
+    assert [book.title for book in catalog.by_category("Even")] == ["Book 0", "Book 2", "Book 4", "Book 6", "Book 8"]
+    assert [book.price for book in catalog.in_price_range(2, 5)] == [2.99, 3.99, 4.99]
+    catalog.remove(4)
+    assert catalog.get_by_title("Book 3") is None
+    assert [book.price for book in catalog.in_price_range(2, 5)] == [2.99, 4.99]
+    with pytest.raises(ValueError):
+        catalog.add(Book("Book 0", "Even", 1.0, "/images/0.jpg"))
+
+def test_catalog_lookup_performance():
+    from models import Book, Catalog
+    catalog = Catalog(Book(f"Book {i}", "Fiction", 9.99, "/images/book.jpg") for i in range(100000))
+    time = timeit.timeit(lambda: catalog.get_by_title("Book 99999"), number=10000)
+    print(f"Catalog lookup time: {time} seconds")
+    assert time < 0.1
 
 def test_update_negative_quantity(client):
     client.post('/add_to_cart', data={'title': 'The Great Gatsby', 'quantity': '1'}, follow_redirects=True)
@@ -60,11 +83,34 @@ def test_get_total_price_performance(client):
     assert time < 0.1
 
 def test_get_total_price_profile(client):
-    from app import cart
+    cart = client.application.cart
     cart.add_book(app.BOOKS[0], 1000)
 
-def test_remove_from_cart(mock_remove_app):
-    with app.app.test_client() as setup_client:
+def test_carts_are_per_user(client, flask_app):
+    client.post('/add_to_cart', data={'title': '1984', 'quantity': '2'}, follow_redirects=True)
+    with flask_app.test_client() as other_client:
+        with other_client.session_transaction() as session:
+            session['user_email'] = 'other@bookstore.com'
+        other_client.post('/add_to_cart', data={'title': 'Moby Dick', 'quantity': '1'}, follow_redirects=True)
+        with other_client.session_transaction() as session:
+            other_cart = app.cart_store.get(session['cart_id'])
+    assert [item.book.title for item in client.application.cart.get_items()] == ['1984']
+    assert [item.book.title for item in other_cart.get_items()] == ['Moby Dick']
+
+def test_cart_store_evicts_idle_carts():
+    from models import CartStore
+    store = CartStore(shards=4, ttl=0.05)
+    cart = store.get('user-1')
+    assert store.get('user-1') is cart
+    store.get('user-2')
+    assert len(store) == 2
+    time.sleep(0.1)
+    assert store.evict_idle() == 2
+    assert len(store) == 0
+    assert store.get('user-1') is not cart
+
+def test_remove_from_cart(mock_remove_app, flask_app):
+    with flask_app.test_client() as setup_client:
         setup_client.post('/add_to_cart', data={'title': 'The Great Gatsby', 'quantity': '1'}, follow_redirects=True)
     response = mock_remove_app.post('/remove-from-cart', data={'title': 'The Great Gatsby'}, follow_redirects=True)
     assert response.status_code == 200
@@ -76,11 +122,34 @@ def test_checkout_with_items(client):
     assert response.status_code == 200
     assert b'The Great Gatsby' in response.data
 
+def test_browsing_does_not_create_carts(app_context, flask_app):
+    visitor = flask_app.test_client()
+    book_id = app.get_book_by_title('1984').book_id
+    carts = len(app.cart_store)
+    for path in ('/', f'/book/{book_id}', '/search?q=moby', '/cart'):
+        response = visitor.get(path, follow_redirects=True)
+        assert response.status_code == 200, path
+        assert 'Set-Cookie' not in response.headers, path
+    with visitor.session_transaction() as session:
+        session['user_email'] = 'demo@bookstore.com'
+    assert visitor.get('/api/cart').get_json()['items'] == []
+    assert len(app.cart_store) == carts
+    visitor.post('/add_to_cart', data={'title': '1984', 'quantity': '1'})
+    assert len(app.cart_store) == carts + 1
+    assert b'1984' in visitor.get('/cart').data
+
 def test_register_user(client):
     response = client.post('/register', data={'email': 'new@bookstore.com', 'password': 'newpass', 'name': 'New User'}, follow_redirects=True)
     assert response.status_code == 200
     assert b'Account created successfully!' in response.data
 
+def test_register_race_on_the_same_email(client, monkeypatch):
+    from models import UserStore
+    monkeypatch.setattr(UserStore, '__contains__', lambda store, email: False)  # as if the other signup lands later
+    response = client.post('/register', data={'email': 'demo@bookstore.com', 'password': 'newpass', 'name': 'Twin'})
+    assert response.status_code == 200
+    assert b'An account with this email already exists' in response.data
+
 def test_login_user(client):
     response = client.post('/login', data={'email': 'demo@bookstore.com', 'password': 'demo123'}, follow_redirects=True)
     assert response.status_code == 200
@@ -92,6 +161,16 @@ def test_logout_user(client):
     assert response.status_code == 200
     assert b'Logged out successfully!' in response.data
 
+def wait_for_payment(client, timeout=5):
+    with client.session_transaction() as session:
+        order_id = session['last_order_id']
+    deadline = time.monotonic() + timeout
+    while True:
+        status = client.get(f'/order-status/{order_id}').get_json()
+        if status['status'] != 'Pending' or time.monotonic() > deadline:
+            return status
+        time.sleep(0.02)
+
 def test_order_confirmation(client):
     client.post('/add_to_cart', data={'title': 'The Great Gatsby', 'quantity': '1'}, follow_redirects=True)
     response = client.post('/process-checkout', data={
@@ -99,7 +178,76 @@ def test_order_confirmation(client):
         'zip_code': '12345', 'payment_method': 'credit_card', 'card_number': '1234567890123456',
         'expiry_date': '12/25', 'cvv': '123'}, follow_redirects=True)
     assert response.status_code == 200
-    assert b'Payment successful!' in response.data or b'confirmed' in response.data.lower()
+    assert b'Order placed!' in response.data
+    status = wait_for_payment(client)
+    assert status['status'] == 'Confirmed'
+    assert status['transaction_id'].startswith('TXN')
+    response = client.get(f"/order-confirmation/{status['order_id']}")
+    assert b'Order Confirmed!' in response.data
+
+def test_failed_payment_restores_cart(client):
+    client.post('/add_to_cart', data={'title': '1984', 'quantity': '2'}, follow_redirects=True)
+    client.post('/process-checkout', data={
+        'name': 'Test User', 'email': 'test@bookstore.com', 'address': 'Test St', 'city': 'Test City',
+        'zip_code': '12345', 'payment_method': 'credit_card', 'card_number': '1234567890121111',
+        'expiry_date': '12/25', 'cvv': '123'}, follow_redirects=True)
+    status = wait_for_payment(client)
+    assert status['status'] == 'Payment Failed'
+    assert 'Invalid card number' in status['message']
+    assert client.application.cart.get_total_items() == 2
+
+def test_payment_executor_limits_and_timeout():
+    import threading
+    from payments import PaymentExecutor, PaymentQueueFull
+    release = threading.Event()
+    timeouts = []
+
+    class SlowGateway:
+        @staticmethod
+        def process_payment(payment_info, timeout=None):
+            timeouts.append(timeout)
+            release.wait()
+            return {'success': True, 'message': 'ok', 'transaction_id': 'TXN1'}
+
+    results = {}
+    late = []
+    executor = PaymentExecutor(gateway=SlowGateway, max_workers=1, max_pending=2, timeout=0.05)
+    executor.submit('A', {}, lambda result: results.setdefault('A', result), late.append)
+    executor.submit('B', {}, lambda result: results.setdefault('B', result))
+    with pytest.raises(PaymentQueueFull):
+        executor.submit('C', {}, lambda result: results.setdefault('C', result))
+    assert executor.check('A')
+
+    # The sweep fails overdue payments and frees their slots without anyone polling
+    deadline = time.time() + 5
+    while len(results) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert 'timed out' in results['A']['message'] and 'timed out' in results['B']['message']
+    assert not executor.check('A')
+    executor.submit('C', {}, lambda result: results.setdefault('C', result))
+    assert timeouts == [0.05]
+
+    # The gateway's late answer for A goes to its reconcile callback instead of being dropped
+    release.set()
+    executor.shutdown()
+    assert late == [{'success': True, 'message': 'ok', 'transaction_id': 'TXN1'}]
+    assert 'C' in results
+
+def test_late_payment_is_refunded(app_context, monkeypatch):
+    from models import Book, CartItem, Order
+    refunds = []
+    monkeypatch.setattr(app.payment_executor.gateway, 'refund',
+                        lambda transaction_id: refunds.append(transaction_id) or {'success': True})
+    order = Order('LATE1', 'test@bookstore.com', [CartItem(Book("Late", "Fiction", 5.0, "/images/late.jpg"), 1)],
+                  {}, {'method': 'paypal', 'transaction_id': None, 'message': 'Payment failed: timed out'}, 5.0,
+                  status='Payment Failed')
+    app.reconcile_late_payment(order, {'success': False, 'message': 'declined', 'transaction_id': None})
+    assert refunds == []
+    app.reconcile_late_payment(order, {'success': True, 'message': 'ok', 'transaction_id': 'TXN9'})
+    assert refunds == ['TXN9']
+    assert order.status == 'Payment Failed'
+    assert order.payment_info['late_transaction_id'] == 'TXN9'
+    assert order.payment_info['message'].endswith('the late charge was refunded')
 
 def test_update_profile(client):
     client.post('/login', data={'email': 'demo@bookstore.com', 'password': 'demo123'}, follow_redirects=True)
@@ -137,7 +285,8 @@ def test_payment_with_paypal(client):
     soup = BeautifulSoup(response.data, 'html.parser')
     flash_messages = soup.find_all('div', {'class': 'flash-message'})
     print(f"Flash messages: {[message.text for message in flash_messages if message.text]}")
-    assert any('payment successful' in str(message.text).lower() for message in flash_messages if message.text)
+    assert any('order placed' in str(message.text).lower() for message in flash_messages if message.text)
+    assert wait_for_payment(client)['status'] == 'Confirmed'
 
 def test_case_insensitive_discount_code(client):
     client.post('/add_to_cart', data={'title': 'The Great Gatsby', 'quantity': '1'}, follow_redirects=True)
@@ -168,4 +317,1156 @@ def test_order_initialization(client):
     assert order.user_email == 'test@bookstore.com'
     assert order.items == items
     assert order.total_amount == 21.98
-    assert order.status == 'Confirmed'
\ No newline at end of file
+    assert order.status == 'Confirmed'
+
+def test_homepage_pagination(client, monkeypatch):
+    from models import Book, Catalog
+    monkeypatch.setattr('app.catalog', Catalog(Book(f"Book {i:03d}", "Fiction", 9.99, "/images/book.jpg") for i in range(50)))
+    response = client.get('/?per_page=20')
+    assert response.status_code == 200
+    assert b'Book 019' in response.data and b'Book 020' not in response.data
+    assert b'after=20' in response.data
+    response = client.get('/?after=20&page=2&per_page=20')
+    assert b'Book 020' in response.data and b'Book 039' in response.data and b'Book 040' not in response.data
+    response = client.get('/?page=3&per_page=20')
+    assert b'Book 049' in response.data and b'Next' not in response.data
+
+def test_homepage_streaming(client):
+    response = client.get('/?stream=1')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert b'The Great Gatsby' in response.data
+
+def test_cart_running_totals():
+    from models import Book, Cart
+    cart = Cart()
+    cheap = Book("Cheap", "Fiction", 0.1, "/images/cheap.jpg")
+    dear = Book("Dear", "Fiction", 0.2, "/images/dear.jpg")
+    cart.add_book(cheap, 3)
+    cart.add_book(dear, 1)
+    assert cart.get_total_price_cents() == 50
+    assert cart.get_total_price() == 0.5  # 3 * 0.1 + 0.2 would drift in floats
+    cart.update_quantity("Cheap", 1)
+    assert (cart.get_total_price_cents(), cart.get_total_items()) == (30, 2)
+    cart.remove_book("Dear")
+    assert (cart.get_total_price_cents(), cart.get_total_items()) == (10, 1)
+    cart.clear()
+    assert (cart.get_total_price_cents(), cart.get_total_items()) == (0, 0)
+
+def test_cart_totals_constant_time():
+    from models import Book, Cart
+    large_cart = Cart()
+    for i in range(5000):
+        large_cart.add_book(Book(f"Book {i}", "Fiction", 9.99, "/images/book.jpg"), 2)
+    time = timeit.timeit(lambda: (large_cart.get_total_price(), large_cart.get_total_items()), number=10000)
+    print(f"Totals time for 5000 lines: {time} seconds")
+    assert large_cart.get_total_items() == 10000
+    assert time < 0.05
+
+def test_checkout_queues_confirmation_email(app_context, client, monkeypatch):
+    from outbox import MemoryTransport
+    transport = MemoryTransport()
+    monkeypatch.setattr(app.email_outbox, 'transport', transport)
+    client.post('/add_to_cart', data={'title': 'Moby Dick', 'quantity': '1'}, follow_redirects=True)
+    client.post('/process-checkout', data={
+        'name': 'Test User', 'email': 'test@bookstore.com', 'address': 'Test St', 'city': 'Test City',
+        'zip_code': '12345', 'payment_method': 'paypal', 'card_number': '', 'expiry_date': '', 'cvv': ''},
+        follow_redirects=True)
+    status = wait_for_payment(client)
+    app.email_outbox.flush()
+    # Payments from earlier tests may still be finishing, so only look at this order's email
+    sent = [message for message in transport.sent if message['Subject'].endswith(status['order_id'])]
+    assert len(sent) == 1
+    assert sent[0]['To'] == 'test@bookstore.com'
+    assert 'Moby Dick x1 @ $12.49' in sent[0].get_content()
+
+def test_email_outbox_batches_and_retries():
+    from email.message import EmailMessage
+    from outbox import EmailOutbox, MemoryTransport
+
+    class FlakyTransport(MemoryTransport):
+        def send_batch(self, messages):
+            if self.batches == 0:
+                self.batches += 1
+                raise ConnectionError('SMTP server unavailable')
+            super().send_batch(messages)
+
+    transport = FlakyTransport()
+    outbox = EmailOutbox(transport, batch_size=10, retry_backoff=0.01)
+    for i in range(25):
+        message = EmailMessage()
+        message['Subject'] = f'Message {i}'
+        outbox.enqueue(message)
+    outbox.start()
+    outbox.stop()
+    assert [message['Subject'] for message in transport.sent] == [f'Message {i}' for i in range(25)]
+    assert transport.batches == 4  # one failed attempt, then three batches of at most 10
+    assert outbox.failed == []
+
+def test_email_lookup_is_case_insensitive(client):
+    response = client.post('/register', data={'email': 'Case@Bookstore.com', 'password': 'casepass', 'name': 'Case User'}, follow_redirects=True)
+    assert b'Account created successfully!' in response.data
+    response = client.post('/register', data={'email': 'CASE@bookstore.COM', 'password': 'other', 'name': 'Other'}, follow_redirects=True)
+    assert b'An account with this email already exists' in response.data
+    response = client.post('/login', data={'email': 'case@BOOKSTORE.com', 'password': 'casepass'}, follow_redirects=True)
+    assert b'Logged in successfully!' in response.data
+    assert b'Hello, Case User!' in response.data
+
+def test_user_store_lookup_performance():
+    from models import User, UserStore
+    store = UserStore()
+    assert store.bulk_load(User(f"user{i}@bookstore.com", None) for i in range(100000)) == 100000
+    with pytest.raises(ValueError):
+        store.add(User("USER5@bookstore.com", None))
+    time = timeit.timeit(lambda: "User99999@Bookstore.com" in store, number=10000)
+    print(f"User lookup time: {time} seconds")
+    assert time < 0.1
+
+def test_password_is_hashed_and_rehashed_on_login():
+    from models import User, PasswordHasher
+    original_hasher = User.hasher
+    try:
+        User.hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=0)
+        user = User("hash@bookstore.com", "secret")
+        assert user.password_hash.startswith('pbkdf2:sha256:1000$')
+        assert 'secret' not in user.password_hash
+        assert not user.check_password("wrong")
+        User.hasher = PasswordHasher(method='pbkdf2:sha256:2000', workers=0)
+        assert user.check_password("secret")
+        assert user.password_hash.startswith('pbkdf2:sha256:2000$')
+        assert user.check_password("secret")
+    finally:
+        User.hasher = original_hasher
+
+def test_short_hash_methods_do_not_rehash_every_login():
+    from models import PasswordHasher
+    for method in ('pbkdf2', 'pbkdf2:sha256', 'scrypt'):
+        hasher = PasswordHasher(method=method, workers=0)
+        assert not hasher.needs_rehash(hasher.hash("secret")), method
+    assert PasswordHasher(method='pbkdf2:sha256:2000', workers=0).needs_rehash(
+        PasswordHasher(method='pbkdf2:sha256:1000', workers=0).hash("secret"))
+
+def test_password_hash_throughput():
+    from models import PasswordHasher
+    for iterations in (1000, 10000, 100000):
+        hasher = PasswordHasher(method=f'pbkdf2:sha256:{iterations}', workers=2)
+        password_hash = hasher.hash("secret")
+        logins = 20
+        time = timeit.timeit(lambda: hasher.verify(password_hash, "secret"), number=logins)
+        hasher.shutdown()
+        print(f"pbkdf2:sha256:{iterations}: {logins / time:.0f} logins/sec")
+        assert time < 10
+
+def test_order_log_survives_restart(tmp_path):
+    from order_log import OrderLog
+    path = str(tmp_path / 'orders.log')
+    log = OrderLog(path, sync_interval=0.001, checkpoint_every=3)
+    for i in range(5):
+        log.append(f'ORDER{i}', {'order_id': f'ORDER{i}', 'status': 'Pending'})
+    log.append('ORDER1', {'order_id': 'ORDER1', 'status': 'Confirmed'})
+    log.close()
+
+    # Simulate a crash halfway through writing one more record
+    with open(path, 'ab') as f:
+        f.write(b'\x00\x00\x01\x00\x06ORDER9{"partial')
+
+    log = OrderLog(path, checkpoint_every=0)
+    assert log.read('ORDER1') == {'order_id': 'ORDER1', 'status': 'Confirmed'}
+    assert log.read('ORDER4')['status'] == 'Pending'
+    assert log.read('ORDER9') is None
+    assert log.keys() == {f'ORDER{i}' for i in range(5)}
+    log.append('ORDER5', {'order_id': 'ORDER5', 'status': 'Pending'})
+    assert log.read('ORDER5')['status'] == 'Pending'
+    log.close()
+
+def test_order_log_group_commit(tmp_path, monkeypatch):
+    import os
+    import threading
+    from order_log import OrderLog
+    fsyncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr('order_log.os.fsync', lambda fd: (fsyncs.append(fd), real_fsync(fd)))
+    log = OrderLog(str(tmp_path / 'orders.log'), sync_interval=0.02, checkpoint_every=0)
+    threads = [threading.Thread(target=log.append, args=(f'ORDER{i}', {'n': i})) for i in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"50 appends took {len(fsyncs)} fsyncs")
+    assert len(fsyncs) < 50
+    assert log.read('ORDER49') == {'n': 49}
+    log.close()
+
+def test_order_log_shared_by_workers(tmp_path):
+    import threading
+    from order_log import OrderLog
+    path = str(tmp_path / 'orders.log')
+    workers = [OrderLog(path, sync_interval=0), OrderLog(path, sync_interval=0)]  # separate file handles
+
+    def place(worker, prefix):
+        for i in range(200):
+            worker.append(f'{prefix}{i}', {'order_id': f'{prefix}{i}', 'status': 'Pending'}, wait=False)
+
+    threads = [threading.Thread(target=place, args=(worker, prefix)) for worker, prefix in zip(workers, 'AB')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Each worker reads the other's orders, and its checkpoint covers both
+    assert workers[0].read('B199') == {'order_id': 'B199', 'status': 'Pending'}
+    workers[1].append('A5', {'order_id': 'A5', 'status': 'Confirmed'})
+    assert workers[0].checkpoint() == 400
+    for worker in workers:
+        worker.close()
+    reopened = OrderLog(path)
+    assert len(reopened) == 400
+    assert all(reopened.read(f'{prefix}{i}')['order_id'] == f'{prefix}{i}' for prefix in 'AB' for i in range(200))
+    assert reopened.read('A5')['status'] == 'Confirmed'
+    reopened.close()
+
+def test_orders_are_read_back_from_the_log(client, monkeypatch, tmp_path):
+    client.post('/add_to_cart', data={'title': '1984', 'quantity': '3'}, follow_redirects=True)
+    client.post('/process-checkout', data={
+        'name': 'Test User', 'email': 'test@bookstore.com', 'address': 'Test St', 'city': 'Test City',
+        'zip_code': '12345', 'payment_method': 'credit_card', 'card_number': '1234567890123456',
+        'expiry_date': '12/25', 'cvv': '123'}, follow_redirects=True)
+    order_id = wait_for_payment(client)['order_id']
+    from order_store import OrderStore
+    monkeypatch.setattr('app.orders', OrderStore(str(tmp_path)))  # As if the app had restarted
+    response = client.get(f'/order-confirmation/{order_id}')
+    assert response.status_code == 200
+    assert b'Order Confirmed!' in response.data
+    assert b'Quantity: 3' in response.data
+
+def test_order_history_pagination_and_summary():
+    from models import Book, CartItem, Order, User
+    user = User("history@bookstore.com", None)
+    book = Book("History", "Fiction", 10.10, "/images/history.jpg")
+    for i in range(25):
+        order = Order(f"ORDER{i:02d}", user.email, [CartItem(book, 1)], {}, {}, 10.10)
+        user.add_order(order)
+        if i % 2 == 0:
+            user.confirm_order(order)
+    assert user.order_count == 25
+    assert user.lifetime_spend_cents == 13 * 1010
+    assert user.last_order_date == order.order_date
+    page, before = user.get_order_history(limit=10)
+    assert page == [f"ORDER{i:02d}" for i in range(24, 14, -1)]
+    page, before = user.get_order_history(limit=10, before=before)
+    assert page == [f"ORDER{i:02d}" for i in range(14, 4, -1)]
+    page, before = user.get_order_history(limit=10, before=before)
+    assert page == [f"ORDER{i:02d}" for i in range(4, -1, -1)]
+    assert before is None
+
+def test_session_for_a_missing_user_is_logged_out(client):
+    with client.session_transaction() as session:
+        session['user_email'] = 'gone@bookstore.com'  # e.g. registered before a restart
+    for path in ('/account', '/account/orders'):
+        response = client.get(path)
+        assert response.status_code == 302 and response.headers['Location'].endswith('/login')
+    with client.session_transaction() as session:
+        assert 'user_email' not in session
+
+def test_account_order_history(client):
+    client.post('/login', data={'email': 'demo@bookstore.com', 'password': 'demo123'}, follow_redirects=True)
+    for _ in range(2):
+        client.post('/add_to_cart', data={'title': 'I Ching', 'quantity': '1'}, follow_redirects=True)
+        client.post('/process-checkout', data={
+            'name': 'Test User', 'email': 'test@bookstore.com', 'address': 'Test St', 'city': 'Test City',
+            'zip_code': '12345', 'payment_method': 'credit_card', 'card_number': '1234567890123456',
+            'expiry_date': '12/25', 'cvv': '123'}, follow_redirects=True)
+        last_order_id = wait_for_payment(client)['order_id']
+    data = client.get('/account/orders?limit=1').get_json()
+    assert [order['order_id'] for order in data['orders']] == [last_order_id]
+    assert data['next_before'] is not None
+    assert data['summary']['order_count'] == len(app.users.get('demo@bookstore.com').order_ids)
+    older = client.get(f"/account/orders?limit=1&before={data['next_before']}").get_json()
+    assert older['orders'][0]['order_id'] != last_order_id
+    response = client.get('/account?limit=1')
+    assert response.status_code == 200
+    assert f'Order #{last_order_id}'.encode() in response.data
+    assert b'Older Orders' in response.data
+    assert f'/account?before={data["next_before"]}&amp;limit=1'.encode() in response.data
+
+def test_order_store_archives_in_the_background(tmp_path):
+    import datetime
+    from models import Book, CartItem, Order
+    from order_store import OrderStore
+    store = OrderStore(str(tmp_path), archive_after=3600, archive_interval=0.01)
+    order = Order("BG1", "test@bookstore.com", [CartItem(Book("Archive", "Fiction", 5.00, "/images/archive.jpg"), 1)],
+                  {}, {}, 5.0, status='Confirmed')
+    order.order_date = datetime.datetime.now() - datetime.timedelta(days=2)
+    store.add(order)
+    assert store.hot_count == 1  # add() never writes a segment itself
+    store.start()
+    try:
+        deadline = time.time() + 5
+        while store.hot_count and time.time() < deadline:
+            time.sleep(0.01)
+        assert store.hot_count == 0 and store.get("BG1").total_amount == 5.0
+    finally:
+        store.stop()
+
+def test_order_store_handles_orders_added_out_of_date_order(tmp_path):
+    import datetime
+    from models import Book, CartItem, Order
+    from order_store import OrderStore
+    store = OrderStore(str(tmp_path), archive_after=3600)
+    book = Book("Archive", "Fiction", 5.00, "/images/archive.jpg")
+    now = datetime.datetime.now()
+    for order_id, age in (("LATE", datetime.timedelta(minutes=1)), ("EARLY", datetime.timedelta(days=2))):
+        order = Order(order_id, "test@bookstore.com", [CartItem(book, 1)], {}, {}, 5.0, status='Confirmed')
+        order.order_date = now - age
+        store.add(order)  # The older checkout finished second
+    assert [record['order_id'] for record in store.scan()] == ["EARLY", "LATE"]
+    assert store.archive() == 1
+    assert store.hot_count == 1 and "EARLY" in store and store.get("EARLY").total_amount == 5.0
+    assert [record['order_id'] for record in store.scan()] == ["EARLY", "LATE"]
+
+def test_order_scan_skips_segments_before_the_cursor(tmp_path):
+    import datetime
+    from models import Book, CartItem, Order
+    from order_store import OrderStore, order_key
+    store = OrderStore(str(tmp_path), archive_after=3600, block_size=8)
+    book = Book("Ledger", "Reference", 4.50, "/images/ledger.jpg")
+    for i in range(400):
+        order = Order(f"SK{i:04d}", "finance@bookstore.com", [CartItem(book, 1)], {}, {}, 4.50, status='Confirmed')
+        order.order_date = datetime.datetime(2026, 1, 1) + datetime.timedelta(hours=i)
+        store.add(order)
+        if i % 100 == 99:
+            store.archive(now=datetime.datetime(2027, 1, 1))
+    records = list(store.scan())
+    cursor = order_key(records[349])
+
+    # Reopened, as after a restart, so segment bounds are read from the files
+    store = OrderStore(str(tmp_path))
+    opened = []
+    scan_segment = store._scan_segment
+    store._scan_segment = lambda number: opened.append(number) or scan_segment(number)
+    assert [record['order_id'] for record in store.scan(after=cursor)] == [f"SK{i:04d}" for i in range(350, 400)]
+    assert opened == [4]
+
+def test_order_store_archives_old_orders(tmp_path):
+    import datetime
+    from models import Book, CartItem, Order
+    from order_store import OrderStore
+    store = OrderStore(str(tmp_path), archive_after=3600, cache_size=2, block_size=4)
+    book = Book("Archive", "Fiction", 5.00, "/images/archive.jpg")
+    old_date = datetime.datetime.now() - datetime.timedelta(days=2)
+    for i in range(10):
+        order = Order(f"OLD{i}", "test@bookstore.com", [CartItem(book, i + 1)], {'city': 'Old Town'}, {}, 5.0 * (i + 1),
+                      status='Pending' if i == 9 else 'Confirmed')
+        order.order_date = old_date
+        store.add(order)
+    store.add(Order("NEW", "test@bookstore.com", [CartItem(book, 1)], {}, {}, 5.0))
+    assert store.archive() == 9
+    assert store.hot_count == 2  # the new order and the still pending one
+    assert store.get("OLD3").items[0].quantity == 4
+    assert store.get("OLD3").shipping_info == {'city': 'Old Town'}
+    for order_id in ("OLD0", "OLD1", "OLD2"):
+        store.get(order_id)
+    assert store.cached_count == 2
+
+    # Segments are found again after a restart
+    restarted = OrderStore(str(tmp_path))
+    assert restarted.get("OLD8").total_amount == 45.0
+    assert "OLD9" not in restarted and len(restarted) == 9
+
+def test_pricing_engine_rules():
+    import datetime
+    from models import Book, Cart
+    from pricing import PricingEngine
+    engine = PricingEngine([
+        {'code': 'FIVEOFF', 'kind': 'fixed', 'value': 5, 'min_spend': 20},
+        {'code': 'FICTION50', 'kind': 'percentage', 'value': 50, 'category': 'Fiction'},
+        {'code': 'OLD', 'kind': 'percentage', 'value': 10, 'expires': '2020-01-01'}
+    ])
+    cart = Cart()
+    cart.add_book(Book("Novel", "Fiction", 10.00, "/images/novel.jpg"), 1)
+    cart.add_book(Book("Atlas", "Reference", 9.99, "/images/atlas.jpg"), 1)
+    assert engine.quote(cart).total_cents == 1999
+    assert engine.quote(cart, 'fiveoff').error.startswith('Spend at least $20.00')
+    assert engine.quote(cart, 'FICTION50').total_cents == 1499
+    assert engine.quote(cart, 'OLD', today=datetime.date(2021, 1, 1)).error == 'This discount code has expired'
+    assert engine.quote(cart, 'NOPE').error == 'Invalid discount code'
+    cart.update_quantity("Atlas", 2)
+    quote = engine.quote(cart, 'FIVEOFF')
+    assert (quote.subtotal_cents, quote.discount_cents, quote.total_cents) == (2998, 500, 2498)
+    assert engine.quote(cart, 'FIVEOFF') is quote  # cached until the cart changes
+    cart.add_book(Book("Novel", "Fiction", 10.00, "/images/novel.jpg"), 1)
+    assert engine.quote(cart, 'FIVEOFF') is not quote
+
+def test_discount_rules_reject_out_of_range_values():
+    from pricing import DiscountRule
+    for value in (0, -5, 100.5, 150):
+        with pytest.raises(ValueError):
+            DiscountRule('BAD', 'percentage', value)
+    with pytest.raises(ValueError):
+        DiscountRule('BAD', 'fixed', -1)
+    assert DiscountRule('ALL', 'percentage', 100).discount_cents(1999) == 1999
+    assert DiscountRule('NONE', 'fixed', 0).discount_cents(1999) == 0
+
+def test_batch_quotes(client):
+    response = client.post('/api/quotes', json={'carts': [
+        {'items': [{'title': 'The Great Gatsby', 'quantity': 2}], 'discount_code': 'save10'},
+        {'items': [{'title': '1984', 'quantity': 1}, {'title': 'Moby Dick', 'quantity': 1}]},
+        {'items': [{'title': '1984', 'quantity': 1}], 'discount_code': 'BOGUS'}
+    ]})
+    assert response.status_code == 200
+    quotes = response.get_json()['quotes']
+    assert [quote['total'] for quote in quotes] == [19.78, 21.48, 8.99]
+    assert quotes[0]['discount'] == 2.20
+    assert quotes[2]['error'] == 'Invalid discount code'
+    response = client.post('/api/quotes', json={'carts': [{'items': [{'title': 'Missing', 'quantity': 1}]}]})
+    assert response.status_code == 400
+    for body in (['x'], {'carts': ['x']}, {'carts': [{'items': 'x'}]}, {'carts': [{'items': ['x']}]},
+                 {'carts': [{'items': [{'title': ['1984'], 'quantity': 1}]}]},
+                 {'carts': [{'items': [], 'discount_code': ['SAVE10']}]}):
+        assert client.post('/api/quotes', json=body).status_code == 400, body
+
+def test_cart_api_batches_operations(client):
+    response = client.post('/api/cart', json={'operations': [
+        {'op': 'add', 'title': '1984', 'quantity': 2},
+        {'op': 'add', 'title': 'Moby Dick', 'quantity': 1},
+        {'op': 'add', 'title': 'I Ching', 'quantity': 1},
+        {'op': 'update', 'title': '1984', 'quantity': 3},
+        {'op': 'remove', 'title': 'I Ching'}
+    ], 'discount_code': 'SAVE10'})
+    assert response.status_code == 200
+    state = response.get_json()
+    assert [(item['title'], item['quantity']) for item in state['items']] == [('1984', 3), ('Moby Dick', 1)]
+    assert state['total_items'] == 4
+    assert state['total_price'] == 39.46
+    assert state['quote']['total'] == 35.51
+    assert client.application.cart.get_total_items() == 4
+
+def test_cart_api_rejects_whole_batch(client):
+    client.post('/api/cart', json={'operations': [{'op': 'add', 'title': '1984', 'quantity': 1}]})
+    response = client.post('/api/cart', json={'operations': [
+        {'op': 'clear'},
+        {'op': 'add', 'title': 'Not A Book', 'quantity': 1}
+    ]})
+    assert response.status_code == 400
+    assert 'Operation 1' in response.get_json()['error']
+    assert client.application.cart.get_total_items() == 1
+    assert client.get('/api/cart').get_json()['items'][0]['title'] == '1984'
+
+def test_cart_api_rejects_malformed_bodies(client):
+    for body in ([], {'operations': {}}, {'operations': [{'op': 'add', 'title': ['1984'], 'quantity': 1}]},
+                 {'operations': [{'op': 'remove', 'title': {'a': 1}}]}, {'operations': [], 'discount_code': 5}):
+        assert client.post('/api/cart', json=body).status_code == 400, body
+    assert client.application.cart.is_empty()
+
+def test_cart_api_rejects_changes_to_books_not_in_the_cart(app_context, client):
+    book_id = app.get_book_by_title('1984').book_id
+    available = app.inventory.available(book_id)
+    for operation in ({'op': 'update', 'title': '1984', 'quantity': 100}, {'op': 'remove', 'title': '1984'}):
+        response = client.post('/api/cart', json={'operations': [operation]})
+        assert response.status_code == 400 and 'not in the cart' in response.get_json()['error']
+    # Membership follows the batch: removed then updated is rejected, added then updated is fine
+    response = client.post('/api/cart', json={'operations': [
+        {'op': 'add', 'title': '1984', 'quantity': 1}, {'op': 'remove', 'title': '1984'},
+        {'op': 'update', 'title': '1984', 'quantity': 100}]})
+    assert response.status_code == 400
+    assert app.inventory.available(book_id) == available
+    response = client.post('/api/cart', json={'operations': [
+        {'op': 'add', 'title': '1984', 'quantity': 1}, {'op': 'update', 'title': '1984', 'quantity': 2}]})
+    assert response.get_json()['items'][0]['quantity'] == 2
+    client.post('/clear-cart')
+
+def test_cart_api_batches_on_one_cart_are_serialized(app_context, client, flask_app, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'CART_MAX_QUANTITY', 1000)
+    import threading
+    from models import to_cents
+    with client.session_transaction() as session:
+        cart_id = session['cart_id']
+    book = app.get_book_by_title('I Ching')
+    app.inventory.set_stock(book.book_id, 100000)
+    errors = []
+
+    def shopper():
+        with flask_app.test_client() as shopper_client:
+            with shopper_client.session_transaction() as session:
+                session['user_email'] = 'demo@bookstore.com'
+                session['cart_id'] = cart_id
+            for _ in range(50):
+                response = shopper_client.post('/api/cart', json={'operations': [
+                    {'op': 'add', 'title': 'I Ching', 'quantity': 1}]})
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+
+    try:
+        threads = [threading.Thread(target=shopper) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cart = client.application.cart
+        assert errors == []
+        assert cart.get_total_items() == 200
+        assert cart.get_total_price_cents() == 200 * to_cents(book.price)
+    finally:
+        client.post('/clear-cart')
+        app.inventory.set_stock(book.book_id, flask_app.config['INVENTORY_DEFAULT_STOCK'])
+
+def test_book_grid_fragment_cache(client, monkeypatch):
+    from models import Book, Catalog
+    from caching import FragmentCache
+    catalog = Catalog([Book("Cached Book", "Fiction", 9.99, "/images/cached.jpg")])
+    monkeypatch.setattr('app.catalog', catalog)
+    monkeypatch.setattr('app.book_grid_cache', FragmentCache())
+    assert b'Cached Book' in client.get('/').data
+    assert b'Cached Book' in client.get('/').data
+    assert (app.book_grid_cache.misses, app.book_grid_cache.hits) == (1, 1)
+    catalog.add(Book("New Arrival", "Fiction", 5.99, "/images/new.jpg"))
+    assert b'New Arrival' in client.get('/').data
+    assert app.book_grid_cache.misses == 2
+
+def test_conditional_get(client):
+    response = client.get('/')
+    etag = response.headers['ETag']
+    assert response.status_code == 200
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    client.post('/api/cart', json={'operations': [{'op': 'add', 'title': '1984', 'quantity': 1}]})
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200  # the header's cart count changed
+    book_id = app.get_book_by_title('1984').book_id
+    response = client.get(f'/book/{book_id}')
+    assert response.status_code == 200 and b'1984' in response.data
+    assert client.get(f'/book/{book_id}', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+def test_fingerprinted_static_assets(client, flask_app):
+    import gzip
+    import re
+    html = client.get('/').data.decode()
+    stylesheet = re.search(r'href="(/assets/styles\.[0-9a-f]{12}\.css)"', html).group(1)
+    assert re.search(r'src="/assets/images/books/1984\.[0-9a-f]{12}\.jpg"', html)
+    with open(os.path.join(flask_app.static_folder, 'styles.css'), 'rb') as f:
+        original = f.read()
+
+    response = client.get(stylesheet, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert response.mimetype == 'text/css'
+    assert gzip.decompress(response.data) == original
+
+    response = client.get(stylesheet)
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == original
+    assert client.get('/assets/styles.css').status_code == 404
+
+def test_catalog_search():
+    from models import Book, Catalog
+    catalog = Catalog([
+        Book("The Great Gatsby", "Fiction", 10.99, "/images/1.jpg"),
+        Book("Great Expectations", "Classics", 9.99, "/images/2.jpg"),
+        Book("Moby Dick", "Adventure", 12.49, "/images/3.jpg"),
+    ])
+    assert [book.title for book in catalog.search("great")] == ["The Great Gatsby", "Great Expectations"]
+    assert [book.title for book in catalog.search("GREAT fiction")] == ["The Great Gatsby"]
+    assert catalog.search("great adventure") == []
+    assert [book.title for book in catalog.search("great exp", prefix=True)] == ["Great Expectations"]
+    assert [book.title for book in catalog.search("mo", prefix=True)] == ["Moby Dick"]
+
+    # The index follows the catalog as books come and go
+    catalog.add(Book("Great Apes", "Nature", 15.0, "/images/4.jpg"))
+    catalog.remove(1)
+    assert [book.title for book in catalog.search("great")] == ["Great Expectations", "Great Apes"]
+    assert catalog.search("gatsby") == []
+    assert catalog.search("gats", prefix=True) == []
+
+def test_catalog_search_performance():
+    from models import Book, Catalog
+    genres = ["Fiction", "Mystery", "Science", "History"]
+    catalog = Catalog(Book(f"Volume {i} of the {genres[i % 4]} series", genres[i % 4], 9.99, "/images/book.jpg")
+                      for i in range(100000))
+    assert [book.title for book in catalog.search("volume 99999 history")] == ["Volume 99999 of the History series"]
+    search_time = timeit.timeit(lambda: catalog.search("99999 history"), number=1000)
+    complete_time = timeit.timeit(lambda: catalog.search("mystery 9999", prefix=True, limit=10), number=1000)
+    print(f"Search time: {search_time} seconds, autocomplete time: {complete_time} seconds")
+    assert search_time < 1.0
+    assert complete_time < 1.0
+
+def test_catalog_search_common_terms_performance():
+    from models import Book, Catalog
+    genres = ["Fiction", "Mystery", "Science", "History"]
+    catalog = Catalog(Book(f"Volume {i} of the {genres[i % 4]} series", genres[i % 4], 9.99, "/images/book.jpg")
+                      for i in range(200000))
+    assert [book.title for book in catalog.search("the series", limit=2)] == [
+        "Volume 0 of the Fiction series", "Volume 1 of the Mystery series"]
+    assert [book.book_id for book in catalog.search("fiction volume", limit=3)] == [1, 5, 9]
+    common_time = timeit.timeit(lambda: catalog.search("fiction"), number=1000)
+    pair_time = timeit.timeit(lambda: catalog.search("the series"), number=1000)
+    print(f"Common term time: {common_time} seconds, common pair time: {pair_time} seconds")
+    assert common_time < 0.5
+    assert pair_time < 0.5
+
+def test_search_page_and_autocomplete(client):
+    response = client.get('/search?q=moby')
+    assert response.status_code == 200
+    assert b'Moby Dick' in response.data
+    assert b'The Great Gatsby' not in response.data
+    assert b'No books match' in client.get('/search?q=nonexistent').data
+
+    data = client.get('/search/autocomplete?q=dys').get_json()
+    assert [suggestion['title'] for suggestion in data['suggestions']] == ['1984']
+    assert data['suggestions'][0]['url'] == f"/book/{data['suggestions'][0]['book_id']}"
+    assert client.get('/search/autocomplete?q=').get_json()['suggestions'] == []
+
+def test_benchmark_harness(app_context, client):
+    import benchmark
+    assert benchmark.percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 0.95) == 10
+    assert benchmark.percentile([1, 2, 3, 4], 0.5) == 2
+
+    accounts = benchmark.seed(app, books=0, users=2, orders_per_user=1)
+    assert accounts[0].order_count == 1
+    summary = benchmark.run(app, sessions=4, threads=2, accounts=accounts, checkout_rate=0)
+    assert summary['POST /login']['count'] == 4
+    assert all(stats['errors'] == 0 for stats in summary.values())
+    assert {'p50_ms', 'p95_ms', 'p99_ms', 'requests_per_sec'} <= summary['GET /'].keys()
+
+    baseline = {'GET /': {'p95_ms': 10.0}, 'GET /cart': {'p95_ms': 0.2}}
+    current = {'GET /': {'p95_ms': 14.0}, 'GET /cart': {'p95_ms': 0.5}}
+    assert benchmark.compare(baseline, current, threshold=0.25) == [
+        'GET /: p95 14.00ms > 12.50ms (baseline 10.00ms)']
+
+def test_metrics_endpoint(client):
+    placed_before = app.orders_placed.value()
+    client.get('/')
+    client.post('/add_to_cart', data={'title': 'Moby Dick', 'quantity': '1'})
+    client.post('/process-checkout', data={
+        'name': 'Test User', 'email': 'test@bookstore.com', 'address': 'Test St', 'city': 'Test City',
+        'zip_code': '12345', 'payment_method': 'paypal', 'card_number': '', 'expiry_date': '', 'cvv': ''})
+    assert wait_for_payment(client)['status'] == 'Confirmed'
+    assert app.orders_placed.value() == placed_before + 1
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.data.decode()
+    assert '# TYPE bookstore_request_duration_seconds histogram' in text
+    assert 'bookstore_request_duration_seconds_bucket{endpoint="index",method="GET",le="+Inf"}' in text
+    assert 'bookstore_requests_total{endpoint="add_to_cart",method="POST",status="302"}' in text
+    assert 'bookstore_span_duration_seconds_count{span="payment_gateway"}' in text
+    assert 'bookstore_span_duration_seconds_count{span="pricing_quote"}' in text
+    assert 'bookstore_span_duration_seconds_count{span="render:index.html"}' in text
+    assert 'bookstore_orders_settled_total{status="Confirmed"}' in text
+    assert 'bookstore_requests_in_flight 1' in text  # the /metrics request itself
+
+def test_histogram_overhead():
+    from metrics import MetricsRegistry
+    registry = MetricsRegistry()
+    histogram = registry.histogram('test_seconds', 'Test histogram.', ('endpoint',))
+    for value in (0.0005, 0.003, 0.003, 20.0):
+        histogram.observe(value, 'index')
+    assert histogram.value('index') == (4, pytest.approx(20.0065))
+    lines = registry.render().splitlines()
+    assert 'bookstore_test_seconds_bucket{endpoint="index",le="0.001"} 1' in lines
+    assert 'bookstore_test_seconds_bucket{endpoint="index",le="0.005"} 3' in lines
+    assert 'bookstore_test_seconds_bucket{endpoint="index",le="+Inf"} 4' in lines
+    time = timeit.timeit(lambda: histogram.observe(0.002, 'index'), number=100000)
+    print(f"Histogram observe time: {time} seconds")
+    assert time < 0.5
+
+def test_sampled_request_profiling(client, flask_app):
+    assert client.get('/admin/profiles').status_code == 403
+    flask_app.config.update(PROFILING_ENABLED=True, ADMIN_EMAILS=['Demo@Bookstore.com'])
+    app.request_profiler.sample_rate = 0
+    try:
+        client.get('/search?q=moby')  # not sampled
+        for _ in range(3):
+            assert client.get('/book/1', headers={'X-Profile': '1'}).status_code == 200
+        report = client.get('/admin/profiles?top=5&sort=total').get_json()
+    finally:
+        flask_app.config.update(PROFILING_ENABLED=False, ADMIN_EMAILS=[])
+    assert 'search' not in report['endpoints']
+    book_profiles = report['endpoints']['book_detail']
+    assert book_profiles['requests'] == 3
+    assert len(book_profiles['functions']) == 5
+    times = [function['total_time'] for function in book_profiles['functions']]
+    assert times == sorted(times, reverse=True)
+
+def test_inventory_holds_and_commits():
+    from inventory import Inventory
+    inventory = Inventory(stripes=4, ttl=60)
+    inventory.set_stock(1, 5)
+    inventory.set_stock(2, 1)
+    assert inventory.hold('cart-a', {1: 3}) == {}
+    assert inventory.hold('cart-b', {1: 3, 2: 1}) == {1: 2}  # all or nothing
+    assert inventory.available(2) == 1
+    assert inventory.hold('cart-a', {1: 5}) == {}  # a cart's own hold counts towards its new quantity
+    assert inventory.hold('cart-a', {1: 2}) == {}
+    assert inventory.transfer('cart-a', 'order-a', {1: 2}) == {}
+    assert inventory.held_by('cart-a', 1) == 0
+    assert inventory.commit('order-a', [1]) == 2
+    assert inventory.available(1) == 3
+    assert inventory.available(3) is None  # untracked books never run out
+    assert inventory.hold('cart-a', {3: 1000}) == {}
+
+    # Abandoned cart holds expire and return their stock
+    assert inventory.hold('cart-c', {1: 3}, ttl=0.01) == {}
+    assert inventory.available(1) == 0
+    time.sleep(0.02)
+    assert inventory.available(1) == 3
+
+def test_inventory_prevents_overselling(app_context, client, flask_app):
+    book = app.get_book_by_title('I Ching')
+    app.inventory.set_stock(book.book_id, 1000)
+    held_elsewhere = 1000 - app.inventory.available(book.book_id)  # e.g. carts from other tests
+    app.inventory.set_stock(book.book_id, held_elsewhere + 2)
+    try:
+        response = client.post('/add_to_cart', data={'title': 'I Ching', 'quantity': '3'}, follow_redirects=True)
+        assert b'only 2 left of' in response.data
+        assert client.application.cart.is_empty()
+        response = client.post('/api/cart', json={'operations': [{'op': 'add', 'title': 'I Ching', 'quantity': 2},
+                                                                 {'op': 'add', 'title': 'I Ching', 'quantity': 1}]})
+        assert response.status_code == 409
+        client.post('/add_to_cart', data={'title': 'I Ching', 'quantity': '2'})
+        with flask_app.test_client() as other_client:
+            with other_client.session_transaction() as session:
+                session['user_email'] = 'other@bookstore.com'
+            response = other_client.post('/add_to_cart', data={'title': 'I Ching', 'quantity': '1'}, follow_redirects=True)
+            assert b'is out of stock' in response.data
+        client.post('/process-checkout', data={
+            'name': 'Test User', 'email': 'test@bookstore.com', 'address': 'Test St', 'city': 'Test City',
+            'zip_code': '12345', 'payment_method': 'paypal', 'card_number': '', 'expiry_date': '', 'cvv': ''})
+        assert wait_for_payment(client)['status'] == 'Confirmed'
+        assert app.inventory.available(book.book_id) == 0
+        assert b'Out of stock' in client.get(f'/book/{book.book_id}').data
+    finally:
+        app.inventory.set_stock(book.book_id, flask_app.config['INVENTORY_DEFAULT_STOCK'])
+
+def test_inventory_concurrency_stress():
+    import threading
+    from inventory import Inventory
+    inventory = Inventory(stripes=8, ttl=60)
+    for book_id in range(10):
+        inventory.set_stock(book_id, 50)
+    sold = [0] * 10
+    sold_lock = threading.Lock()
+
+    def shopper(number):
+        for attempt in range(200):
+            book_ids = [(number + attempt) % 10, (number * 7 + attempt) % 10]
+            quantities = {book_id: 1 for book_id in book_ids}
+            cart, order = f'cart-{number}', f'order-{number}-{attempt}'
+            if inventory.hold(cart, quantities) or inventory.transfer(cart, order, quantities):
+                inventory.release(cart, book_ids)
+                continue
+            inventory.commit(order, list(quantities))
+            with sold_lock:
+                for book_id in quantities:
+                    sold[book_id] += 1
+
+    threads = [threading.Thread(target=shopper, args=(number,)) for number in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sold == [50] * 10  # every unit sold exactly once, none oversold
+    assert all(inventory.available(book_id) == 0 for book_id in range(10))
+
+def test_catalog_import_is_incremental(tmp_path):
+    from catalog_import import import_catalog
+    from models import Catalog
+    path = tmp_path / 'books.csv'
+    rows = ['id,title,category,price,image']
+    rows += [f'{i},Title {i},Fiction,{i}.99,/images/books/{i}.jpg' for i in range(1, 301)]
+    rows += ['301,"Comma, Quoted",Poetry,5,/images/books/301.png',
+             '302,Bad Price,Fiction,free,/images/books/302.jpg',
+             '303,Bad Image,Fiction,5,../secrets.txt']
+    path.write_text('\n'.join(rows) + '\n')
+    catalog = Catalog()
+    stats = import_catalog(catalog, str(path), chunk_size=50, workers=2)
+    assert (stats.rows, stats.added, stats.error_count) == (303, 301, 2)
+    assert [line for line, _ in stats.errors] == [303, 304]
+    assert catalog.get_by_title('Comma, Quoted').price == 5.0
+
+    # Re-importing only touches changed rows
+    version = catalog.version
+    rows[10] = '10,Title 10 (2nd edition),Reference,12.50,/images/books/10.jpg'
+    path.write_text('\n'.join(rows) + '\n')
+    stats = import_catalog(catalog, str(path), chunk_size=50, workers=0)
+    assert (stats.added, stats.updated, stats.unchanged) == (0, 1, 300)
+    assert catalog.version != version
+    assert catalog.get(10).title == 'Title 10 (2nd edition)'
+    assert [book.book_id for book in catalog.search('edition')] == [10]
+    assert [book.book_id for book in catalog.by_category('Reference')] == [10]
+    assert catalog.in_price_range(12.5, 12.5)[0].book_id == 10
+
+    version = catalog.version
+    stats = import_catalog(catalog, str(path), workers=0)
+    assert stats.unchanged == 301 and catalog.version == version
+
+def test_catalog_import_cli(tmp_path, monkeypatch, flask_app):
+    from models import Catalog
+    monkeypatch.setattr('app.catalog', Catalog())
+    path = tmp_path / 'books.jsonl'
+    path.write_text('{"title": "Dune", "category": "Science Fiction", "price": 9.99, "image": "/images/books/dune.jpg"}\n'
+                    '\n'
+                    '{"title": "No Price", "category": "Fiction", "image": "/images/books/none.jpg"}\n'
+                    'not json\n')
+    result = flask_app.test_cli_runner().invoke(
+        args=['catalog', 'import', str(path), '--workers', '0', '--no-save'])
+    assert result.exit_code == 0, result.output
+    assert 'rows/s' in result.output
+    assert 'line 3: Invalid price' in result.stderr
+    assert 'line 4: Invalid JSON' in result.stderr
+    assert app.catalog.get_by_title('Dune').category == 'Science Fiction'
+
+def test_sales_ledger_rollups_and_reversals():
+    import datetime
+    from analytics import SalesLedger
+    from models import Book, Cart, Order
+    ledger = SalesLedger(capacity=2)
+    cart = Cart()
+    cart.add_book(Book('Dune', 'Science Fiction', 9.99, '/images/books/dune.jpg', book_id=1), 2)
+    cart.add_book(Book('Emma', 'Fiction', 5.00, '/images/books/emma.jpg', book_id=2), 1)
+    paid = Order('A1', 'a@bookstore.com', cart.get_items(), {}, {}, 24.98)
+    failed = Order('A2', 'b@bookstore.com', cart.get_items(), {}, {}, 24.98)
+    for order in (paid, failed):
+        ledger.record_order(order)
+    ledger.record_order(failed, reverse=True)
+    today = datetime.date.today().isoformat()
+    assert len(ledger) == 6
+    assert ledger.rollup(['category']) == [
+        {'category': 'Science Fiction', 'revenue': 19.98, 'units': 2, 'lines': 1},
+        {'category': 'Fiction', 'revenue': 5.0, 'units': 1, 'lines': 1}]  # the reversed lines cancel out
+    assert ledger.rollup(['day', 'category']) == ledger.query(['day', 'category'])
+    assert ledger.query([]) == [{'revenue': 24.98, 'units': 3, 'lines': 2}]
+    assert ledger.query(['book'], category='Fiction') == [{'book_id': 2, 'revenue': 5.0, 'units': 1, 'lines': 1}]
+    assert ledger.query(['day'], end=datetime.date.today() - datetime.timedelta(days=1)) == []
+    assert ledger.query(['day'], category='Poetry') == []
+    assert ledger.rollup(['day']) == [{'day': today, 'revenue': 24.98, 'units': 3, 'lines': 2}]
+    with pytest.raises(ValueError):
+        ledger.rollup(['book'])
+
+def test_sales_ledger_days_in_half_hour_timezones(monkeypatch):
+    import datetime
+    from analytics import SalesLedger
+    monkeypatch.setenv('TZ', 'Asia/Kolkata')  # UTC+5:30
+    time.tzset()
+    try:
+        midnight = datetime.datetime(2026, 3, 10).timestamp()  # local midnight, half past an hour in UTC
+        timestamps = [int(midnight) - 60, int(midnight) + 60]
+        ledger = SalesLedger()
+        ledger.append([1, 1], ['Fiction', 'Fiction'], [1, 1], [500, 500], timestamps)
+        assert [row['day'] for row in ledger.rollup(['day'])] == ['2026-03-09', '2026-03-10']
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+def test_sales_report_scan_performance():
+    import datetime
+    import numpy as np
+    from analytics import SalesLedger
+    ledger = SalesLedger()
+    rng = np.random.default_rng(7)
+    lines = 1_000_000
+    categories = ['Fiction', 'Science Fiction', 'History', 'Poetry', 'Reference']
+    ledger.append(rng.integers(1, 50000, lines), [categories[i] for i in rng.integers(0, 5, lines)],
+                  rng.integers(1, 4, lines), rng.integers(500, 5000, lines),
+                  int(time.time()) - rng.integers(0, 365 * 86400, lines))
+    start = datetime.date.today() - datetime.timedelta(days=30)
+    time_taken = timeit.timeit(lambda: ledger.query(['day'], start=start, category='History'), number=10) / 10
+    print(f"Sales report scan time over {lines} lines: {time_taken} seconds")
+    assert time_taken < 0.1
+    # The maintained rollups agree with a full scan
+    assert ledger.rollup(['category']) == ledger.query(['category'])
+    assert sum(row['lines'] for row in ledger.rollup(['day'])) == lines
+
+def test_cart_quantities_are_bounded_and_ledger_errors_do_not_fail_checkout(client, monkeypatch):
+    from analytics import SalesLedger
+    response = client.post('/add_to_cart', data={'title': 'Moby Dick', 'quantity': '3000000000'}, follow_redirects=True)
+    assert b'At most 99 copies' in response.data and client.application.cart.is_empty()
+    assert client.post('/api/cart', json={'operations': [
+        {'op': 'add', 'title': 'Moby Dick', 'quantity': 60}, {'op': 'add', 'title': 'Moby Dick', 'quantity': 60}]}
+    ).status_code == 400
+    ledger = SalesLedger()
+    monkeypatch.setattr('app.sales_ledger', ledger)
+    monkeypatch.setattr(ledger, 'record_order', lambda order, reverse=False: 1 / 0)
+    client.post('/add_to_cart', data={'title': 'Moby Dick', 'quantity': '1'}, follow_redirects=True)
+    response = client.post('/process-checkout', data={
+        'name': 'Test User', 'email': 'test@bookstore.com', 'address': 'Test St', 'city': 'Test City',
+        'zip_code': '12345', 'payment_method': 'paypal', 'card_number': '', 'expiry_date': '', 'cvv': ''})
+    assert response.status_code == 302
+    assert wait_for_payment(client)['status'] == 'Confirmed'
+
+def test_sales_ledger_holds_large_quantities():
+    from analytics import SalesLedger
+    ledger = SalesLedger()
+    ledger.append([1], ['Fiction'], [3_000_000_000], [100], [int(time.time())])
+    assert ledger.query([])[0]['units'] == 3_000_000_000
+
+def test_admin_sales_report(client, monkeypatch, flask_app):
+    from analytics import SalesLedger
+    monkeypatch.setattr('app.sales_ledger', SalesLedger())
+    assert client.get('/admin/reports/sales').status_code == 403
+    client.post('/add_to_cart', data={'title': '1984', 'quantity': '2'}, follow_redirects=True)
+    client.post('/process-checkout', data={
+        'name': 'Test User', 'email': 'test@bookstore.com', 'address': 'Test St', 'city': 'Test City',
+        'zip_code': '12345', 'payment_method': 'credit_card', 'card_number': '1234567890121111',
+        'expiry_date': '12/25', 'cvv': '123'}, follow_redirects=True)
+    assert wait_for_payment(client)['status'] == 'Payment Failed'
+    client.post('/remove-from-cart', data={'title': '1984'}, follow_redirects=True)
+    client.post('/add_to_cart', data={'title': 'Moby Dick', 'quantity': '1'}, follow_redirects=True)
+    client.post('/process-checkout', data={
+        'name': 'Test User', 'email': 'test@bookstore.com', 'address': 'Test St', 'city': 'Test City',
+        'zip_code': '12345', 'payment_method': 'paypal', 'card_number': '', 'expiry_date': '', 'cvv': ''},
+        follow_redirects=True)
+    assert wait_for_payment(client)['status'] == 'Confirmed'
+
+    monkeypatch.setitem(flask_app.config, 'ADMIN_EMAILS', ['demo@bookstore.com'])
+    report = client.get('/admin/reports/sales?group_by=category').get_json()
+    assert report['source'] == 'rollup'
+    assert report['lines_total'] == 3  # the failed order and its reversal, then the paid one
+    revenue = {row['category']: (row['revenue'], row['units']) for row in report['rows']}
+    assert revenue == {'Dystopia': (0.0, 0), 'Adventure': (12.49, 1)}
+    report = client.get('/admin/reports/sales?group_by=book&category=Adventure').get_json()
+    assert report['source'] == 'scan'
+    assert [row['book_id'] for row in report['rows']] == [app.get_book_by_title('Moby Dick').book_id]
+    assert client.get('/admin/reports/sales?group_by=week').status_code == 400
+    assert client.get('/admin/reports/sales?start=yesterday').status_code == 400
+
+def test_order_export_streams_with_cursors(client, monkeypatch, tmp_path, flask_app):
+    import csv
+    import datetime
+    import gzip
+    import io
+    import json
+    import tracemalloc
+    from models import Book, CartItem, Order
+    from order_store import OrderStore
+    store = OrderStore(str(tmp_path), archive_after=3600, block_size=16)
+    book = Book("Ledger", "Reference", 4.50, "/images/ledger.jpg")
+    first_day = datetime.datetime(2026, 1, 1, 9, 30)
+    for i in range(4000):
+        order = Order(f"EX{i:05d}", "finance@bookstore.com", [CartItem(book, 1 + i % 3)], {}, {'method': 'paypal'},
+                      4.50 * (1 + i % 3), status='Payment Failed' if i % 10 == 0 else 'Confirmed')
+        order.order_date = first_day + datetime.timedelta(minutes=i * 7)  # about 20 days of orders
+        store.add(order)
+        if i % 1000 == 999 and i < 3000:
+            store.archive(now=datetime.datetime(2027, 1, 1))  # several segments plus a hot tier
+    assert store.hot_count == 1000
+    monkeypatch.setattr(flask_app.extensions['bookstore'], 'orders', store)
+    assert client.get('/admin/orders/export').status_code == 403
+    monkeypatch.setitem(flask_app.config, 'ADMIN_EMAILS', ['demo@bookstore.com'])
+
+    def export_peak_memory(url):
+        tracemalloc.start()
+        response = client.get(url, headers={'Accept-Encoding': 'gzip'}, buffered=False)
+        body = b''.join(response.response)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return response, body, peak
+
+    # Everything, gzipped on the fly, in no more memory than a short export
+    response, compressed, peak = export_peak_memory('/admin/orders/export')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert peak < 1.5 * export_peak_memory('/admin/orders/export?limit=200')[2]
+    data = gzip.decompress(compressed).decode()
+    rows = list(csv.DictReader(io.StringIO(data)))
+    assert [row['order_id'] for row in rows] == [f"EX{i:05d}" for i in range(4000)]
+    assert rows[1]['items'] == 'Ledger x2' and rows[1]['total_amount'] == '9.00'
+
+    # Paged with a limit, then resumed from the last cursor
+    first = client.get('/admin/orders/export?format=jsonl&status=Confirmed&start=2026-01-03&end=2026-01-05&limit=100')
+    assert 'gzip' not in first.headers.get('Content-Encoding', '')
+    page = [json.loads(line) for line in first.data.decode().splitlines()]
+    assert len(page) == 100 and {order['status'] for order in page} == {'Confirmed'}
+    assert page[0]['order_date'].startswith('2026-01-03')
+    rest = client.get(f"/admin/orders/export?format=jsonl&status=Confirmed&end=2026-01-05&cursor={page[-1]['cursor']}")
+    resumed = [json.loads(line) for line in rest.data.decode().splitlines()]
+    assert resumed[0]['order_id'] > page[-1]['order_id']
+    assert all(order['order_date'][:10] <= '2026-01-05' for order in resumed)
+    expected = [row['order_id'] for row in rows if row['status'] == 'Confirmed'
+                and '2026-01-03' <= row['order_date'][:10] <= '2026-01-05']
+    assert [order['order_id'] for order in page + resumed] == expected
+
+    # Resumed CSV has no header, so it can be appended to a partial download
+    resumed_csv = client.get(f"/admin/orders/export?cursor={rows[-2]['cursor']}").data.decode()
+    assert resumed_csv.startswith('EX03999,')
+    assert client.get('/admin/orders/export?cursor=bogus').status_code == 400
+    assert client.get('/admin/orders/export?format=xml').status_code == 400
+
+def test_order_export_streams_from_a_factory_app(tmp_path):
+    import json
+    from models import Book, CartItem, Order, User
+    fresh = app.create_app({'TESTING': True, 'ADMIN_EMAILS': ['finance@bookstore.com'],
+                            'ORDER_LOG_PATH': str(tmp_path / 'orders.log'),
+                            'ORDER_ARCHIVE_DIR': str(tmp_path / 'order-segments'),
+                            'STATIC_BUILD_DIR': str(tmp_path / 'static-build'),
+                            'CATALOG_PATH': str(tmp_path / 'catalog.jsonl'), 'CATALOG_SNAPSHOT_PATH': None})
+    book = Book("Ledger", "Reference", 4.50, "/images/ledger.jpg")
+    with fresh.app_context():
+        fresh.extensions['bookstore'].users.add(User("finance@bookstore.com", None))
+        for i in range(3):
+            fresh.extensions['bookstore'].orders.add(
+                Order(f"FX{i}", "finance@bookstore.com", [CartItem(book, 1)], {}, {'method': 'paypal'}, 4.50))
+    # No app context is active here, as in production
+    client = fresh.test_client()
+    with client.session_transaction() as session:
+        session['user_email'] = 'finance@bookstore.com'
+    response = client.get('/admin/orders/export?format=jsonl', buffered=False)
+    lines = b''.join(response.response).decode().splitlines()
+    assert [json.loads(line)['order_id'] for line in lines] == ['FX0', 'FX1', 'FX2']
+
+def test_admin_routes_require_a_registered_admin(client, monkeypatch, flask_app):
+    monkeypatch.setitem(flask_app.config, 'ADMIN_EMAILS', ['demo@bookstore.com', 'ghost@bookstore.com'])
+    assert client.get('/admin/reports/sales').status_code == 200
+    with client.session_transaction() as session:
+        session['user_email'] = 'ghost@bookstore.com'  # listed, but no such account
+    assert client.get('/admin/reports/sales').status_code == 403
+    assert client.get('/admin/orders/export?format=jsonl').status_code == 403
+
+def test_import_time_and_lazy_subsystems(tmp_path):
+    import subprocess
+    import sys
+    script = ('import time\n'
+              'started = time.perf_counter()\n'
+              'import app\n'
+              'print(time.perf_counter() - started)\n'
+              "print(sorted(app.app.extensions['bookstore'].built()))\n")
+    env = dict(os.environ, ORDER_LOG_PATH=str(tmp_path / 'orders.log'), ORDER_ARCHIVE_DIR=str(tmp_path / 'segments'))
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, env=env,
+                            cwd=os.path.dirname(app.__file__), check=True)
+    import_time, built = result.stdout.split('\n')[:2]
+    print(f"App import time: {import_time} seconds")
+    assert built == '[]'  # nothing is loaded, hashed or opened at import
+    assert float(import_time) < 2.0
+    assert not os.path.exists(tmp_path / 'orders.log')
+
+    # A new app builds each subsystem only when a request first needs it
+    fresh = app.create_app({'TESTING': True, 'CATALOG_SNAPSHOT_PATH': None,
+                            'STATIC_BUILD_DIR': str(tmp_path / 'static-build'),
+                            'CATALOG_PATH': str(tmp_path / 'catalog.jsonl')})
+    services = fresh.extensions['bookstore']
+    assert services.built() == set()
+    assert fresh.test_client().get('/search/autocomplete?q=mob').get_json()['suggestions'][0]['title'] == 'Moby Dick'
+    assert services.built() == {'catalog'}
+
+def test_apps_keep_their_own_password_hashing(tmp_path):
+    apps = [app.create_app({'TESTING': True, 'CATALOG_SNAPSHOT_PATH': None, 'PASSWORD_HASH_WORKERS': 0,
+                            'PASSWORD_HASH_METHOD': f'pbkdf2:sha256:{iterations}',
+                            'CATALOG_PATH': str(tmp_path / 'catalog.jsonl')})
+            for iterations in (1000, 2000)]
+    stores = [flask_app.extensions['bookstore'].users for flask_app in apps]
+    for flask_app in apps:
+        flask_app.test_client().post('/register', data={
+            'email': 'tenant@bookstore.com', 'password': 'secret', 'name': 'Tenant', 'address': '1 Tenant St'})
+    for iterations, store in zip((1000, 2000), stores):
+        assert store.get('demo@bookstore.com').password_hash.startswith(f'pbkdf2:sha256:{iterations}$')
+        assert store.get('tenant@bookstore.com').password_hash.startswith(f'pbkdf2:sha256:{iterations}$')
+
+def test_catalog_warm_start_from_snapshot(tmp_path):
+    import json
+    path = tmp_path / 'catalog.jsonl'
+    with open(path, 'w') as f:
+        for i in range(20000):
+            f.write(json.dumps({'title': f'Volume {i}', 'category': f'Shelf {i % 50}', 'price': 5 + i % 30,
+                                'image': '/images/books/1984.jpg'}) + '\n')
+    config = {'TESTING': True, 'CATALOG_PATH': str(path), 'CATALOG_IMPORT_WORKERS': 0,
+              'CATALOG_SNAPSHOT_PATH': str(tmp_path / 'catalog.snapshot')}
+
+    def load_catalog():
+        worker = app.create_app(config)
+        services = worker.extensions['bookstore']
+        started = time.perf_counter()
+        with worker.app_context():
+            catalog = services.catalog
+        return catalog, services.catalog_source, time.perf_counter() - started
+
+    cold, source, cold_time = load_catalog()
+    assert source == 'source' and len(cold) == 20004
+    warm, source, warm_time = load_catalog()
+    print(f"Catalog cold start: {cold_time} seconds, warm start from snapshot: {warm_time} seconds")
+    assert source == 'snapshot'
+    assert warm_time < cold_time / 2
+    assert [book.book_id for book in warm.search('volume 1234')] == [book.book_id for book in cold.search('volume 1234')]
+    assert warm.get_by_title('Moby Dick').book_id == cold.get_by_title('Moby Dick').book_id
+    assert warm.version != cold.version
+
+    # Changing the source file makes the snapshot stale
+    with open(path, 'a') as f:
+        f.write(json.dumps({'title': 'Late Addition', 'category': 'Shelf 1', 'price': 9,
+                            'image': '/images/books/1984.jpg'}) + '\n')
+    rebuilt, source, _ = load_catalog()
+    assert source == 'source' and 'Late Addition' in rebuilt
+
+def test_co_purchase_index_counts_and_refreshes():
+    from recommendations import CoPurchaseIndex
+    index = CoPurchaseIndex(k=2, refresh_interval=0.01)
+    index.record([1, 2, 3])
+    index.record([1, 2])
+    index.record([1, 4, 4])
+    index.record([5])
+    assert index.neighbors(1) == ()  # nothing is published before a refresh
+    assert index.refresh() == 4
+    assert index.version == 1
+    assert index.neighbors(1) == ((2, 2), (3, 1))  # top 2 only, ties broken by id
+    assert index.neighbors(4) == ((1, 1),)
+    assert index.neighbors(5) == ()
+    assert index.recommend([2, 3]) == [1]
+    assert index.recommend([1], limit=1) == [2]
+    assert index.refresh() == 0 and index.version == 1
+
+    index.start()
+    try:
+        index.record([3, 4])
+        deadline = time.time() + 5
+        while index.version == 1 and time.time() < deadline:
+            time.sleep(0.01)
+        assert index.neighbors(4) == ((1, 1), (3, 1))
+    finally:
+        index.stop()
+
+def test_co_purchase_recommendation_performance():
+    import random
+    from recommendations import CoPurchaseIndex
+    rng = random.Random(7)
+    index = CoPurchaseIndex(k=10)
+    record_time = timeit.timeit(lambda: index.record(rng.sample(range(5000), 4)), number=20000)
+    refresh_time = timeit.timeit(index.refresh, number=1)
+    recommend_time = timeit.timeit(lambda: index.recommend([1, 2, 3], limit=4), number=10000)
+    print(f"Co-purchase record: {record_time / 20000 * 1e6} us, refresh: {refresh_time} s, "
+          f"recommend: {recommend_time / 10000 * 1e6} us")
+    assert len(index.recommend([1, 2, 3], limit=4)) == 4
+    assert record_time / 20000 < 0.0005
+    assert recommend_time / 10000 < 0.0005
+
+def test_customers_also_bought(client, monkeypatch):
+    from recommendations import CoPurchaseIndex
+    index = CoPurchaseIndex()
+    monkeypatch.setattr('app.co_purchases', index)
+    # A failed payment is not a purchase, so I Ching is never recommended with 1984
+    client.post('/add_to_cart', data={'title': '1984', 'quantity': '1'}, follow_redirects=True)
+    client.post('/add_to_cart', data={'title': 'I Ching', 'quantity': '1'}, follow_redirects=True)
+    client.post('/process-checkout', data={
+        'name': 'Test User', 'email': 'test@bookstore.com', 'address': 'Test St', 'city': 'Test City',
+        'zip_code': '12345', 'payment_method': 'credit_card', 'card_number': '1234567890121111',
+        'expiry_date': '12/25', 'cvv': '123'}, follow_redirects=True)
+    assert wait_for_payment(client)['status'] == 'Payment Failed'
+    client.post('/clear-cart')
+
+    client.post('/add_to_cart', data={'title': '1984', 'quantity': '1'}, follow_redirects=True)
+    client.post('/add_to_cart', data={'title': 'Moby Dick', 'quantity': '1'}, follow_redirects=True)
+    client.post('/process-checkout', data={
+        'name': 'Test User', 'email': 'test@bookstore.com', 'address': 'Test St', 'city': 'Test City',
+        'zip_code': '12345', 'payment_method': 'paypal', 'card_number': '', 'expiry_date': '', 'cvv': ''},
+        follow_redirects=True)
+    assert wait_for_payment(client)['status'] == 'Confirmed'
+
+    client.post('/add_to_cart', data={'title': '1984', 'quantity': '1'}, follow_redirects=True)
+    assert 'Customers also bought' not in client.get('/cart').get_data(as_text=True)  # not refreshed yet
+    before = client.get('/', query_string={'stream': '0'})
+    index.refresh()
+    for path in ('/cart', '/?stream=0', '/?stream=1'):
+        soup = BeautifulSoup(client.get(path).data, 'html.parser')
+        section = soup.find('div', class_='recommendations')
+        assert section is not None, path
+        assert [a.get_text() for a in section.find_all('a')] == ['Moby Dick']
+    # Published recommendations change the index page's ETag
+    assert client.get('/', query_string={'stream': '0'}, headers={'If-None-Match': before.headers['ETag']}).status_code == 200